@@ -27,11 +27,15 @@ VSP_UUID = b'\x7c\x16\xa5\x5e\xba\x11\xcb\x92\x0c\x49\x7f\xb8\x01\x11\x9a\x56'
 
 verbose = False
 
+# An AD line from the dongle (data is the advertisement and scan response)
+ScanResult = namedtuple("ScanResult", "address rssi data")
+
 
 class AdvParser:
     """ Parse BT510 advertisements """
 
     def __init__(self, buf):
+        """ buf is the advertisement as bytes or as a hex string """
         self.rx_epoch = int(time.time())
         self.logger = logging.getLogger(__file__)
         self.adv = tuple()
@@ -39,14 +43,19 @@ class AdvParser:
         self.flags_dict = dict()
         self.bd_addr = ""
         self.name = ""
+        # Set from the scan result (parse_scan)
+        self.rssi = 0
         self.adv_valid = False
         self.rsp_valid = False
         self.rsp_has_versions = False
-        if (len(buf) % 2) == 0:
+        if isinstance(buf, bytes):
+            b = buf
+        elif (len(buf) % 2) == 0:
             b = bytes.fromhex(buf)
         else:
             b = bytes()
-        self.logger.debug(f"Advertisement Length {len(buf)} -> {len(b)}")
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(f"Advertisement Length {len(buf)} -> {len(b)}")
         try:
             self.adv = namedtuple("adv", FOB_ADV_FIELDS)._make(
                 struct.unpack_from(FOB_ADV_FORMAT, b))
@@ -133,6 +142,30 @@ class AdvParser:
             return "0.0"
 
 
+def parse_scan(ad):
+    """
+    Parse the advertisement in a ScanResult (or an AD line from the dongle).
+    Returns None on error.
+    """
+    if ad is None:
+        return None
+    if isinstance(ad, ScanResult):
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("%s %s \"%s\"", ad.address, ad.rssi, ad.data.hex().upper())
+        ap = AdvParser(ad.data)
+        ap.rssi = ad.rssi
+        return ap
+    try:
+        junk, address, rssi, ad_rsp = ad.split(' ')
+        logging.debug("%s %s %s", address, rssi, ad_rsp)
+        ap = AdvParser(ad_rsp.strip('"'))
+        ap.rssi = int(rssi)
+        return ap
+    except:
+        logging.debug("unable to process advertisement")
+        return None
+
+
 if __name__ == "__main__":
     import log_wrapper
     log_wrapper.setup(__file__, console_level=logging.DEBUG)
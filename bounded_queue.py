@@ -0,0 +1,135 @@
+
+"""
+Queue with a maximum size and a policy for what happens when it is full.
+
+block - put waits for space (queue.Queue behaviour)
+drop_oldest - the oldest item is discarded
+coalesce - an item replaces a queued item with the same key (only the latest
+           advertisement of each sensor is queued); when the queue is full the
+           oldest item is discarded
+coalesce_duplicates - an item replaces a queued item with the same duplicate key
+           (the same advertisement received again); when the queue is full the
+           oldest item is discarded
+
+Dropped and coalesced items are counted (and are done for join()).
+"""
+
+import queue
+from collections import deque, OrderedDict
+
+BLOCK = "block"
+DROP_OLDEST = "drop_oldest"
+COALESCE = "coalesce"
+COALESCE_DUPLICATES = "coalesce_duplicates"
+POLICIES = (BLOCK, DROP_OLDEST, COALESCE, COALESCE_DUPLICATES)
+KEYED_POLICIES = (COALESCE, COALESCE_DUPLICATES)
+
+
+def ad_key(ad) -> str:
+    """ Key of a ScanResult from the dongle (the sensor) """
+    return ad.address
+
+
+def ad_duplicate_key(ad) -> tuple:
+    """
+    Duplicate key of a ScanResult. A sensor repeats an advertisement until its
+    next event (the RSSI can differ).
+    """
+    return (ad.address, ad.data)
+
+
+class BoundedQueue(queue.Queue):
+    def __init__(self, maxsize=0, policy=BLOCK, key=None, duplicate_key=None):
+        self._check(policy, key, duplicate_key)
+        self.policy = policy
+        self.key = key
+        self.duplicate_key = duplicate_key
+        self.dropped = 0
+        self.coalesced = 0
+        super().__init__(maxsize)
+
+    @staticmethod
+    def _check(policy: str, key, duplicate_key) -> None:
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown queue policy {policy}")
+        if policy == COALESCE and key is None:
+            raise ValueError("coalesce policy requires a key function")
+        if policy == COALESCE_DUPLICATES and duplicate_key is None:
+            raise ValueError("coalesce_duplicates policy requires a duplicate key function")
+
+    def configure(self, maxsize: int, policy: str, key=None, duplicate_key=None) -> None:
+        """ Change the size and policy (the queued items are kept unless they are coalesced) """
+        self._check(policy, key or self.key, duplicate_key or self.duplicate_key)
+        with self.mutex:
+            items = list(self.queue.values()) if self.policy in KEYED_POLICIES else list(self.queue)
+            self.policy = policy
+            self.key = key or self.key
+            self.duplicate_key = duplicate_key or self.duplicate_key
+            self.maxsize = maxsize
+            self._init(maxsize)
+            for item in items:
+                self._put(item)
+            self._done(len(items) - self._qsize())
+            self.not_full.notify_all()
+
+    def _init(self, maxsize):
+        self.queue = OrderedDict() if self.policy in KEYED_POLICIES else deque()
+
+    def _key(self, item):
+        return self.key(item) if self.policy == COALESCE else self.duplicate_key(item)
+
+    def _put(self, item):
+        if self.policy in KEYED_POLICIES:
+            k = self._key(item)
+            if k in self.queue:
+                self.coalesced += 1
+            # A sensor keeps its place in the queue
+            self.queue[k] = item
+        else:
+            self.queue.append(item)
+
+    def _get(self):
+        if self.policy in KEYED_POLICIES:
+            return self.queue.popitem(last=False)[1]
+        return self.queue.popleft()
+
+    def _done(self, count: int) -> None:
+        """ Items that were discarded won't be marked done by a consumer (called with the mutex) """
+        if count > 0:
+            self.unfinished_tasks -= count
+            if self.unfinished_tasks == 0:
+                self.all_tasks_done.notify_all()
+
+    def put(self, item, block=True, timeout=None):
+        if self.policy == BLOCK or self.maxsize <= 0:
+            return super().put(item, block, timeout)
+        with self.not_full:
+            self.unfinished_tasks += 1
+            if self.policy in KEYED_POLICIES and self._key(item) in self.queue:
+                # The replaced item is done
+                self._put(item)
+                self._done(1)
+            else:
+                dropped = 0
+                while self._qsize() >= self.maxsize:
+                    self._get()
+                    dropped += 1
+                self.dropped += dropped
+                self._done(dropped)
+                self._put(item)
+            self.not_empty.notify()
+
+    def stats(self) -> dict:
+        with self.mutex:
+            return {"size": self._qsize(), "maxsize": self.maxsize, "policy": self.policy,
+                    "dropped": self.dropped, "coalesced": self.coalesced}
+
+
+if __name__ == "__main__":
+    from adv_parser import ScanResult
+    q = BoundedQueue(4, COALESCE, ad_key)
+    for n in range(10):
+        q.put(ScanResult(f"01C0FFEE00000{n % 4}", -60 - n, b'\x00'))
+    print(q.stats())
+    while not q.empty():
+        print(q.get())
@@ -0,0 +1,412 @@
+
+"""
+Single command line entry point for the BT510 scripts.
+
+python bt510.py scan [--dump]
+python bt510.py report
+python bt510.py read-logs
+python bt510.py config
+python bt510.py set-epoch
+python bt510.py cloudwatch
+
+The configuration file is parsed once and the dongle is initialized once.
+Only the modules needed by a subcommand are imported (pyserial, bitstruct,
+boto3, etc.) so that short cron jobs start quickly.
+"""
+
+import sys
+import time
+import logging
+import argparse
+from contextlib import contextmanager
+import log_wrapper
+from json_config import JsonConfig
+
+NAMESPACE = "Client/Application"
+
+
+@contextmanager
+def open_store(args):
+    """
+    The event store (--store) or None. Rollups are kept current as events are stored.
+    Queued advertisements are written when the command ends (or is interrupted).
+    """
+    if not args.store:
+        yield None
+        return
+    from event_store import EventStore
+    from rollups import RollupEngine
+    with EventStore(args.store) as store:
+        RollupEngine(store)
+        yield store
+
+
+def open_inventory(jc: JsonConfig, args):
+    """ Expected sensors (--inventory or the inventory configuration key) or None """
+    import inventory
+    return inventory.open_inventory(jc.config, args.inventory)
+
+
+@contextmanager
+def open_history(jc: JsonConfig):
+    """
+    Recent samples of each sensor (--history or event_history_samples) or None.
+    The last hour of each sensor is summarized when the command ends.
+    """
+    import event_history
+    history = event_history.open_history(jc.config)
+    try:
+        yield history
+    finally:
+        if history is not None:
+            history.log_summary()
+
+
+@contextmanager
+def open_ad_writer(args):
+    """ Columnar advertisement export (--parquet) or None """
+    if not args.parquet:
+        yield None
+        return
+    from columnar_export import AdvertisementWriter
+    with AdvertisementWriter(args.parquet) as writer:
+        yield writer
+
+
+@contextmanager
+def open_dongle(jc: JsonConfig):
+    """ Open and initialize the BL65x dongle, yields (bt_module, jtester) """
+    import serial
+    import serial.threaded
+    from functools import partial
+    from dongle import BL65x
+    from json_commander import jtester
+    ser = serial.serial_for_url(url=jc.get_port(), baudrate=jc.get_baudrate(),
+                                timeout=1, rtscts=True)
+    with serial.threaded.ReaderThread(ser, partial(BL65x, config=jc.config)) as bt_module:
+        jt = jtester(config=jc.config)
+        jt.set_protocol(bt_module)
+        telemetry = None
+        if jc.get_optional("session_telemetry_file"):
+            from session_telemetry import SessionTelemetry
+            telemetry = SessionTelemetry(jc.get_optional("session_telemetry_file"))
+            bt_module.set_telemetry(telemetry)
+            jt.set_telemetry(telemetry)
+        bt_module.secondary_initialization()
+        try:
+            yield bt_module, jt
+        finally:
+            if telemetry is not None:
+                telemetry.log_summary()
+                telemetry.close()
+            stats = bt_module.queue_stats()
+            if any(q["dropped"] for q in stats.values()):
+                logging.info(f"Queues {stats}")
+            else:
+                logging.debug(f"Queues {stats}")
+            for (link, table) in (("AT", bt_module.rtt), ("JSON", jt.rtt)):
+                for (key, (srtt, rttvar, timeout, samples, timeouts)) in table.stats().items():
+                    if samples:
+                        logging.debug(f"{link} {key} srtt {srtt:.3f} rttvar {rttvar:.3f} "
+                                      f"timeout {timeout:.3f} samples {samples} timeouts {timeouts}")
+
+
+def parse_scan(ad: str):
+    """ Split an AD line from the dongle and parse the advertisement """
+    from adv_parser import parse_scan
+    return parse_scan(ad)
+
+
+def for_each_new_sensor(bt_module, name_to_look_for: str, count, action, description: str,
+                        select=None, duration=None, profile=None, inventory=None) -> None:
+    """
+    Connect to each new sensor whose name matches and call action(ap).
+    Stops after count sensors (runs indefinitely when count is None),
+    after duration seconds or when every sensor in the inventory had a session.
+    select(ap) can skip sensors that don't need a connection (yet).
+    profile is the connection profile used for the sessions.
+    """
+    from session_runner import SessionRunner
+    runner = SessionRunner(bt_module, name_to_look_for, select, profile=profile, inventory=inventory)
+    runner.run(action, count, duration, description)
+
+
+def cmd_scan(jc: JsonConfig, args) -> None:
+    """ Print events from sensors, optionally dumping the attributes of new sensors """
+    from sensor_event import SensorEvent
+    name_to_look_for = args.name or jc.get("system_name_to_look_for")
+    with open_store(args) as store, open_history(jc) as history, \
+            open_dongle(jc) as (bt_module, jt), open_ad_writer(args) as ad_writer:
+        bt_module.scan(nameMatch=name_to_look_for)
+        event_dict = dict()
+        while True:
+            ap = parse_scan(bt_module.get_scan(timeout=None))
+            if ap is None or not ap.adv_valid:
+                continue
+            if ad_writer is not None:
+                ad_writer.add(ap, ap.rssi)
+            if ap.bd_addr not in event_dict:
+                logging.info(
+                    f'Found new sensor "{ap.name}" with BDA: {ap.bd_addr}')
+                event_dict[ap.bd_addr] = SensorEvent(history=history)
+                if ap.rsp_valid:
+                    logging.info(ap.rsp)
+                if args.dump:
+                    bt_module.cancel_scan()
+                    bt_module.connect(ap.get_at_bd_addr(),
+                                      bt_module.connection_timeout, args.profile or "quick")
+                    if bt_module.vspConnection:
+                        jt.SetSensor(ap)
+                        jt.Dump()
+                        bt_module.disconnect()
+                    else:
+                        logging.debug('Unable to connect')
+                    bt_module.scan(nameMatch=name_to_look_for)
+
+            if event_dict[ap.bd_addr].update(ap):
+                logging.info(ap.name)
+                logging.info(event_dict[ap.bd_addr].__dict__)
+                if store is not None:
+                    store.ingest_advertisement(ap)
+
+
+def cmd_report(jc: JsonConfig, args) -> None:
+    """ Scan for advertisements and generate report of BT510s """
+    from system_report import SystemReport, scan_report
+    name_to_look_for = args.name or jc.get("system_name_to_look_for")
+    duration = args.duration or jc.get("system_report_scan_duration_seconds")
+    idle = args.idle or jc.get_optional("system_report_idle_seconds")
+    report = SystemReport("logs/" + name_to_look_for + ".system_report.log", args.xlsx)
+    inventory = open_inventory(jc, args)
+    with open_dongle(jc) as (bt_module, jt):
+        try:
+            scan_report(bt_module, name_to_look_for, duration, report, idle, inventory)
+        finally:
+            report.close()
+        logging.info("System Report Complete")
+
+
+def cmd_read_logs(jc: JsonConfig, args) -> None:
+    """ Read the event log of each sensor, write it to a file and then set the epoch """
+    from log_download import LogDownloader
+    name_to_look_for = args.name or jc.get("name_to_look_for")
+    inventory = open_inventory(jc, args)
+    count = args.count or (None if inventory else jc.get("number_of_devices_to_look_for"))
+    with open_store(args) as store, open_dongle(jc) as (bt_module, jt):
+        downloader = LogDownloader(jt)
+
+        def read_log(ap):
+            # Each chunk is stored before it is acked (resumes after a lost connection)
+            start = downloader.size(ap.bd_addr)
+            downloader.download(ap.bd_addr)
+            downloader.export(ap.bd_addr, ap.name)
+            if store is not None:
+                store.set_name(ap.bd_addr, ap.name)
+                store.ingest_log(ap.bd_addr, downloader.events(ap.bd_addr, start))
+            jt.SetEpoch(int(time.time()))
+            jt.LogResults()
+
+        for_each_new_sensor(bt_module, name_to_look_for, count,
+                            read_log, "Preparing to read logs", duration=args.duration,
+                            profile=args.profile or "bulk", inventory=inventory)
+        logging.debug("Log Read")
+
+
+def cmd_config(jc: JsonConfig, args) -> None:
+    """
+    Configure sensors using default_sensor_configuration.json.
+    Sensors that already have the configuration (configVersion in the scan response)
+    aren't connected to and only attributes that differ are written.
+    """
+    from sensor_config import sensor_config
+    from config_engine import ConfigEngine
+    config = sensor_config(args.file)
+    if not args.no_prompt:
+        config.ask_user_for_changes()
+    engine = ConfigEngine(config.get_kwargs())
+    inventory = open_inventory(jc, args)
+    with open_dongle(jc) as (bt_module, jt):
+        def configure(ap):
+            jt.SetEpoch(int(time.time()))
+            engine.apply(jt, ap)
+            jt.LogResults()
+
+        for_each_new_sensor(bt_module, args.name, args.count,
+                            configure, "Preparing to configure new device",
+                            None if args.all else engine.needs_config, profile=args.profile or "quick",
+                            inventory=inventory)
+
+
+def cmd_set_epoch(jc: JsonConfig, args) -> None:
+    """
+    Connect to sensors and set their clock.
+    Unless --force is used, only sensors whose clock offset (estimated from their
+    advertisements) is beyond the threshold or whose time was never set are connected to.
+    """
+    name_to_look_for = args.name or jc.get("name_to_look_for")
+    inventory = open_inventory(jc, args)
+    count = args.count or (None if inventory else jc.get("number_of_devices_to_look_for"))
+    select = None
+    duration = None
+    if not args.force:
+        from clock_drift import ClockDriftEstimator, DRIFT_THRESHOLD_SECONDS
+        estimator = ClockDriftEstimator(args.threshold or jc.get_optional(
+            "clock_drift_threshold_seconds", DRIFT_THRESHOLD_SECONDS))
+        duration = args.duration
+
+        def select(ap):
+            estimator.update(ap)
+            if not estimator.needs_sync(ap.bd_addr):
+                return False
+            logging.info(f"{ap.bd_addr} clock offset {estimator.offset(ap.bd_addr)} s "
+                         f"time_was_set {ap.flags_dict.get('time_was_set')}")
+            return True
+
+    with open_dongle(jc) as (bt_module, jt):
+        def set_epoch(ap):
+            jt.SetEpoch(int(time.time()))
+            jt.LogResults()
+            if not args.force:
+                estimator.synced(ap.bd_addr)
+
+        for_each_new_sensor(bt_module, name_to_look_for, count,
+                            set_epoch, "Preparing to set Epoch", select, duration,
+                            args.profile or "quick", inventory)
+    if not args.force:
+        # Sensors that didn't need setEpoch
+        estimator.log_summary()
+
+
+def cmd_cloudwatch(jc: JsonConfig, args) -> None:
+    """ Send BT510 event data to AWS CloudWatch """
+    import boto3
+    import metrics
+    from sensor_event import SensorEvent
+    name_to_look_for = args.name or jc.get("system_name_to_look_for")
+    with open_store(args) as store, open_history(jc) as history, open_dongle(jc) as (bt_module, jt):
+        cloudwatch = boto3.client('cloudwatch')
+        bt_module.scan(nameMatch=name_to_look_for)
+        event_dict = dict()
+        while True:
+            ap = parse_scan(bt_module.get_scan(timeout=None))
+            if ap is None or not ap.adv_valid:
+                continue
+            if ap.bd_addr not in event_dict:
+                logging.info(
+                    f'Found new sensor "{ap.name}" with BDA: {ap.bd_addr}')
+                event_dict[ap.bd_addr] = SensorEvent(history=history)
+            if event_dict[ap.bd_addr].update(ap):
+                logging.info(ap.name)
+                logging.info(event_dict[ap.bd_addr].__dict__)
+                if store is not None:
+                    store.ingest_advertisement(ap)
+                try:
+                    cloudwatch.put_metric_data(
+                        Namespace=NAMESPACE, MetricData=metrics.Generate(event_dict[ap.bd_addr], ap))
+                except:
+                    logging.info("Unable to send metric to CloudWatch")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="bt510", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--config", default="config.json", help="Script configuration file")
+    parser.add_argument("--port", help="Override the dongle port (COM71, /dev/ttyUSB0, socket://...)")
+    parser.add_argument("--verbose", action="store_true", help="Log debug messages to the console")
+    parser.add_argument("--queued-log", action="store_true",
+                        help="Write the transcript from a separate thread")
+    parser.add_argument("--sidecar", action="store_true",
+                        help="Write log payloads to a binary file referenced by the transcript")
+    parser.add_argument("--store", help="SQLite event store (logs/events.db)")
+    parser.add_argument("--capture", help="Record raw serial data in this ring file")
+    parser.add_argument("--fast-init", action="store_true",
+                        help="Only write the dongle registers that differ (skip the reset when possible)")
+    parser.add_argument("--telemetry",
+                        help="Write the time of each session phase to this JSON lines file "
+                             "(logs/session_telemetry.jsonl)")
+    parser.add_argument("--inventory",
+                        help="JSON file of the expected sensors ({\"bd_addrs\": [...]}, {\"names\": [...]} "
+                             "or {\"prefix\": \"Test-\", \"count\": 13}); stops when all have been seen")
+    parser.add_argument("--history", type=int,
+                        help="Keep this many advertised samples of each sensor in memory "
+                             "(event_history_samples, 288 is a day of 5 minute samples)")
+    parser.add_argument("--profile", help="Connection profile (bulk, quick, low_power, default or "
+                                          "one from connection_profiles) instead of the one for the command")
+    parser.add_argument("--transcript-level", default="DEBUG",
+                        choices=["DEBUG", "INFO", "WARNING"], help="Transcript log level")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("scan", aliases=["query"], help="Print sensor events")
+    p.add_argument("--name", help="Name to look for (system_name_to_look_for)")
+    p.add_argument("--dump", action="store_true", help="Dump the attributes of each new sensor")
+    p.add_argument("--parquet", help="Write every advertisement to this Parquet (or .arrow) file")
+    p.set_defaults(func=cmd_scan)
+
+    p = sub.add_parser("report", help="Generate a system report")
+    p.add_argument("--name", help="Name to look for (system_name_to_look_for)")
+    p.add_argument("--duration", type=int, help="Scan duration in seconds")
+    p.add_argument("--idle", type=int,
+                   help="Stop when no sensor was found or updated for this many seconds")
+    p.add_argument("--xlsx", help="Also write the report to this spreadsheet")
+    p.set_defaults(func=cmd_report)
+
+    p = sub.add_parser("read-logs", help="Read sensor event logs")
+    p.add_argument("--name", help="Name to look for (name_to_look_for)")
+    p.add_argument("--count", type=int, help="Number of devices to look for")
+    p.add_argument("--duration", type=int, help="Stop after this many seconds")
+    p.set_defaults(func=cmd_read_logs)
+
+    p = sub.add_parser("config", help="Configure sensors")
+    p.add_argument("--name", default="BT510", help="Name to look for")
+    p.add_argument("--count", type=int, help="Number of devices to configure (default: run indefinitely)")
+    p.add_argument("--file", default="default_sensor_configuration.json")
+    p.add_argument("--no-prompt", action="store_true", help="Don't ask for changes to the configuration")
+    p.add_argument("--all", action="store_true",
+                   help="Connect to sensors even if their configVersion is current")
+    p.set_defaults(func=cmd_config)
+
+    p = sub.add_parser("set-epoch", help="Set sensor clocks")
+    p.add_argument("--name", help="Name to look for (name_to_look_for)")
+    p.add_argument("--count", type=int, help="Number of devices to look for")
+    p.add_argument("--force", action="store_true",
+                   help="Set the clock of every sensor instead of only those that have drifted")
+    p.add_argument("--threshold", type=int,
+                   help="Clock offset (seconds) that requires setEpoch (clock_drift_threshold_seconds)")
+    p.add_argument("--duration", type=int, default=900,
+                   help="Seconds to watch advertisements for drifted sensors")
+    p.set_defaults(func=cmd_set_epoch)
+
+    p = sub.add_parser("cloudwatch", help="Send sensor events to AWS CloudWatch")
+    p.add_argument("--name", help="Name to look for (system_name_to_look_for)")
+    p.set_defaults(func=cmd_cloudwatch)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    command = args.func.__name__.replace("cmd_", "")
+    log_wrapper.setup(f"bt510_{command}.py",
+                      console_level=logging.DEBUG if args.verbose else logging.INFO,
+                      file_mode='a' if command == "cloudwatch" else 'w',
+                      file_level=getattr(logging, args.transcript_level),
+                      queued=args.queued_log, sidecar=args.sidecar)
+    isBle = True
+    jc = JsonConfig(isBle, args.config)
+    if args.port:
+        jc.config["ble_dongle_comport"] = args.port
+    if args.capture:
+        jc.config["serial_capture_file"] = args.capture
+    if args.telemetry:
+        jc.config["session_telemetry_file"] = args.telemetry
+    if args.fast_init:
+        jc.config["dongle_fast_init"] = True
+    if args.history:
+        jc.config["event_history_samples"] = args.history
+    try:
+        args.func(jc, args)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
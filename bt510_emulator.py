@@ -0,0 +1,559 @@
+
+"""
+BT510 emulator for bench testing without hardware.
+
+Speaks the subset of JSON-RPC used by jtester and, optionally, the AT command
+front end of the BL65x dongle (scanning with AT+LSCN, VSP connections with ATD).
+The emulator is served on a TCP port or a pty so that it can be opened with
+serial.serial_for_url("socket://localhost:7777") or serial.Serial("/dev/pts/N").
+
+python bt510_emulator.py --mode dongle --sensors 100 --name Test-
+"""
+
+import os
+import sys
+import json
+import time
+import math
+import base64
+import random
+import socket
+import struct
+import argparse
+import logging
+import threading
+import bitstruct
+from adv_parser import FOB_ADV_FORMAT, FOB_RSP_FORMAT2, FOB_FLAGS_FORMAT, FOB_FLAGS_NAMES
+from event_log import FOB_EVENT_FORMAT, SIZE_OF_EVENT
+from event_store import BATTERY_EVENTS
+from sensor_event import SensorEventType, MagnetState, ResetReason
+
+# Response times observed in sample_logs (seconds)
+REALISTIC_LATENCY = {
+    "default": 0.10,
+    "prepareLog": 0.20,
+    "readLog": 0.30,
+    "ackLog": 0.70,
+    "dump": 0.40,
+    "connect": 3.20,
+}
+
+# limited in sensor (by JSON buffer size)
+MAX_EVENTS_PER_READ = 128
+MAX_LOG_EVENTS = 8192
+
+DEFAULT_ATTRIBUTES = {
+    "mtu": 96, "odr": 5, "txPower": 0, "scale": 2, "magnetState": 1, "resetCount": 2,
+    "movementAlarm": 0, "networkId": 0, "sensorName": "BT510", "resetReason": "SREQ",
+    "scratchpad2": 0, "activeMode": 1, "scratchpad1": 0, "deltaTemperatureAlarm": 0,
+    "useCodedPhy": 0, "tempCc": 2250, "lock": 1, "returnToSleepDuration": 6,
+    "activationThreshold": 8, "rateOfChangeTemperatureAlarm": 0,
+    "deltaTemperatureAlarmTheshold": 255, "location": "", "temperatureAggregationCount": 1,
+    "advertisingDuration": 0, "configVersion": 0, "connectionTimeout": 60, "hwVersion": "0",
+    "lowTemperatureAlarm": 0, "rateOfChangeTemperatureAlarmThreshold": 0,
+    "bluetoothAddress": "", "bootloaderVersion": "1.0.7", "accelerometerSelfTestStatus": 2,
+    "highTemperatureAlarm": 0, "temperatureSenseInterval": 600, "advertisingInterval": 1000,
+    "batteryVoltageMv": 2985, "hardwareMinorVersion": 0, "lowTemperatureAlarmThreshold2": -127,
+    "passkey": "123456", "lowTemperatureAlarmThreshold1": -127, "flags": 32775,
+    "highTemperatureAlarmThreshold2": 127, "scratchpad3": 0, "batterySenseInterval": 1800,
+    "highTemperatureAlarmThreshold1": 127, "impactAlarm": 0, "firmwareVersion": "4.1.0",
+}
+
+verbose = False
+
+
+class SensorEmulator:
+    """ State of a single BT510 and its JSON-RPC command handler """
+
+    def __init__(self, bd_addr: str, name="BT510", event_count=890, clock_offset=0.0,
+                 time_was_set=True, latency=None, seed=None):
+        self.logger = logging.getLogger('SensorEmulator')
+        self.bd_addr = bd_addr.upper()
+        self.attributes = dict(DEFAULT_ATTRIBUTES)
+        self.attributes["sensorName"] = name
+        self.attributes["bluetoothAddress"] = self.bd_addr
+        self.latency = dict(REALISTIC_LATENCY) if latency is None else latency
+        self.max_events_per_read = MAX_EVENTS_PER_READ
+        self.random = random.Random(seed if seed is not None else bd_addr)
+        # The sensor clock is host time plus an offset (drift can be emulated)
+        self.clock_offset = clock_offset
+        self.time_was_set = time_was_set
+        self.record_number = 0
+        self.last_event = (0, 0, SensorEventType.RESERVED)
+        self.events = list()
+        self.prepared = 0
+        self.lock = threading.Lock()
+        self._populate(event_count)
+
+    def epoch(self) -> int:
+        return int(time.time() + self.clock_offset)
+
+    def _add_event(self, timestamp: int, event_type: SensorEventType, data: int) -> None:
+        """ Add an event to the log and make it the current advertisement """
+        salt = 0
+        if self.events:
+            last_timestamp, _, _, last_salt = struct.unpack(
+                FOB_EVENT_FORMAT, self.events[-1])
+            if last_timestamp == timestamp:
+                salt = (last_salt + 1) & 0xFF
+        self.events.append(struct.pack(FOB_EVENT_FORMAT, timestamp,
+                                       data & 0xFFFF, event_type, salt))
+        if len(self.events) > MAX_LOG_EVENTS:
+            del self.events[0]
+            self.prepared = max(0, self.prepared - 1)
+        self.record_number = (self.record_number + 1) & 0xFFFF
+        self.last_event = (timestamp, data, event_type)
+
+    def _temperature(self, timestamp: int) -> int:
+        """ Daily temperature cycle in hundredths of a degree """
+        day = (timestamp % 86400) / 86400.0
+        return int(2200 + 300 * math.sin(2 * math.pi * day) + self.random.randint(-20, 20))
+
+    def _populate(self, event_count: int) -> None:
+        """ Create a history of event_count events that ends now """
+        interval = self.attributes["temperatureSenseInterval"]
+        battery_every = max(1, self.attributes["batterySenseInterval"] // interval)
+        # The events are chosen first so that the last temperature sample is taken now
+        # (otherwise advance() adds the samples that are missing)
+        kinds = [SensorEventType.RESET]
+        while len(kinds) < event_count:
+            kinds.append(SensorEventType.TEMPERATURE)
+            if len(kinds) < event_count and (len(kinds) % battery_every) == 0:
+                kinds.append(SensorEventType.BATTERY_GOOD)
+            if len(kinds) < event_count and self.random.random() < 0.02:
+                kinds.append(SensorEventType.MAGNET)
+        timestamp = self.epoch() - interval * kinds.count(SensorEventType.TEMPERATURE)
+        for kind in kinds:
+            if kind == SensorEventType.TEMPERATURE:
+                timestamp += interval
+                self._add_event(timestamp, kind, self._temperature(timestamp))
+            elif kind == SensorEventType.BATTERY_GOOD:
+                self._add_event(timestamp, kind,
+                                self.attributes["batteryVoltageMv"] - self.random.randint(0, 5))
+            elif kind == SensorEventType.MAGNET:
+                magnet = MagnetState(self.random.randint(0, 1))
+                self.attributes["magnetState"] = int(magnet)
+                self._add_event(timestamp, kind, magnet)
+            else:
+                self._add_event(timestamp, kind, ResetReason.SREQ)
+        self.next_sample = timestamp + interval
+
+    def advance(self) -> None:
+        """ Take the samples that would have occurred since the last call """
+        now = self.epoch()
+        with self.lock:
+            while self.next_sample <= now:
+                self._add_event(self.next_sample, SensorEventType.TEMPERATURE,
+                                self._temperature(self.next_sample))
+                self.next_sample += self.attributes["temperatureSenseInterval"]
+
+    def _flags(self) -> int:
+        d = dict.fromkeys(FOB_FLAGS_NAMES, 0)
+        d["magnet_state"] = self.attributes["magnetState"]
+        d["active_mode"] = self.attributes["activeMode"]
+        d["time_was_set"] = 1 if self.time_was_set else 0
+        return struct.unpack('>H', bitstruct.pack_dict(FOB_FLAGS_FORMAT, FOB_FLAGS_NAMES, d))[0]
+
+    def advertisement(self) -> str:
+        """ Advertisement and scan response as reported by AT+LSCN (hex) """
+        self.advance()
+        timestamp, data, event_type = self.last_event
+        if event_type in BATTERY_EVENTS:
+            # The log has mV and the advertisement has 10 mV units
+            data //= 10
+        name = self.attributes["sensorName"].encode('utf-8')
+        major, minor, build = (int(x) for x in self.attributes["firmwareVersion"].split('.'))
+        bl_major, bl_minor, bl_build = (int(x) for x in self.attributes["bootloaderVersion"].split('.'))
+        adv = struct.pack(FOB_ADV_FORMAT, 2, 0x01, 0x06, 0x1b, 0xff, 0x0077, 0x0001,
+                          self.attributes["networkId"], self._flags(),
+                          bytes.fromhex(self.bd_addr)[::-1], event_type, self.record_number,
+                          timestamp, data, self.attributes["resetCount"] & 0xFF)
+        rsp = struct.pack(FOB_RSP_FORMAT2, 0x10, 0xff, 0x00E4, 0x0003, 0,
+                          major, minor, build, 0, self.attributes["configVersion"] & 0xFF,
+                          bl_major, bl_minor, bl_build, 0x20, len(name) + 1, 0x09)
+        return (adv + rsp + name).hex().upper()
+
+    def delay(self, method: str) -> float:
+        return self.latency.get(method, self.latency.get("default", 0))
+
+    def handle_request(self, request: dict) -> dict:
+        """ Process a JSON-RPC request and return the response """
+        method = request.get("method", "")
+        params = request.get("params", [])
+        response = {"jsonrpc": "2.0", "id": request.get("id")}
+        handler = getattr(self, "_rpc_" + method, None)
+        if handler is None:
+            response["error"] = {"code": -32601, "message": "Method not found"}
+            return response
+        try:
+            with self.lock:
+                handler(params, response)
+        except Exception as err:
+            response["error"] = {"code": -32602, "message": str(err)}
+        return response
+
+    def _rpc_get(self, params, response) -> None:
+        for name in params:
+            response[name] = self.attributes[name]
+        response["result"] = "ok"
+
+    def _rpc_set(self, params, response) -> None:
+        if self.attributes["lock"] and list(params.keys()) != ["lock"]:
+            response["error"] = {"code": -32000, "message": "Locked"}
+            return
+        for (name, value) in params.items():
+            if name not in self.attributes:
+                raise ValueError(f"Unknown attribute {name}")
+        self.attributes.update(params)
+        response["result"] = "ok"
+
+    def _rpc_setEpoch(self, params, response) -> None:
+        self.clock_offset = params[0] - time.time()
+        self.time_was_set = True
+        response["result"] = "ok"
+
+    def _rpc_getEpoch(self, params, response) -> None:
+        response["result"] = self.epoch()
+
+    def _rpc_prepareLog(self, params, response) -> None:
+        self.prepared = len(self.events)
+        response["result"] = self.prepared
+
+    def _rpc_readLog(self, params, response) -> None:
+        count = min(params[0], self.max_events_per_read, self.prepared)
+        buf = b''.join(self.events[:count])
+        response["result"] = [len(buf), base64.standard_b64encode(buf).decode('ascii')]
+
+    def _rpc_ackLog(self, params, response) -> None:
+        count = min(params[0], self.prepared)
+        del self.events[:count]
+        self.prepared -= count
+        response["result"] = count
+
+    def _rpc_dump(self, params, response) -> None:
+        response.update(self.attributes)
+        response["result"] = "ok"
+
+    def _rpc_reboot(self, params, response) -> None:
+        self.attributes["resetCount"] += 1
+        self.attributes["resetReason"] = "SREQ"
+        self.attributes["lock"] = 1
+        response["result"] = "ok"
+
+    def _rpc_factoryReset(self, params, response) -> None:
+        self.attributes.update(DEFAULT_ATTRIBUTES)
+        self.attributes["bluetoothAddress"] = self.bd_addr
+        self._rpc_reboot(params, response)
+
+    def _rpc_ledTest(self, params, response) -> None:
+        response["result"] = "ok"
+
+
+class JsonFramer:
+    """ Split a byte stream into JSON objects using brace counting """
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.depth = 0
+
+    def feed(self, data: bytes) -> list:
+        packets = list()
+        for b in data:
+            if self.depth == 0 and b != ord('{'):
+                continue
+            self.buf.append(b)
+            if b == ord('{'):
+                self.depth += 1
+            elif b == ord('}'):
+                self.depth -= 1
+                if self.depth == 0:
+                    packets.append(bytes(self.buf))
+                    self.buf.clear()
+        return packets
+
+
+class PortWriter:
+    """ Serialize writes from the command and scan threads """
+
+    def __init__(self, write_fn, chunk_size=0, chunk_delay=0.0):
+        self.write_fn = write_fn
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.lock = threading.Lock()
+
+    def write(self, data: bytes) -> None:
+        with self.lock:
+            if self.chunk_size <= 0:
+                self.write_fn(data)
+                return
+            for n in range(0, len(data), self.chunk_size):
+                self.write_fn(data[n:n + self.chunk_size])
+                if self.chunk_delay:
+                    time.sleep(self.chunk_delay)
+
+
+class SerialFrontEnd:
+    """ A sensor connected with its UART (JsonSerialReader) """
+
+    def __init__(self, sensor: SensorEmulator, writer: PortWriter):
+        self.sensor = sensor
+        self.writer = writer
+        self.framer = JsonFramer()
+
+    def data_received(self, data: bytes) -> None:
+        for packet in self.framer.feed(data):
+            respond(self.sensor, packet, self.writer, b'\r\n')
+
+    def stop(self) -> None:
+        pass
+
+
+def respond(sensor: SensorEmulator, packet: bytes, writer: PortWriter, terminator=b'') -> None:
+    """ Handle a JSON-RPC request and write the response after the method's latency """
+    try:
+        request = json.loads(packet)
+    except ValueError:
+        return
+    response = sensor.handle_request(request)
+    time.sleep(sensor.delay(request.get("method", "")))
+    writer.write(json.dumps(response).encode('utf-8') + terminator)
+
+
+class DongleFrontEnd:
+    """ BL65x AT command interface with any number of sensors in range """
+
+    def __init__(self, sensors: dict, writer: PortWriter, adv_interval=1.0):
+        self.logger = logging.getLogger('DongleEmulator')
+        self.sensors = sensors
+        self.writer = writer
+        self.adv_interval = adv_interval
+        self.bd_addr = "01FCEA3495B3CB"
+        self.sregs = {100: 0, 107: 0, 109: 0, 111: 0, 210: 0, 300: 30000, 301: 30000}
+        self.line = bytearray()
+        self.connected = None
+        # Connection that completes after the sensor's connect latency (cancelled by AT+LCONX)
+        self.pending_connect = None
+        self.lock = threading.Lock()
+        self.framer = None
+        self.carets = 0
+        self.scan_filter = None
+        self.alive = True
+        self._scan_thread = threading.Thread(target=self._run_scan)
+        self._scan_thread.daemon = True
+        self._scan_thread.name = 'emulator-scan'
+        self._scan_thread.start()
+
+    def stop(self) -> None:
+        self.alive = False
+
+    def _send_line(self, line: str) -> None:
+        self.writer.write(('\n' + line + '\r').encode('utf-8'))
+
+    def data_received(self, data: bytes) -> None:
+        if self.connected is not None:
+            self._vsp_received(data)
+            return
+        for b in data:
+            if b == ord('\r'):
+                line = self.line.decode('utf-8', errors='ignore').strip()
+                self.line.clear()
+                if line != "":
+                    self._command(line)
+            elif b != ord('\n'):
+                self.line.append(b)
+
+    def _vsp_received(self, data: bytes) -> None:
+        for b in data:
+            if b == ord('^') and self.framer.depth == 0:
+                self.carets += 1
+                if self.carets == 4:
+                    self.carets = 0
+                    self._disconnect()
+                    return
+            else:
+                self.carets = 0
+        for packet in self.framer.feed(data):
+            respond(self.connected, packet, self.writer)
+
+    def _disconnect(self) -> None:
+        self.connected = None
+        self.framer = None
+        self._send_line("NOCARRIER 1")
+
+    def _command(self, line: str) -> None:
+        if verbose:
+            print(f"emulator command {line}")
+        upper = line.upper()
+        if upper in ("AT", "AT&W", "AT+SFMT 1"):
+            self._send_line("OK")
+        elif upper == "ATZ":
+            self.scan_filter = None
+            self._send_line("OK")
+        elif upper == "ATI 4":
+            self._send_line(self.bd_addr)
+            self._send_line("OK")
+        elif upper.startswith("ATS ") and upper.endswith("?"):
+            reg = int(upper[4:-1])
+            self._send_line(str(self.sregs.get(reg, 0)))
+            self._send_line("OK")
+        elif upper.startswith("ATS ") and "=" in upper:
+            reg, value = upper[4:].split("=")
+            self.sregs[int(reg)] = int(value)
+            self._send_line("OK")
+        elif upper == "AT+LCONX":
+            with self.lock:
+                if self.pending_connect is not None:
+                    self.pending_connect.cancel()
+                    self.pending_connect = None
+            self._send_line("OK")
+        elif upper.startswith("AT+LSCNX"):
+            self.scan_filter = None
+            self._send_line("OK")
+        elif upper.startswith("AT+LSCN"):
+            args = line[len("AT+LSCN"):].strip().split(',')
+            name = args[1].strip('"') if len(args) > 1 else ""
+            rssi = int(args[2]) if len(args) > 2 else -128
+            self.scan_filter = (name, rssi)
+            self._send_line("OK")
+        elif upper.startswith("ATD "):
+            self._connect(upper[4:].strip())
+        elif upper.startswith("AT+LCON "):
+            self._send_line("OK")
+            self._send_line("connect 1," + upper[8:].strip())
+        elif upper.startswith("AT+PAIR"):
+            self._send_line("OK")
+            self._send_line("encrypt 1")
+        elif upper.startswith("AT+LDSC"):
+            self._send_line("OK")
+            self._send_line("discon 1")
+        elif upper.startswith("AT+PRSP"):
+            self._send_line("OK")
+        else:
+            self._send_line("ERROR 1")
+
+    def _connect(self, addr: str) -> None:
+        sensor = self.sensors.get(addr)
+        if sensor is None:
+            self._send_line("NOCARRIER 1")
+            return
+        with self.lock:
+            self.pending_connect = threading.Timer(sensor.delay("connect"), self._connected, (sensor, addr))
+            self.pending_connect.daemon = True
+            self.pending_connect.start()
+
+    def _connected(self, sensor: SensorEmulator, addr: str) -> None:
+        with self.lock:
+            if self.pending_connect is None:
+                return
+            self.pending_connect = None
+            self.scan_filter = None
+            self.connected = sensor
+            self.framer = JsonFramer()
+            self.carets = 0
+            self._send_line("CONNECT 1," + addr)
+
+    def _run_scan(self) -> None:
+        """ Every sensor advertises once per interval with random phase """
+        while self.alive:
+            start = time.time()
+            for (addr, sensor) in list(self.sensors.items()):
+                scan_filter = self.scan_filter
+                if scan_filter is None or self.connected is not None:
+                    break
+                name, rssi_threshold = scan_filter
+                rssi = sensor.random.randint(-90, -45)
+                if sensor.attributes["sensorName"].startswith(name) and rssi >= rssi_threshold:
+                    self._send_line(f'AD {addr} {rssi} "{sensor.advertisement()}"')
+                time.sleep(self.adv_interval / max(1, len(self.sensors)))
+            remaining = self.adv_interval - (time.time() - start)
+            if remaining > 0:
+                time.sleep(remaining)
+
+
+def build_fleet(count: int, name="Test-", event_count=890, latency=None, max_drift=0.0) -> dict:
+    """ Create sensors keyed by their AT (01 prefixed) address """
+    sensors = dict()
+    for n in range(count):
+        bd_addr = f"C0FFEE{n:06X}"
+        rng = random.Random(n)
+        sensors["01" + bd_addr] = SensorEmulator(bd_addr, f"{name}{n:02d}", event_count,
+                                                 clock_offset=rng.uniform(-max_drift, max_drift),
+                                                 latency=latency)
+    return sensors
+
+
+def serve(front_end_factory, port=7777, use_pty=False, chunk_size=0, chunk_delay=0.0) -> None:
+    """ Serve the emulator on a TCP port (socket://) or on a pty until interrupted """
+    if use_pty:
+        import tty
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        print(f"Emulator available on {os.ttyname(slave)}")
+        _pump(lambda size: os.read(master, size), lambda data: os.write(master, data),
+              front_end_factory, chunk_size, chunk_delay)
+        return
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(("localhost", port))
+    server.listen(1)
+    print(f"Emulator available on socket://localhost:{port}")
+    while True:
+        conn, addr = server.accept()
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        logging.info(f"Client connected from {addr}")
+        try:
+            _pump(conn.recv, conn.sendall, front_end_factory, chunk_size, chunk_delay)
+        except OSError:
+            pass
+        conn.close()
+        logging.info("Client disconnected")
+
+
+def _pump(read_fn, write_fn, front_end_factory, chunk_size, chunk_delay) -> None:
+    writer = PortWriter(write_fn, chunk_size, chunk_delay)
+    front_end = front_end_factory(writer)
+    try:
+        while True:
+            data = read_fn(4096)
+            if not data:
+                break
+            front_end.data_received(data)
+    finally:
+        front_end.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="BT510 emulator")
+    parser.add_argument("--mode", choices=["dongle", "serial"], default="dongle",
+                        help="BL65x AT front end or direct sensor UART")
+    parser.add_argument("--port", type=int, default=7777, help="TCP port for socket://")
+    parser.add_argument("--pty", action="store_true", help="Serve on a pty instead of TCP")
+    parser.add_argument("--sensors", type=int, default=4)
+    parser.add_argument("--name", default="Test-", help="Sensor name prefix")
+    parser.add_argument("--events", type=int, default=890, help="Events in each log")
+    parser.add_argument("--latency-scale", type=float, default=1.0,
+                        help="Scale the response times observed with real sensors (0 = none)")
+    parser.add_argument("--max-drift", type=float, default=0.0,
+                        help="Maximum sensor clock offset in seconds")
+    parser.add_argument("--adv-interval", type=float, default=1.0)
+    parser.add_argument("--chunk-size", type=int, default=0,
+                        help="Bytes per write (0 = unlimited)")
+    parser.add_argument("--chunk-delay", type=float, default=0.0)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    verbose = args.verbose
+    latency = {k: v * args.latency_scale for (k, v) in REALISTIC_LATENCY.items()}
+    fleet = build_fleet(args.sensors, args.name, args.events, latency, args.max_drift)
+    if args.mode == "dongle":
+        def factory(writer): return DongleFrontEnd(fleet, writer, args.adv_interval)
+    else:
+        sensor = next(iter(fleet.values()))
+        sensor.attributes["lock"] = 0
+        def factory(writer): return SerialFrontEnd(sensor, writer)
+    try:
+        serve(factory, args.port, args.pty, args.chunk_size, args.chunk_delay)
+    except KeyboardInterrupt:
+        sys.exit(0)
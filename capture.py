@@ -0,0 +1,244 @@
+
+"""
+Raw serial byte capture for post-mortem analysis.
+
+Every chunk read from or written to the port is recorded with a monotonic
+timestamp and its direction in a fixed size memory-mapped ring file.
+The newest data overwrites the oldest, so capture can be left running.
+
+python capture.py dump logs/capture.bin
+python capture.py replay logs/capture.bin --protocol dongle
+python capture.py replay logs/capture.bin --url socket://localhost:7777
+"""
+
+import os
+import sys
+import mmap
+import time
+import struct
+import argparse
+import threading
+
+MAGIC = b'BT510CAP'
+VERSION = 1
+# magic, version, capacity, head (total bytes ever written), wall clock at creation, monotonic at creation
+HEADER_FORMAT = '<8sIQQdd'
+HEADER_SIZE = 64
+# sync, direction, length, monotonic timestamp
+RECORD_FORMAT = '<HBHd'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+RECORD_SYNC = 0xB5A1
+MAX_CHUNK = 0xFFFF
+
+RX = 0
+TX = 1
+DIRECTION_NAMES = {RX: "rx", TX: "tx"}
+
+DEFAULT_CAPACITY = 4 * 1024 * 1024
+
+
+class CaptureRing:
+    """ Fixed size memory-mapped ring of raw serial chunks """
+
+    def __init__(self, fname: str, capacity=DEFAULT_CAPACITY, readonly=False):
+        """
+        The recorder creates the ring (or continues an existing one).
+        readonly - open an existing ring (dump/replay); the file is never modified.
+        ValueError is raised if an existing file isn't a capture ring.
+        """
+        self.readonly = readonly
+        self.lock = threading.Lock()
+        exists = os.path.exists(fname) and os.path.getsize(fname) > 0
+        if readonly:
+            self.f = open(fname, 'rb')
+            self.mm = self._map(fname, mmap.ACCESS_READ)
+        elif exists:
+            self.f = open(fname, 'r+b')
+            self.mm = self._map(fname, mmap.ACCESS_WRITE)
+        else:
+            if capacity <= RECORD_SIZE:
+                raise ValueError(f"Capture capacity {capacity} is too small")
+            self.f = open(fname, 'w+b')
+            self.f.truncate(HEADER_SIZE + capacity)
+            self.mm = mmap.mmap(self.f.fileno(), 0)
+            self.capacity = capacity
+            self.head = 0
+            self.wall_start = time.time()
+            self.monotonic_start = time.monotonic()
+            self._write_header()
+
+    def _map(self, fname: str, access):
+        """ Map an existing ring and read its header """
+        if os.path.getsize(fname) < HEADER_SIZE + RECORD_SIZE:
+            self.f.close()
+            raise ValueError(f"{fname} is not a capture file")
+        mm = mmap.mmap(self.f.fileno(), 0, access=access)
+        magic, version, self.capacity, self.head, self.wall_start, self.monotonic_start = \
+            struct.unpack_from(HEADER_FORMAT, mm, 0)
+        if magic != MAGIC or version != VERSION or not RECORD_SIZE < self.capacity <= len(mm) - HEADER_SIZE:
+            mm.close()
+            self.f.close()
+            raise ValueError(f"{fname} is not a capture file (or has an unsupported version)")
+        return mm
+
+    def _write_header(self) -> None:
+        struct.pack_into(HEADER_FORMAT, self.mm, 0, MAGIC, VERSION, self.capacity,
+                         self.head, self.wall_start, self.monotonic_start)
+
+    def _put(self, data) -> None:
+        """ Copy data into the ring at head (wrapping when necessary) """
+        if len(data) > self.capacity:
+            raise ValueError(f"{len(data)} bytes don't fit in the capture ring ({self.capacity})")
+        start = self.head % self.capacity
+        first = min(len(data), self.capacity - start)
+        self.mm[HEADER_SIZE + start:HEADER_SIZE + start + first] = data[:first]
+        if first < len(data):
+            self.mm[HEADER_SIZE:HEADER_SIZE + len(data) - first] = data[first:]
+        self.head += len(data)
+
+    def record(self, direction: int, data) -> None:
+        if self.readonly:
+            raise ValueError("The capture ring is read-only")
+        timestamp = time.monotonic()
+        # A record (header and chunk) never exceeds the ring
+        size = min(MAX_CHUNK, self.capacity - RECORD_SIZE)
+        with self.lock:
+            for n in range(0, len(data), size):
+                chunk = data[n:n + size]
+                self._put(struct.pack(RECORD_FORMAT, RECORD_SYNC,
+                                      direction, len(chunk), timestamp))
+                self._put(chunk)
+            struct.pack_into('<Q', self.mm, 20, self.head)
+
+    def _get(self, position: int, length: int) -> bytes:
+        start = position % self.capacity
+        first = min(length, self.capacity - start)
+        data = self.mm[HEADER_SIZE + start:HEADER_SIZE + start + first]
+        if first < length:
+            data += self.mm[HEADER_SIZE:HEADER_SIZE + length - first]
+        return data
+
+    def _walk(self, position: int):
+        """ Return the records from position to head or None if the chain is broken """
+        records = list()
+        while position < self.head:
+            if self.head - position < RECORD_SIZE:
+                return None
+            sync, direction, length, timestamp = struct.unpack(
+                RECORD_FORMAT, self._get(position, RECORD_SIZE))
+            if sync != RECORD_SYNC or direction not in DIRECTION_NAMES:
+                return None
+            position += RECORD_SIZE
+            if position + length > self.head:
+                return None
+            records.append((timestamp, direction, self._get(position, length)))
+            position += length
+        return records
+
+    def records(self) -> list:
+        """
+        All complete records (oldest first) as (monotonic timestamp, direction, data).
+        After the ring wraps the oldest record is found by searching for a
+        record chain that ends exactly at head.
+        """
+        with self.lock:
+            oldest = max(0, self.head - self.capacity)
+            for position in range(oldest, min(self.head, oldest + MAX_CHUNK + RECORD_SIZE)):
+                records = self._walk(position)
+                if records is not None:
+                    return records
+            return list()
+
+    def close(self) -> None:
+        with self.lock:
+            if not self.readonly:
+                self.mm.flush()
+            self.mm.close()
+            self.f.close()
+
+
+def dump(ring: CaptureRing, as_hex=False) -> None:
+    last = None
+    for (timestamp, direction, data) in ring.records():
+        delta = 0.0 if last is None else timestamp - last
+        last = timestamp
+        wall = ring.wall_start + (timestamp - ring.monotonic_start)
+        text = data.hex() if as_hex else repr(data)
+        print(f"{time.strftime('%H:%M:%S', time.localtime(wall))}.{int((wall % 1) * 1e6):06d} "
+              f"+{delta:9.6f} {DIRECTION_NAMES[direction]} {len(data):5} {text}")
+
+
+def replay_into_protocol(ring: CaptureRing, protocol_name: str) -> None:
+    """ Feed the received chunks into a protocol (without a port) and show what it produced """
+    import queue
+    if protocol_name == "dongle":
+        import dongle
+        from dongle import BL65x
+        dongle.laird_dongle_quiet()
+        protocol = BL65x(config=dict(bd_addrs=[""]))
+        queues = {"ads": protocol.ads, "responses": protocol.responses,
+                  "events": protocol.events, "json": protocol.json_packets}
+    else:
+        from json_serial_reader import JsonSerialReader
+        protocol = JsonSerialReader()
+        protocol.text = ""
+        queues = {"json": protocol.json_packets}
+
+    def drain():
+        for (name, q) in queues.items():
+            while True:
+                try:
+                    print(f"    {name}: {q.get_nowait()}")
+                except queue.Empty:
+                    break
+
+    for (timestamp, direction, data) in ring.records():
+        print(f"{DIRECTION_NAMES[direction]} {data!r}")
+        if direction == RX:
+            protocol.data_received(data)
+            drain()
+
+
+def replay_to_port(ring: CaptureRing, url: str, speed=1.0) -> None:
+    """ Write the received chunks to a port with their original timing (act as the device) """
+    import serial
+    port = serial.serial_for_url(url, timeout=1)
+    last = None
+    for (timestamp, direction, data) in ring.records():
+        if direction != RX:
+            continue
+        if last is not None and speed > 0:
+            time.sleep((timestamp - last) / speed)
+        last = timestamp
+        port.write(data)
+    port.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Raw serial capture tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("dump", help="Print the records")
+    p.add_argument("file")
+    p.add_argument("--hex", action="store_true")
+    p = sub.add_parser("replay", help="Replay received data")
+    p.add_argument("file")
+    p.add_argument("--protocol", choices=["dongle", "serial"], default="dongle")
+    p.add_argument("--url", help="Write received data to this port instead")
+    p.add_argument("--speed", type=float, default=1.0, help="0 = as fast as possible")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.file):
+        print(f"{args.file} not found")
+        sys.exit(1)
+    try:
+        ring = CaptureRing(args.file, readonly=True)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    if args.command == "dump":
+        dump(ring, args.hex)
+    elif args.url:
+        replay_to_port(ring, args.url, args.speed)
+    else:
+        replay_into_protocol(ring, args.protocol)
+    ring.close()
@@ -0,0 +1,133 @@
+
+"""
+Estimate sensor clock offsets from advertisements.
+
+An advertisement carries the epoch of the sensor's last event. The first time
+a record number is received, rx_epoch - epoch is the clock offset plus the
+time it took to receive the advertisement (advertising interval, dongle and
+queue delay). The delay is never negative, so the smallest value over several
+records is the estimate of the offset. A negative value (sensor ahead of the
+host) proves the sensor is ahead even if the record wasn't seen when it was new.
+
+Only sensors whose offset is beyond a threshold or whose time was never set
+(time_was_set == 0) need a setEpoch connection.
+"""
+
+import time
+import logging
+from collections import deque
+
+DRIFT_THRESHOLD_SECONDS = 30
+# Records used for the estimate (sensors take a temperature sample every few minutes)
+WINDOW = 16
+
+
+class ClockEstimate:
+    """ Offset (host - sensor seconds) of one sensor """
+
+    def __init__(self, window=WINDOW):
+        self.record_number = None
+        self.time_was_set = True
+        # (rx_epoch, rx_epoch - epoch) for records that were received when they were new
+        self.samples = deque(maxlen=window)
+        # The sensor is ahead of the host by at least this much (when negative)
+        self.upper_bound = None
+
+    def update(self, ap) -> None:
+        self.time_was_set = bool(ap.flags_dict.get("time_was_set", 1))
+        delta = ap.rx_epoch - ap.adv.epoch
+        if ap.adv.record_number == self.record_number:
+            return
+        if self.record_number is not None:
+            # The record number changed while scanning, so this event is new
+            self.samples.append((ap.rx_epoch, delta))
+        elif delta < 0:
+            self.upper_bound = delta
+        self.record_number = ap.adv.record_number
+
+    def offset(self):
+        """ Estimated offset in seconds or None if unknown """
+        candidates = [d for (_, d) in self.samples]
+        if self.upper_bound is not None:
+            candidates.append(self.upper_bound)
+        return min(candidates) if candidates else None
+
+    def drift_rate(self):
+        """
+        Change in offset (seconds per day) from the minimum of the older and
+        newer halves of the window or None if there aren't enough samples.
+        """
+        if len(self.samples) < 4:
+            return None
+        samples = list(self.samples)
+        half = len(samples) // 2
+        older = min(samples[:half], key=lambda s: s[1])
+        newer = min(samples[half:], key=lambda s: s[1])
+        if newer[0] == older[0]:
+            return None
+        return (newer[1] - older[1]) * 86400 / (newer[0] - older[0])
+
+
+class ClockDriftEstimator:
+    """ Decide which sensors need their clock set from the advertisements they send """
+
+    def __init__(self, threshold=DRIFT_THRESHOLD_SECONDS, window=WINDOW):
+        self.logger = logging.getLogger('ClockDriftEstimator')
+        self.threshold = threshold
+        self.window = window
+        self.sensors = dict()
+
+    def update(self, ap) -> None:
+        if not ap.adv_valid:
+            return
+        estimate = self.sensors.get(ap.bd_addr)
+        if estimate is None:
+            estimate = ClockEstimate(self.window)
+            self.sensors[ap.bd_addr] = estimate
+        estimate.update(ap)
+
+    def offset(self, bd_addr: str):
+        estimate = self.sensors.get(bd_addr)
+        return None if estimate is None else estimate.offset()
+
+    def needs_sync(self, bd_addr: str) -> bool:
+        estimate = self.sensors.get(bd_addr)
+        if estimate is None:
+            return False
+        if not estimate.time_was_set:
+            return True
+        offset = estimate.offset()
+        return offset is not None and abs(offset) > self.threshold
+
+    def due(self) -> list:
+        """ Addresses of the sensors that need setEpoch """
+        return [bd_addr for bd_addr in self.sensors if self.needs_sync(bd_addr)]
+
+    def synced(self, bd_addr: str) -> None:
+        """ Forget the estimate after the clock was set """
+        self.sensors.pop(bd_addr, None)
+
+    def log_summary(self) -> None:
+        for (bd_addr, estimate) in self.sensors.items():
+            offset = estimate.offset()
+            rate = estimate.drift_rate()
+            self.logger.info(
+                f"{bd_addr} time_was_set: {int(estimate.time_was_set)} "
+                f"offset: {'?' if offset is None else offset} s "
+                f"drift: {'?' if rate is None else f'{rate:.1f}'} s/day "
+                f"records: {len(estimate.samples)}")
+
+
+if __name__ == "__main__":
+    import log_wrapper
+    from adv_parser import AdvParser
+    from bt510_emulator import SensorEmulator
+    log_wrapper.setup(__file__, console_level=logging.DEBUG)
+    estimator = ClockDriftEstimator()
+    sensors = [SensorEmulator("C0FFEE000001", "ahead", clock_offset=120),
+               SensorEmulator("C0FFEE000002", "on time"),
+               SensorEmulator("C0FFEE000003", "not set", time_was_set=False)]
+    for s in sensors:
+        estimator.update(AdvParser(s.advertisement()))
+    estimator.log_summary()
+    logging.info(f"setEpoch needed for {estimator.due()} at {time.time():.0f}")
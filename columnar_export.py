@@ -0,0 +1,259 @@
+
+"""
+Export sensor events and advertisements as Parquet (or Arrow IPC) files.
+
+Event logs are decoded straight from the raw 8 byte records with a numpy
+structured dtype and advertisements are accumulated in typed array columns,
+so no Python object is built per row. Sensor names are dictionary encoded and
+rows are written in row groups as they are added.
+
+python columnar_export.py logs/downloads logs/events.parquet [--store logs/events.db]
+
+Requires pyarrow and numpy (pip install pyarrow).
+"""
+
+import os
+import array
+import logging
+from event_log import SIZE_OF_EVENT
+from event_store import TEMPERATURE_EVENTS, BATTERY_EVENTS
+
+try:
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    np = None
+    pa = None
+
+# Same layout as FOB_EVENT_FORMAT '<LHBB'
+EVENT_DTYPE = None if np is None else np.dtype(
+    [('timestamp', '<u4'), ('data', '<u2'), ('type', 'u1'), ('salt', 'u1')])
+
+ROW_GROUP_SIZE = 64 * 1024
+
+LOG_SCHEMA = None if pa is None else pa.schema([
+    ('sensor', pa.dictionary(pa.int32(), pa.string())),
+    ('bd_addr', pa.dictionary(pa.int32(), pa.string())),
+    ('timestamp', pa.timestamp('s', tz='UTC')),
+    ('salt', pa.uint8()),
+    ('type', pa.uint8()),
+    ('data', pa.uint16()),
+    ('value', pa.float64())])
+
+ADVERTISEMENT_SCHEMA = None if pa is None else pa.schema([
+    ('sensor', pa.dictionary(pa.int32(), pa.string())),
+    ('bd_addr', pa.dictionary(pa.int32(), pa.string())),
+    ('record_number', pa.uint16()),
+    ('record_type', pa.uint8()),
+    ('epoch', pa.timestamp('s', tz='UTC')),
+    ('payload', pa.uint32()),
+    ('flags', pa.uint16()),
+    ('rssi', pa.int8()),
+    ('reset_count', pa.uint8())])
+
+
+def _require_pyarrow() -> None:
+    if pa is None:
+        raise ImportError("columnar export requires pyarrow and numpy (pip install pyarrow)")
+
+
+def scaled_values(events):
+    """
+    Temperature in degrees C and battery in volts (same scaling as EventLog).
+    Other events are the raw data.
+    """
+    value = events['data'].astype(np.float64)
+    temperature = np.isin(events['type'], [int(t) for t in TEMPERATURE_EVENTS])
+    value[temperature] = events['data'][temperature].view(np.int16) / 100.0
+    battery = np.isin(events['type'], [int(t) for t in BATTERY_EVENTS])
+    value[battery] /= 1000.0
+    return value
+
+
+class _Dictionary:
+    """ Codes of a dictionary-encoded string column """
+
+    def __init__(self):
+        self.codes = dict()
+        self.values = list()
+
+    def code(self, s: str) -> int:
+        c = self.codes.get(s)
+        if c is None:
+            c = len(self.values)
+            self.codes[s] = c
+            self.values.append(s)
+        return c
+
+    def array(self, indices):
+        return pa.DictionaryArray.from_arrays(indices, pa.array(self.values, pa.string()))
+
+
+class _ColumnarWriter:
+    def __init__(self, fname: str, schema, row_group_size: int):
+        _require_pyarrow()
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.fname = fname
+        self.schema = schema
+        self.row_group_size = row_group_size
+        self.names = _Dictionary()
+        self.addresses = _Dictionary()
+        self.rows = 0
+        if fname.endswith(".arrow"):
+            # The dictionaries only grow, so each batch adds a delta (an IPC file
+            # can't replace a dictionary)
+            self.writer = pa.ipc.new_file(fname, schema,
+                                          options=pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+        else:
+            self.writer = pq.ParquetWriter(fname, schema, compression="zstd")
+
+    def _write_batch(self, columns: list) -> None:
+        batch = pa.RecordBatch.from_arrays(columns, schema=self.schema)
+        if isinstance(self.writer, pq.ParquetWriter):
+            self.writer.write_batch(batch, row_group_size=self.row_group_size)
+        else:
+            self.writer.write_batch(batch)
+        self.rows += batch.num_rows
+
+    def close(self) -> None:
+        self.flush()
+        self.writer.close()
+        self.logger.info(f"Wrote {self.rows} rows to {self.fname}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class LogWriter(_ColumnarWriter):
+    """ Writes decoded event logs (timestamp, salt, type, data and scaled value) """
+
+    def __init__(self, fname: str, row_group_size=ROW_GROUP_SIZE):
+        super().__init__(fname, LOG_SCHEMA, row_group_size)
+        self.pending = list()
+        self.pending_rows = 0
+
+    def write(self, sensor_name: str, bd_addr: str, data) -> int:
+        """ Add raw events (bytes or a memoryview of 8 byte records), returns the number of events """
+        count = len(data) // SIZE_OF_EVENT
+        if count == 0:
+            return 0
+        events = np.frombuffer(data, dtype=EVENT_DTYPE, count=count)
+        self.pending.append((self.names.code(sensor_name),
+                             self.addresses.code(bd_addr.lower()), events))
+        self.pending_rows += count
+        if self.pending_rows >= self.row_group_size:
+            self.flush()
+        return count
+
+    def flush(self) -> None:
+        if self.pending_rows == 0:
+            return
+        events = np.concatenate([e for (_, _, e) in self.pending])
+        names = np.concatenate([np.full(len(e), n, np.int32) for (n, _, e) in self.pending])
+        addresses = np.concatenate([np.full(len(e), a, np.int32) for (_, a, e) in self.pending])
+        self._write_batch([
+            self.names.array(pa.array(names)),
+            self.addresses.array(pa.array(addresses)),
+            pa.array(events['timestamp'].astype(np.int64), pa.timestamp('s', tz='UTC')),
+            pa.array(events['salt']),
+            pa.array(events['type']),
+            pa.array(events['data']),
+            pa.array(scaled_values(events))])
+        self.pending.clear()
+        self.pending_rows = 0
+
+
+class AdvertisementWriter(_ColumnarWriter):
+    """ Writes the fields of parsed advertisements (AdvParser) """
+
+    def __init__(self, fname: str, row_group_size=ROW_GROUP_SIZE):
+        super().__init__(fname, ADVERTISEMENT_SCHEMA, row_group_size)
+        self._reset()
+
+    def _reset(self) -> None:
+        self.sensor = array.array('i')
+        self.bd_addr = array.array('i')
+        self.record_number = array.array('H')
+        self.record_type = array.array('B')
+        self.epoch = array.array('q')
+        self.payload = array.array('I')
+        self.flags = array.array('H')
+        self.rssi = array.array('b')
+        self.reset_count = array.array('B')
+
+    def add(self, ap, rssi: int) -> None:
+        if not ap.adv_valid:
+            return
+        self.sensor.append(self.names.code(ap.name))
+        self.bd_addr.append(self.addresses.code(ap.bd_addr))
+        self.record_number.append(ap.adv.record_number)
+        self.record_type.append(ap.adv.record_type)
+        self.epoch.append(ap.adv.epoch)
+        self.payload.append(ap.adv.payload)
+        self.flags.append(ap.adv.flags)
+        self.rssi.append(max(-128, min(127, rssi)))
+        self.reset_count.append(ap.adv.reset_count)
+        if len(self.record_number) >= self.row_group_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if len(self.record_number) == 0:
+            return
+
+        def column(a, t):
+            # The array's buffer is used without conversion
+            return pa.Array.from_buffers(t, len(a), [None, pa.py_buffer(a)])
+
+        self._write_batch([
+            self.names.array(column(self.sensor, pa.int32())),
+            self.addresses.array(column(self.bd_addr, pa.int32())),
+            column(self.record_number, pa.uint16()),
+            column(self.record_type, pa.uint8()),
+            column(self.epoch, pa.int64()).cast(pa.timestamp('s', tz='UTC')),
+            column(self.payload, pa.uint32()),
+            column(self.flags, pa.uint16()),
+            column(self.rssi, pa.int8()),
+            column(self.reset_count, pa.uint8())])
+        self._reset()
+
+
+def export_downloads(directory: str, fname: str, names=None) -> int:
+    """
+    Write the logs stored by LogDownloader (directory/<bd_addr>/events.bin).
+    names maps bd_addr to sensor name (EventStore.sensors()).
+    """
+    from log_download import EVENTS_FILE, DownloadState
+    names = names or dict()
+    count = 0
+    with LogWriter(fname) as writer:
+        for bd_addr in sorted(os.listdir(directory)):
+            path = os.path.join(directory, bd_addr, EVENTS_FILE)
+            if not os.path.exists(path):
+                continue
+            committed = DownloadState(os.path.join(directory, bd_addr)).committed
+            with open(path, 'rb') as f:
+                count += writer.write(names.get(bd_addr, ""), bd_addr, f.read(committed))
+    return count
+
+
+if __name__ == "__main__":
+    import argparse
+    import log_wrapper
+    parser = argparse.ArgumentParser(description="Export downloaded event logs to Parquet/Arrow")
+    parser.add_argument("directory", nargs="?", default="logs/downloads")
+    parser.add_argument("output", nargs="?", default="logs/events.parquet",
+                        help="Output file (.parquet or .arrow)")
+    parser.add_argument("--store", help="Event store used for sensor names")
+    args = parser.parse_args()
+    log_wrapper.setup(__file__, console_level=logging.DEBUG)
+    names = None
+    if args.store:
+        from event_store import EventStore
+        store = EventStore(args.store)
+        names = store.sensors()
+        store.close()
+    export_downloads(args.directory, args.output, names)
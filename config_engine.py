@@ -0,0 +1,116 @@
+
+"""
+Apply a sensor configuration only where it is needed.
+
+The configVersion attribute is set with the configuration and is reported in
+the scan response. When the version in the scan response and the hash of the
+configuration match what was last applied to a sensor, no connection is made.
+Otherwise only the attributes that differ from the sensor's dump are written,
+and the sensor is only rebooted when a changed attribute takes effect after
+a reset.
+"""
+
+import os
+import json
+import hashlib
+import logging
+
+STATE_FILE = "logs/config_state.json"
+
+# These attributes take effect after a reset
+REBOOT_ATTRIBUTES = frozenset([
+    "sensorName", "advertisingInterval", "advertisingDuration",
+    "txPower", "useCodedPhy", "networkId"])
+
+
+def config_hash(config: dict) -> str:
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class ConfigEngine:
+    def __init__(self, config: dict, state_file=STATE_FILE):
+        self.logger = logging.getLogger('ConfigEngine')
+        self.config = dict(config)
+        self.hash = config_hash(self.config)
+        # configVersion is a single byte (0 is the factory default)
+        if "configVersion" not in self.config:
+            self.config["configVersion"] = int(self.hash[:8], 16) % 255 + 1
+        self.version = self.config["configVersion"]
+        self.state_file = state_file
+        self.state = dict()
+        try:
+            with open(state_file, 'r') as f:
+                self.state = json.load(f)
+        except (IOError, ValueError):
+            pass
+
+    def _save(self) -> None:
+        directory = os.path.dirname(self.state_file)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        tmp = self.state_file + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f, indent=1)
+        os.replace(tmp, self.state_file)
+
+    def needs_config(self, ap) -> bool:
+        """ False when the scan response shows the configuration was already applied """
+        applied = self.state.get(ap.bd_addr, dict())
+        if applied.get("hash") != self.hash:
+            return True
+        if ap.rsp_has_versions:
+            return ap.rsp.config_version != self.version
+        return False
+
+    def diff(self, attributes: dict) -> dict:
+        """ Attributes whose value in the sensor differs from the configuration """
+        return {k: v for (k, v) in self.config.items() if attributes.get(k) != v}
+
+    def requires_reboot(self, changes: dict) -> bool:
+        return any(k in REBOOT_ATTRIBUTES for k in changes)
+
+    def apply(self, jt, ap) -> bool:
+        """
+        Write the attributes that differ to the connected sensor.
+        The dump saved during the last connection is used while it is still valid.
+        Returns True if the sensor has the configuration.
+        """
+        fail = jt.fail
+        jt.SetSensor(ap, self.state.get(ap.bd_addr, dict()).get("attributes"))
+        snapshot = jt.Snapshot()
+        if snapshot is None:
+            return False
+        changes = self.diff(snapshot.attributes)
+        attributes = dict(snapshot.attributes)
+        if changes:
+            self.logger.info(f"{ap.bd_addr} changing {changes}")
+            jt.Unlock()
+            jt.SetAttributes(**changes)
+            if self.requires_reboot(changes):
+                jt.SendReboot()
+                attributes["resetCount"] = attributes.get("resetCount", 0) + 1
+            else:
+                jt.Lock()
+        else:
+            self.logger.info(f"{ap.bd_addr} already configured")
+        if jt.fail != fail:
+            return False
+        attributes.update(changes)
+        self.state[ap.bd_addr] = {
+            "hash": self.hash,
+            "config_version": self.version,
+            "attributes": attributes}
+        self._save()
+        return True
+
+
+if __name__ == "__main__":
+    import log_wrapper
+    from sensor_config import sensor_config
+    log_wrapper.setup(__file__, console_level=logging.DEBUG)
+    engine = ConfigEngine(sensor_config().get_kwargs())
+    logging.info(f"configVersion {engine.version} hash {engine.hash}")
+    for (bd_addr, applied) in engine.state.items():
+        current = applied.get("hash") == engine.hash
+        logging.info(f"{bd_addr} configVersion {applied.get('config_version')} "
+                     f"{'current' if current else 'out of date'}")
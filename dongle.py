@@ -9,8 +9,17 @@ import threading
 import serial.threaded
 import serial
 import logging
+import json_codec
+import log_buffer
+import capture
+import binascii
+import bounded_queue
+from adv_parser import ScanResult
+from bounded_queue import BoundedQueue
+from rtt_estimator import RttTable, AT_MINIMUMS, at_command_name
 import sys
 import time
+from collections import namedtuple
 sys.path.insert(0, '..')
 
 
@@ -24,9 +33,99 @@ class ATException(Exception):
     pass
 
 
+# AD <address> <rssi> "<advertisement and scan response (hex)>"
+AD_ADDRESS_START = 3
+AD_ADDRESS_END = 17
+
+
+def _scan_result(address: bytes, rssi: bytes, data: bytes) -> ScanResult:
+    """ Raises ValueError (or binascii.Error) if a field is malformed """
+    if len(address) != AD_ADDRESS_END - AD_ADDRESS_START:
+        raise ValueError(address)
+    binascii.unhexlify(address)
+    return ScanResult(address.decode('ascii'), int(rssi), binascii.unhexlify(data))
+
+
+def scan_result(line: bytes):
+    """
+    ScanResult from an AD line or None if it is malformed.
+    The fields are sliced at fixed offsets. Lines with other spacing
+    (or another AD variant) are split into tokens instead.
+    """
+    rssi_end = line.find(b' "', AD_ADDRESS_END + 1)
+    if line[AD_ADDRESS_START - 1:AD_ADDRESS_START] == b' ' and line[AD_ADDRESS_END:AD_ADDRESS_END + 1] == b' ' \
+            and rssi_end >= 0 and line.endswith(b'"'):
+        try:
+            return _scan_result(line[AD_ADDRESS_START:AD_ADDRESS_END],
+                                line[AD_ADDRESS_END + 1:rssi_end], line[rssi_end + 2:-1])
+        except (ValueError, binascii.Error):
+            pass
+    tokens = line.split()
+    if len(tokens) != 4:
+        return None
+    try:
+        return _scan_result(tokens[1], tokens[2], tokens[3].strip(b'"'))
+    except (ValueError, binascii.Error):
+        return None
+
+
 verbose = True
 verbose_bracket = False
 
+ADS_QUEUE_SIZE = 1024
+
+# PairingIoCapability (0=JustWorks, 1=Disp with Y/N, 2=Kboard only, 3=Disp Only 4=Kboard+Disp)
+PAIRING_IO_CAPABILITY = 4
+
+
+def dongle_registers(connection_interval_us: int) -> list:
+    """ S-registers (register, value) set by secondary_initialization """
+    return [
+        # enable max bi-directional throughput and DLE (bits 3 and 4 set)
+        (100, 24),
+        # enable disconnect via ^^^^
+        (109, -1),
+        # use 4 '^' to disconnect
+        (111, 4),
+        # ms delay between '^' to disconnect
+        (210, 250),
+        # us minimum connection interval
+        (300, connection_interval_us),
+        # us maximum connection interval
+        (301, connection_interval_us),
+    ]
+
+
+# S-registers applied before a connection
+# throughput - S100 (bits 3 and 4 enable max bi-directional throughput and DLE)
+ConnectionProfile = namedtuple('ConnectionProfile', ['min_interval_us', 'max_interval_us', 'throughput'])
+
+# Profiles selected by the session for each operation
+BULK = "bulk"                # readLog downloads
+QUICK = "quick"              # a few commands (setEpoch, get, set)
+LOW_POWER = "low_power"      # battery sensitive sensors
+DEFAULT = "default"          # ble_connection_interval_us
+CONNECTION_PROFILES = {
+    BULK: ConnectionProfile(7500, 7500, 24),
+    QUICK: ConnectionProfile(15000, 30000, 24),
+    LOW_POWER: ConnectionProfile(100000, 200000, 0),
+}
+
+# The caller's timeout is always used for connections. The dongle keeps connecting after
+# the host gives up, so an ATD that timed out is cancelled before the next command is sent.
+CONNECT_COMMANDS = ("ATD", "AT+LCON")
+CONNECT_CANCEL = "AT+LCONX"
+
+# Rates supported by the BL654 UART (fastest first)
+BAUD_RATES = (1000000, 921600, 460800, 230400, 115200)
+# Time for the radio to restart after ATZ
+RESET_SECONDS = 2.0
+
+
+def sreg_equal(current, value: int) -> bool:
+    """ Registers are 32 bits (-1 may be read back as 4294967295) """
+    return current is not None and (current & 0xFFFFFFFF) == (value & 0xFFFFFFFF)
+
 
 def laird_dongle_verbose():
     global verbose
@@ -43,12 +142,19 @@ class ATProtocol(serial.threaded.Protocol):
     def __init__(self):
         super().__init__()
         print("protocol init")
-        self.text = ""
+        self.buffer = bytearray()
+        # Set by other threads, the reader thread discards the partial line in buffer
+        self.discard_buffer = False
         self.transport = None
+        self.capture = None
         self.alive = True
-        self.responses = queue.Queue()
-        self.events = queue.Queue()
-        self.ads = queue.Queue()
+        self.responses = BoundedQueue()
+        self.events = BoundedQueue()
+        # The oldest advertisements are dropped (and counted) when the consumer falls behind.
+        # ads_queue_policy can keep only the latest advertisement of each sensor (coalesce)
+        # or only replace repeats of the same advertisement (coalesce_duplicates).
+        self.ads = BoundedQueue(ADS_QUEUE_SIZE, bounded_queue.DROP_OLDEST,
+                                bounded_queue.ad_key, bounded_queue.ad_duplicate_key)
         self._event_thread = threading.Thread(target=self._run_event)
         self._event_thread.daemon = True
         self._event_thread.name = 'at-event'
@@ -56,11 +162,16 @@ class ATProtocol(serial.threaded.Protocol):
         self.lock = threading.Lock()
         self.pairing_done = threading.Event()
         self.no_carrier = threading.Event()
+        # Response times of each command on this link
+        self.rtt = RttTable(AT_MINIMUMS)
+        self.rx_bytes = 0
+        self.tx_bytes = 0
+        self.telemetry = None
 
     def connection_made(self, transport):
         """Store transport"""
         self.transport = transport
-        self.text = ""
+        self.buffer = bytearray()
         self.transport.serial.reset_input_buffer()
         self.transport.serial.reset_output_buffer()
 
@@ -68,7 +179,7 @@ class ATProtocol(serial.threaded.Protocol):
         """Forget transport"""
         super().connection_lost(exc)
         self.transport = None
-        self.text = ""
+        self.buffer = bytearray()
 
     def stop(self):
         """
@@ -93,45 +204,104 @@ class ATProtocol(serial.threaded.Protocol):
         """
         Parse the different types of responses from the BL65x and route them
         to the appropriate queue or handler.
+        The data is kept as bytes; AD lines are parsed without converting them to text.
         """
+        if self.capture is not None:
+            self.capture.record(capture.RX, data)
+        self.rx_bytes += len(data)
         if verbose:
             print(f"data received {data}")
-        self.text += data.decode('utf-8', errors='ignore').strip('\n')
-
-        if self.text == "":
+        if self.discard_buffer:
+            self.discard_buffer = False
+            self.buffer = bytearray()
+        self.buffer += data
+
+        start = self.buffer.find(b'{')
+        if start >= 0 or self.buffer.find(b'}') >= 0:
+            end = self.buffer.rfind(b'}')
+            open_count = self.buffer.count(b'{')
+            close_count = self.buffer.count(b'}')
+            if verbose_bracket:
+                print(f"{start} {end} {open_count} {close_count}")
+            if open_count > 0 and open_count == close_count:
+                # The packet is a view of the buffer (it is replaced, not resized)
+                self.handle_packet(memoryview(self.buffer)[start:end+1])
+                self.buffer = bytearray()
+            elif start >= 0:
+                del self.buffer[:start]
+            else:
+                self.buffer = bytearray()
             return
 
-        start = self.text.find('{')
-        end = self.text.rfind('}')
-        open_count = self.text.count('{')
-        close_count = self.text.count('}')
-        if verbose_bracket:
-            print(f"{start} {end} {open_count} {close_count}")
-        if open_count > 0 and open_count == close_count:
-            self.handle_packet(str(self.text[start:end+1]))
-            self.text = ""
-        elif start >= 0:
-            self.text = self.text[start:]
-        elif end >= 0:
-            self.text = ""
+        # Lines can be split across reads (socket:// returns one byte at a time).
+        # Keep the incomplete line until its '\r' arrives.
+        last = self.buffer.rfind(b'\r')
+        if last < 0:
+            return
+        lines = self.buffer[:last].split(b'\r')
+        del self.buffer[:last+1]
+        for line in lines:
+            line = line.replace(b'\n', b'')
+            if line.startswith(b'AD'):
+                ad = scan_result(line)
+                if ad is not None:
+                    self.ads.put(ad)
+            elif line != b'':
+                self._handle_line(line.decode('utf-8', errors='ignore'))
+
+    def _handle_line(self, line: str) -> None:
+        if line.startswith("NOCARRIER"):
+            self.events.put(line)
+            self.no_carrier.set()
+        elif line.startswith("passkey?"):
+            self.events.put(line)
+        elif line.startswith("encrypt"):
+            self.pairing_done.set()
+        elif line.startswith("discon"):
+            self.no_carrier.set()
         else:
-            for line in self.text.split('\r'):
-                line = line.replace('\r', '').replace('\n', '')
-                if line != "":
-                    if line.startswith("AD"):
-                        self.ads.put(line)
-                    elif line.startswith("NOCARRIER"):
-                        self.events.put(line)
-                        self.no_carrier.set()
-                    elif line.startswith("passkey?"):
-                        self.events.put(line)
-                    elif line.startswith("encrypt"):
-                        self.pairing_done.set()
-                    elif line.startswith("discon"):
-                        self.no_carrier.set()
-                    else:
-                        self.responses.put(line)
-            self.text = ""
+            self.responses.put(line)
+
+    def queues(self) -> dict:
+        return {"ads": self.ads, "events": self.events, "responses": self.responses}
+
+    def configure_queues(self, c: dict) -> None:
+        """
+        Size and policy of each queue from the configuration
+        ("ads_queue_size": 256, "ads_queue_policy": "drop_oldest", ...).
+        """
+        for (name, q) in self.queues().items():
+            if f"{name}_queue_size" in c or f"{name}_queue_policy" in c:
+                q.configure(c.get(f"{name}_queue_size", q.maxsize),
+                            c.get(f"{name}_queue_policy", q.policy))
+
+    def queue_stats(self) -> dict:
+        """ Size and dropped/coalesced counts of each queue """
+        return {name: q.stats() for (name, q) in self.queues().items()}
+
+    def set_capture(self, ring) -> None:
+        """ Record raw data in a capture.CaptureRing (None disables) """
+        self.capture = ring
+
+    def write(self, data: bytes) -> None:
+        """ Write to the port (and capture) """
+        if self.capture is not None:
+            self.capture.record(capture.TX, data)
+        self.tx_bytes += len(data)
+        self.transport.write(data)
+
+    def _phase(self, name: str):
+        return None if self.telemetry is None else self.telemetry.start(name)
+
+    def _phase_end(self, token, outcome="ok", retries=0) -> None:
+        if token is not None:
+            self.telemetry.stop(token, outcome, retries)
+
+    def set_telemetry(self, telemetry) -> None:
+        """ Record the time of each session phase in a session_telemetry.SessionTelemetry (None disables) """
+        self.telemetry = telemetry
+        if telemetry is not None:
+            telemetry.byte_counter = lambda: self.rx_bytes + self.tx_bytes
 
     def handle_packet(self, packet):
         raise NotImplementedError(
@@ -141,26 +311,34 @@ class ATProtocol(serial.threaded.Protocol):
         raise NotImplementedError(
             'Spontaneous message received implement functionality in handle_event')
 
-    def command(self, cmd, response='OK', timeout=1):
+    def command(self, cmd, response='OK', timeout=None):
         """
         Set an AT command and wait for the response.
+        The timeout is estimated from the previous response times of the command.
+        When a timeout is provided it is used until a response has been measured
+        and is the maximum afterwards (connections always use it).
         """
+        name = at_command_name(cmd)
+        if timeout is None or name not in CONNECT_COMMANDS:
+            timeout = self.rtt.timeout(name, timeout)
         cmd = (cmd + '\r').encode('utf-8')
         with self.lock:  # ensure that just one thread is sending commands at once
-            self.transport.write(cmd)
+            self.write(cmd)
+            start = time.monotonic()
             lines = []
             while True:
                 try:
-                    line = self.responses.get(timeout=timeout)
+                    remaining = start + timeout - time.monotonic()
+                    line = self.responses.get(timeout=max(remaining, 0))
                     # print(line)
                     lines.append(line)
-                    if line.startswith(response):
-                        return lines
-                    elif line.startswith("ERROR"):
+                    if line.startswith(response) or line.startswith("ERROR"):
+                        self.rtt.sample(name, time.monotonic() - start)
                         return lines
                 except queue.Empty:
                     # print(lines)
-                    raise ATException(f'AT command timeout for {cmd}')
+                    self.rtt.timed_out(name)
+                    raise ATException(f'AT command timeout for {cmd} ({timeout:.2f} s)')
 
 
 class BL65x(ATProtocol):
@@ -170,41 +348,82 @@ class BL65x(ATProtocol):
     vspConnection = False
     inputJSON = ""
 
-    def __init__(self, fname="config.json"):
+    def __init__(self, fname="config.json", config=None):
         super().__init__()
         print("transport init")
-        self.json_packets = queue.Queue()
+        self.json_packets = BoundedQueue()
+        self.log_buffer = None
         self.allow_non_vsp = True
         self.bd_addrs = []
-        self.connection_interval_ms = 7500
+        self.connection_interval_us = 30000
+        self.profiles = dict(CONNECTION_PROFILES)
+        # Registers currently set in the radio
+        self.profile = None
         self.bd_addr_index = 0
         self.disconnect_timeout = 10.0
         self.connection_timeout = 10.0
         self.passkey = 123456
-        self._bleConfig(fname)
+        self.fast_init = False
+        self.init_time = None
+        # Switch the dongle to the fastest rate up to this (0 disables)
+        self.max_baudrate = 0
+        self._bleConfig(fname, config)
         self.current_addr = self.bd_addrs[self.bd_addr_index]
+        # Successful connections (jtester forgets the selected sensor when this changes)
+        self.connections = 0
         self.logger = logging.getLogger('LairdDongle')
 
-    def _bleConfig(self, fname: str) -> None:
-        with open(fname, 'r') as f:
-            c = json.load(f)
-            if "bd_addrs" in c:
-                self.bd_addrs = c["bd_addrs"]
-            if "bd_addr_index" in c:
-                self.bd_addr_index = c["bd_addr_index"]
-            if "ble_connection_interval_us" in c:
-                self.connection_interval_us = c["ble_connection_interval_us"]
-            if "disconnect_timeout" in c:
-                self.disconnect_timeout = c["disconnect_timeout"]
-            if "connection_timeout" in c:
-                self.connection_timeout = c["connection_timeout"]
-            if "passkey" in c:
-                self.passkey = c["passkey"]
+    def _bleConfig(self, fname: str, c=None) -> None:
+        """ Use the already parsed configuration (c) when it is provided """
+        if c is None:
+            with open(fname, 'r') as f:
+                c = json.load(f)
+        if "bd_addrs" in c:
+            self.bd_addrs = c["bd_addrs"]
+        if "bd_addr_index" in c:
+            self.bd_addr_index = c["bd_addr_index"]
+        if "ble_connection_interval_us" in c:
+            self.connection_interval_us = c["ble_connection_interval_us"]
+        if "disconnect_timeout" in c:
+            self.disconnect_timeout = c["disconnect_timeout"]
+        if "connection_timeout" in c:
+            self.connection_timeout = c["connection_timeout"]
+        if "passkey" in c:
+            self.passkey = c["passkey"]
+        for (name, values) in c.get("connection_profiles", dict()).items():
+            base = self.profiles.get(name, CONNECTION_PROFILES[QUICK])
+            self.profiles[name] = base._replace(**values)
+        if "ble_dongle_max_baudrate" in c:
+            self.max_baudrate = c["ble_dongle_max_baudrate"]
+        if "dongle_fast_init" in c:
+            self.fast_init = c["dongle_fast_init"]
+        if "at_timeout_minimums" in c:
+            self.rtt.set_minimums(c["at_timeout_minimums"])
+        if c.get("serial_capture_file"):
+            self.set_capture(capture.CaptureRing(
+                c["serial_capture_file"], c.get("serial_capture_size", capture.DEFAULT_CAPACITY)))
+        self.configure_queues(c)
+
+    def queues(self) -> dict:
+        d = super().queues()
+        d["json"] = self.json_packets
+        return d
+
+    def set_log_buffer(self, buffer) -> None:
+        """ readLog results are decoded into buffer (None disables) """
+        self.log_buffer = buffer
 
     def handle_packet(self, packet):
+        """ packet is a memoryview of the received bytes """
         #self.logger.debug(f"response {packet}")
+        if self.log_buffer is not None:
+            # readLog results are matched without converting them to text
+            jsonObject = log_buffer.decode_read_log(packet, self.log_buffer)
+            if jsonObject is not None:
+                self.json_packets.put(jsonObject)
+                return
         try:
-            jsonObject = json.loads(packet)
+            jsonObject = json_codec.loads(bytes(packet).decode('utf-8', errors='ignore'))
             self.json_packets.put(jsonObject)
         except ValueError:
             pass
@@ -212,6 +431,7 @@ class BL65x(ATProtocol):
     def handle_event(self, event):
         if event.startswith("NOCARRIER"):
             self.vspConnection = False
+            self.set_log_buffer(None)
             self.logger.info("Disconnected")
         elif event.startswith("passkey?"):
             try:
@@ -244,11 +464,11 @@ class BL65x(ATProtocol):
 
     def scan(self, scanDuration=0, nameMatch="", rssiThreshold=-128):
         logging.debug(f"Starting Scan for {nameMatch}")
-        return self.command(f'AT+LSCN {scanDuration},"{nameMatch}",{rssiThreshold}', timeout=2)
+        return self.command(f'AT+LSCN {scanDuration},"{nameMatch}",{rssiThreshold}')
 
     def cancel_scan(self):
         logging.debug(f"Stopping Scan")
-        return self.command('AT+LSCNX', timeout=2)
+        return self.command('AT+LSCNX')
 
     def allow_pairing(self):
         """
@@ -257,8 +477,25 @@ class BL65x(ATProtocol):
         """
         self.allow_non_vsp = True
 
-    def connect(self, addr, timeout=1):
+    def set_profile(self, name: str) -> None:
+        """ Write the connection profile registers that differ from those in the radio """
+        profile = self.profiles[name]
+        current = self.profile or ConnectionProfile(None, None, None)
+        registers = [(300, profile.min_interval_us), (301, profile.max_interval_us)]
+        if current.max_interval_us is not None and profile.min_interval_us > current.max_interval_us:
+            # The minimum can't be greater than the maximum
+            registers.reverse()
+        registers.append((100, profile.throughput))
+        for (register, value) in registers:
+            if value != current[(300, 301, 100).index(register)]:
+                self.set_attribute(attribute=register, value=value)
+        self.profile = profile
+        self.logger.debug(f"Connection profile {name} {profile}")
+
+    def connect(self, addr, timeout=1, profile=None, retries=0):
         """
+        profile - name of the connection profile to apply before connecting.
+        retries - connection attempts already made (telemetry)
         First try to connect in VSP mode.
         VSP mode previously only allowed just works pairing.
         Otherwise, connect in non-VSP mode so that we can pair.
@@ -271,16 +508,27 @@ class BL65x(ATProtocol):
                 self.responses.queue.clear()
             with self.events.mutex:
                 self.events.queue.clear()
+            self.set_log_buffer(None)
+            if profile is not None:
+                self.set_profile(profile)
+            phase = self._phase("connect")
             try:
                 self.logger.info(f"Attempting to connect to {addr}")
                 self.command(
                     f"ATD {addr}", response='CONNECT', timeout=timeout)
                 self.vspConnection = True
+                self.connections += 1
                 self.logger.info("Connected in VSP mode")
+                self._phase_end(phase, "ok", retries)
             except:
+                self._phase_end(phase, "fail", retries)
+                self._cancel_connect()
                 if self.allow_non_vsp:
                     self.allow_non_vsp = False
                     step_time = 2
+                    phase = self._phase("pairing")
+                    if self.telemetry is not None:
+                        self.telemetry.retry()
                     try:
                         self.logger.info("Attempting non-VSP connection")
                         self.command(
@@ -306,27 +554,57 @@ class BL65x(ATProtocol):
                                 "Now that we have paired in non-VSP mode we can try a VSP connection")
                             # This delay is required in order for the next connection to be successful.
                             time.sleep(step_time)
-                            self.connect(addr, timeout)
+                            self._phase_end(phase, "ok")
+                            phase = None
+                            self.connect(addr, timeout, retries=retries + 1)
                         except:
                             self.logger.info("Unable to pair")
+                            self._phase_end(phase, "fail")
                     except:
                         self.logger.info("Unable to connect in non-VSP mode")
+                        self._phase_end(phase, "fail")
                 else:
                     self.logger.info(
                         "Already tried to connect in non-VSP mode")
 
+    def _late_connect(self) -> bool:
+        """ A CONNECT response arrived after the command timed out """
+        with self.responses.mutex:
+            lines = list(self.responses.queue)
+            self.responses.queue.clear()
+        return any(line.startswith("CONNECT") for line in lines)
+
+    def _cancel_connect(self) -> None:
+        """
+        Stop a connection attempt that timed out on the host so that the next
+        command doesn't collide with it. A connection that completed anyway is closed.
+        """
+        connected = self._late_connect()
+        if not connected:
+            try:
+                lines = self.command(CONNECT_CANCEL, timeout=self.rtt.timeout(CONNECT_CANCEL))
+                connected = any(line.startswith("CONNECT") for line in lines)
+            except ATException:
+                connected = self._late_connect()
+        if connected:
+            self.logger.info("Closing a connection that completed after the timeout")
+            self.vspConnection = True
+            self.disconnect()
+        self.vspConnection = False
+
     def disconnect(self):
         self.no_carrier.clear()
+        self.set_log_buffer(None)
         if self.vspConnection == True:
             with self.lock:
                 self.logger.debug("Requesting Disconnect")
-                self.transport.write(b'^')
+                self.write(b'^')
                 time.sleep(0.300)
-                self.transport.write(b'^')
+                self.write(b'^')
                 time.sleep(0.300)
-                self.transport.write(b'^')
+                self.write(b'^')
                 time.sleep(0.300)
-                self.transport.write(b'^')
+                self.write(b'^')
             self.no_carrier.wait(timeout=self.disconnect_timeout)
 
     def send_json(self, data, delay):
@@ -335,7 +613,7 @@ class BL65x(ATProtocol):
             # flow control.  It shouldn't be necessary for the BLE version.
             # time.sleep(delay)
             with self.lock:
-                self.transport.write(data.encode('utf-8'))
+                self.write(data.encode('utf-8'))
         else:
             self.logger.warning(
                 "Attempt to send VSP data without a connection")
@@ -351,13 +629,132 @@ class BL65x(ATProtocol):
     def get_scan(self, timeout=10):
         try:
             return self.ads.get(timeout=timeout)
-        except:
+        except queue.Empty:
             return None
 
-    def secondary_initialization(self, connection_interval_us=30000):
+    def read_sreg(self, register: int):
+        """ Value of an S-register (None if it can't be read) """
+        for line in self.get_attribute(register):
+            try:
+                return int(line.strip(), 0)
+            except ValueError:
+                pass
+        return None
+
+    def _in_command_mode(self) -> bool:
+        """
+        The radio answers AT commands (it isn't in a VSP connection).
+        Cancelling the scan also stops one left running by a previous script.
+        """
+        try:
+            self.command("AT+LSCNX", timeout=0.5)
+            return True
+        except ATException:
+            return False
+
+    def _probe(self, baudrate: int, duration=0.5) -> bool:
+        """ Set the host port to baudrate and check that the radio answers """
+        port = self.transport.serial
+        port.baudrate = baudrate
+        stop_time = time.monotonic() + duration
+        while True:
+            # Discard anything received at the previous rate
+            port.reset_input_buffer()
+            # The buffer belongs to the reader thread
+            self.discard_buffer = True
+            with self.responses.mutex:
+                self.responses.queue.clear()
+            try:
+                if self.command("AT", timeout=0.2)[-1].startswith("OK"):
+                    return True
+            except ATException:
+                pass
+            if time.monotonic() > stop_time:
+                return False
+
+    def find_baudrate(self):
+        """ The rate the radio is using (the configured rate is tried first) """
+        current = self.transport.serial.baudrate
+        for baudrate in (current,) + tuple(b for b in BAUD_RATES if b != current):
+            if self._probe(baudrate):
+                return baudrate
+        self.transport.serial.baudrate = current
+        return None
+
+    def _switch_baudrate(self, baudrate: int, duration=RESET_SECONDS) -> bool:
+        """ Save the rate in the radio, reset it and confirm it answers at the new rate """
+        lines = self.command(f"ATS 302={baudrate}")
+        if lines[-1].startswith("ERROR"):
+            return False
+        self.save_sregs()
+        self.reset()
+        return self._probe(baudrate, duration) and self.get_mac_address()[-1].startswith("OK")
+
+    def negotiate_baudrate(self, max_baudrate=None):
+        """
+        Switch the radio and the host port to the fastest rate supported by both
+        (up to max_baudrate). The rate is saved in the radio (ATS 302, AT&W, ATZ).
+        If the radio doesn't answer at the new rate the previous rate is restored.
+        Returns the rate in use (None if the radio doesn't answer).
+        """
+        max_baudrate = max_baudrate or self.max_baudrate
+        port = self.transport.serial
+        current = self.find_baudrate()
+        if current is None:
+            self.logger.error("Radio doesn't answer at any rate")
+            return None
+        for baudrate in BAUD_RATES:
+            if baudrate <= current:
+                break
+            if baudrate > max_baudrate:
+                continue
+            try:
+                # Check that the host port supports the rate before changing the radio
+                port.baudrate = baudrate
+                port.baudrate = current
+            except (ValueError, serial.SerialException):
+                self.logger.debug(f"Port doesn't support {baudrate}")
+                port.baudrate = current
+                continue
+            self.logger.info(f"Changing rate from {current} to {baudrate}")
+            try:
+                if self._switch_baudrate(baudrate):
+                    self.logger.info(f"Radio rate is {baudrate} (set ble_dongle_baudrate to open it directly)")
+                    return baudrate
+            except ATException:
+                pass
+            self.logger.warning(f"Radio didn't answer at {baudrate}, restoring {current}")
+            restored = self.find_baudrate()
+            try:
+                if restored == current:
+                    # The new rate is saved and would be used after the next reset
+                    self.command(f"ATS 302={current}")
+                    self.save_sregs()
+                elif restored is not None:
+                    self._switch_baudrate(current)
+            except ATException:
+                pass
+            if self.find_baudrate() != current:
+                self.logger.error("Unable to restore the previous rate")
+                return None
+        port.baudrate = current
+        return current
+
+    def secondary_initialization(self, connection_interval_us=None, fast=None):
         """
         After the serial port is open - initialize the BLE dongle.
+        fast - the registers are read and only those that differ are written.
+        The radio is only reset when it doesn't respond or a saved register changes.
+        (default: dongle_fast_init in the configuration)
+        connection_interval_us - (default: ble_connection_interval_us)
         """
+        start = time.monotonic()
+        if connection_interval_us is None:
+            connection_interval_us = self.connection_interval_us
+        if fast is None:
+            fast = self.fast_init
+        if self.max_baudrate:
+            self.negotiate_baudrate()
         # Bug 17747
         # The soft reset will only work if the radio isn't in a
         # connection. Since the FTDI DCD line is connected to the
@@ -366,34 +763,34 @@ class BL65x(ATProtocol):
         # reset of the radio on start-up.
         #
         # Workaround - Unplug dongle and then plug it back in.
-        self.reset()
-        self.logger.debug("Radio Reset")
+        resets = 0
+        if not fast or not self._in_command_mode():
+            self.reset()
+            resets += 1
+            self.logger.debug("Radio Reset")
         self.logger.debug(f"Dongle BD Address: {self.get_mac_address()}")
 
         self.logger.debug("Initializing radio")
-        # enable max bi-directional throughput and DLE (bits 3 and 4 set)
-        self.set_attribute(attribute=100, value=24)
-        # enable disconnect via ^^^^
-        self.set_attribute(attribute=109, value=-1)
-        # use 4 '^' to disconnect
-        self.set_attribute(attribute=111, value=4)
-        # ms delay between '^' to disconnect
-        self.set_attribute(attribute=210, value=250)
-        # us minimum connection interval
-        self.set_attribute(attribute=300, value=connection_interval_us)
-        # us maximum connection interval
-        self.set_attribute(attribute=301, value=connection_interval_us)
+        written = 0
+        for (register, value) in dongle_registers(connection_interval_us):
+            if fast and sreg_equal(self.read_sreg(register), value):
+                continue
+            self.set_attribute(attribute=register, value=value)
+            written += 1
         # Pairing mode cannot be set on-the-fly
-        if self.get_attribute(attribute=107) != '4':
-            # PairingIoCapability (0=JustWorks, 1=Disp with Y/N, 2=Kboard only, 3=Disp Only 4=Kboard+Disp)
-            self.set_attribute(attribute=107, value=4)
+        if not sreg_equal(self.read_sreg(107), PAIRING_IO_CAPABILITY):
+            self.set_attribute(attribute=107, value=PAIRING_IO_CAPABILITY)
             self.save_sregs()
             self.reset()
+            written += 1
+            resets += 1
+        self.profile = ConnectionProfile(connection_interval_us, connection_interval_us, 24)
+        self.profiles.setdefault(DEFAULT, self.profile)
         # Return advertisement data when scanning
         self.command("AT+SFMT 1", response='OK')
-        self.logger.info("Radio initialized")
-
-        pass
+        self.init_time = time.monotonic() - start
+        self.logger.info(f"Radio initialized in {self.init_time * 1000:.0f} ms "
+                         f"({written} registers written, {resets} resets)")
 
 
 if __name__ == "__main__":
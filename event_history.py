@@ -0,0 +1,152 @@
+
+"""
+Recent advertisement history of each sensor in fixed size columns.
+
+Each sensor has a ring of typed arrays (epoch, type, record_number, value and
+rssi) that is allocated once. Every sample is written twice (at i and
+i + capacity) so that the last n samples are always contiguous and can be
+returned as memoryviews (or numpy arrays) without copying.
+About 24 bytes are used per sample; 5000 sensors x 288 samples (a day of
+5 minute samples) is ~35 MB.
+"""
+
+import array
+import logging
+from event_store import scaled_value, SOURCE_ADVERTISEMENT, TEMPERATURE_EVENTS
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DEFAULT_CAPACITY = 288
+
+COLUMNS = (("epoch", 'I'), ("type", 'B'), ("record_number", 'H'), ("value", 'f'), ("rssi", 'b'))
+
+
+class SensorHistory:
+    """ Ring of the last capacity samples of one sensor """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.head = 0
+        self.count = 0
+        self.columns = {name: array.array(code, bytes(2 * capacity * array.array(code).itemsize))
+                        for (name, code) in COLUMNS}
+        self.views = {name: memoryview(a) for (name, a) in self.columns.items()}
+        self.epoch = self.columns["epoch"]
+        self.type = self.columns["type"]
+        self.record_number = self.columns["record_number"]
+        self.value = self.columns["value"]
+        self.rssi = self.columns["rssi"]
+
+    def add(self, epoch: int, event_type: int, record_number: int, value: float, rssi: int) -> None:
+        i = self.head
+        j = i + self.capacity
+        self.epoch[i] = self.epoch[j] = epoch
+        self.type[i] = self.type[j] = event_type
+        self.record_number[i] = self.record_number[j] = record_number
+        self.value[i] = self.value[j] = value
+        self.rssi[i] = self.rssi[j] = rssi
+        self.head = (i + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def last(self, n=None) -> dict:
+        """ memoryviews of the last n samples (oldest first) of each column """
+        n = self.count if n is None else min(n, self.count)
+        end = self.head + self.capacity
+        return {name: v[end - n:end] for (name, v) in self.views.items()}
+
+    def since(self, epoch: int) -> dict:
+        """
+        Columns of the samples (oldest first) at or after epoch.
+        Epochs aren't always in arrival order (sensor clock reset, setEpoch,
+        advertisements merged with the log) so every sample is checked.
+        memoryviews of the ring are returned when the samples are the newest ones,
+        otherwise the columns are copied.
+        """
+        columns = self.last()
+        selected = [i for (i, e) in enumerate(columns["epoch"]) if e >= epoch]
+        n = len(selected)
+        if n == 0 or selected[0] == self.count - n:
+            return self.last(n)
+        return {name: memoryview(array.array(v.format, [v[i] for i in selected]))
+                for (name, v) in columns.items()}
+
+
+def as_numpy(columns: dict) -> dict:
+    """ numpy arrays that share memory with the columns """
+    if np is None:
+        raise ImportError("numpy is required")
+    return {name: np.frombuffer(v, dtype=v.format) for (name, v) in columns.items()}
+
+
+class EventHistory:
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.logger = logging.getLogger('EventHistory')
+        self.capacity = capacity
+        self.sensors = dict()
+
+    def add(self, ap) -> None:
+        """ Add the event in a parsed advertisement (called when SensorEvent.update returns True) """
+        h = self.sensors.get(ap.bd_addr)
+        if h is None:
+            h = SensorHistory(self.capacity)
+            self.sensors[ap.bd_addr] = h
+        adv = ap.adv
+        h.add(adv.epoch, adv.record_type, adv.record_number,
+              scaled_value(adv.record_type, adv.payload, SOURCE_ADVERTISEMENT),
+              max(-128, min(127, ap.rssi)))
+
+    def window(self, bd_addr: str, seconds: int, now: int) -> dict:
+        """ Columns of the samples of a sensor in the last seconds before now (epoch) """
+        h = self.sensors.get(bd_addr)
+        if h is None:
+            return SensorHistory(1).last(0)
+        return h.since(now - seconds)
+
+    def memory(self) -> int:
+        """ Bytes used by the columns """
+        return sum(a.itemsize * len(a) for h in self.sensors.values() for a in h.columns.values())
+
+    def log_summary(self, seconds=3600) -> None:
+        """ Samples of each sensor in the last seconds (of its newest sample) """
+        for (bd_addr, h) in self.sensors.items():
+            if h.count == 0:
+                continue
+            newest = h.last(1)["epoch"][0]
+            w = h.since(newest - seconds)
+            temperatures = [v for (t, v) in zip(w["type"], w["value"]) if t in TEMPERATURE_EVENTS]
+            text = f"{bd_addr} {len(w['epoch'])} samples in the last {seconds} s"
+            if temperatures:
+                text += f" temperature {min(temperatures):.2f} - {max(temperatures):.2f} C"
+            self.logger.info(text)
+        self.logger.debug(f"{len(self.sensors)} sensors {self.memory()} bytes")
+
+
+def open_history(c: dict):
+    """ History with event_history_samples per sensor (None if the key isn't set) """
+    capacity = c.get("event_history_samples")
+    if not capacity:
+        return None
+    return EventHistory(int(capacity))
+
+
+if __name__ == "__main__":
+    import time
+    import log_wrapper
+    from adv_parser import AdvParser
+    from bt510_emulator import build_fleet
+    log_wrapper.setup(__file__, console_level=logging.INFO)
+    history = EventHistory(capacity=8)
+    fleet = build_fleet(3)
+    for sensor in fleet.values():
+        for n in range(10):
+            sensor.record_number += 1
+            sensor.last_event = (int(time.time()) - 600 * (10 - n), 2000 + n, 1)
+            history.add(AdvParser(sensor.advertisement()))
+    for (bd_addr, h) in history.sensors.items():
+        w = history.window(bd_addr, 3600, int(time.time()))
+        logging.info(f"{bd_addr} {list(w['record_number'])} {list(w['value'])}")
+    logging.info(f"{history.memory()} bytes")
@@ -6,7 +6,6 @@ Reads base64 encoded BT510 logs, decode them, and write them to a file.
 import time
 import logging
 import struct
-from collections import namedtuple
 import base64
 from ctypes import c_int16
 from sensor_event import SensorEventType
@@ -16,6 +15,7 @@ from sensor_event import ResetReason
 # Salt is used to keep order in the log for items that occur at the same time
 FOB_EVENT_FORMAT = '<LHBB'
 FOB_EVENT_FIELDS = "timestamp data type salt"
+EVENT_FIELD_NAMES = FOB_EVENT_FIELDS.split()
 SIZE_OF_EVENT = 8
 RECORD_DELIMITER = ';'
 
@@ -39,14 +39,18 @@ class EventLog:
     def parse(self, event_list):
         """
         Generate a list of dictionaries from a list of lists in
-        the form of [size, base64 encoded data]
+        the form of [size, base64 encoded data].
+        The data can also be bytes (or a memoryview) that were already decoded.
         """
         for (size, b64) in event_list:
-            try:
-                buf = base64.standard_b64decode(b64)
-            except:
-                self.logger.debug("Base64 decode error")
-                return
+            if isinstance(b64, str):
+                try:
+                    buf = base64.standard_b64decode(b64)
+                except:
+                    self.logger.debug("Base64 decode error")
+                    return
+            else:
+                buf = b64
 
             if (size % SIZE_OF_EVENT) != 0:
                 self.logger.debug("Size isn't a multiple of event")
@@ -57,16 +61,16 @@ class EventLog:
 
     def _unpack_event(self, size, buf):
         try:
-            for n in range(0, size, SIZE_OF_EVENT):
-                t = namedtuple("event", FOB_EVENT_FIELDS)._make(
-                    struct.unpack_from(FOB_EVENT_FORMAT, buf, n))
-                self.events.append(dict(t._asdict()))
+            for t in struct.iter_unpack(FOB_EVENT_FORMAT, buf[:size]):
+                self.events.append(dict(zip(EVENT_FIELD_NAMES, t)))
         except:
             self.logger.debug("Event log unpack error")
 
-    def write(self, sensor_name: str, event_count: int) -> None:
-        ofile = "logs/" + sensor_name + '_' + time.strftime('%d%b%y_%H%M%S', time.localtime(
-            time.time())) + "_" + str(event_count) + ".sensor_events.log"
+    def write(self, sensor_name: str, event_count: int, ofile=None) -> None:
+        """ ofile - (default: logs/<sensor_name>_<time>_<event_count>.sensor_events.log) """
+        if ofile is None:
+            ofile = "logs/" + sensor_name + '_' + time.strftime('%d%b%y_%H%M%S', time.localtime(
+                time.time())) + "_" + str(event_count) + ".sensor_events.log"
         last_timestamp = 0
         with open(ofile, 'w') as f:
             f.write(self._output_formatter("Index", "Epoch", "Salt",
@@ -0,0 +1,201 @@
+
+"""
+SQLite store for sensor events.
+
+Events read from sensor logs and events received in advertisements are kept
+in one table. Ingest is batched (executemany) in WAL mode and is idempotent:
+a row is identified by (bd_addr, timestamp, salt) for each source.
+Advertisements don't have a salt so the record number is used.
+"""
+
+import time
+import struct
+import sqlite3
+import logging
+from ctypes import c_int16, c_uint16
+from event_log import FOB_EVENT_FORMAT, SIZE_OF_EVENT
+from sensor_event import SensorEventType
+
+SOURCE_LOG = 0
+SOURCE_ADVERTISEMENT = 1
+
+TEMPERATURE_EVENTS = frozenset([
+    SensorEventType.TEMPERATURE,
+    SensorEventType.ALARM_HIGH_TEMP_1,
+    SensorEventType.ALARM_HIGH_TEMP_2,
+    SensorEventType.ALARM_HIGH_TEMP_CLEAR,
+    SensorEventType.ALARM_LOW_TEMP_1,
+    SensorEventType.ALARM_LOW_TEMP_2,
+    SensorEventType.ALARM_LOW_TEMP_CLEAR,
+    SensorEventType.ALARM_DELTA_TEMP,
+    SensorEventType.ALARM_TEMPERATURE_RATE_OF_CHANGE])
+
+BATTERY_EVENTS = frozenset([
+    SensorEventType.BATTERY_GOOD,
+    SensorEventType.BATTERY_BAD,
+    SensorEventType.ADV_ON_BUTTON])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    bd_addr TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    salt INTEGER NOT NULL,
+    source INTEGER NOT NULL,
+    type INTEGER NOT NULL,
+    data INTEGER NOT NULL,
+    UNIQUE (bd_addr, timestamp, salt, source)
+);
+CREATE INDEX IF NOT EXISTS events_by_type ON events (type, timestamp);
+CREATE TABLE IF NOT EXISTS sensors (
+    bd_addr TEXT PRIMARY KEY,
+    name TEXT NOT NULL
+);
+"""
+
+INSERT_EVENT = "INSERT OR IGNORE INTO events (bd_addr, timestamp, salt, source, type, data) VALUES (?, ?, ?, ?, ?, ?)"
+UPSERT_SENSOR = "INSERT INTO sensors (bd_addr, name) VALUES (?, ?) ON CONFLICT (bd_addr) DO UPDATE SET name = excluded.name"
+
+
+def scaled_value(event_type: int, data: int, source=SOURCE_LOG) -> float:
+    """
+    Temperature in degrees C and battery in volts (same scaling as EventLog and SensorEvent).
+    Other events return the raw data.
+    """
+    if event_type in TEMPERATURE_EVENTS:
+        return c_int16(data).value / 100.0
+    elif event_type in BATTERY_EVENTS:
+        if source == SOURCE_ADVERTISEMENT:
+            return c_uint16(data).value / 100.0
+        return data / 1000.0
+    return float(data)
+
+
+def same_reading(event_type: int, data: int, source: int, other_data: int, other_source: int) -> bool:
+    """
+    The data of two events of the same type is the same reading. The sources store
+    different payloads (32 bit temperatures and 10 mV battery voltages in advertisements).
+    """
+    if source == other_source:
+        return data == other_data
+    value = scaled_value(event_type, data, source)
+    other = scaled_value(event_type, other_data, other_source)
+    if event_type in BATTERY_EVENTS:
+        return abs(value - other) < 0.01
+    return value == other
+
+
+class EventStore:
+    def __init__(self, fname="logs/events.db", batch_size=500, flush_interval=5.0):
+        self.logger = logging.getLogger('EventStore')
+        self.conn = sqlite3.connect(fname)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending_ads = list()
+        self.pending_names = dict()
+        self.last_flush = time.monotonic()
+        # RollupEngine (updated after each write)
+        self.rollups = None
+
+    def _written(self) -> None:
+        if self.rollups is not None:
+            self.rollups.update()
+
+    def ingest_log(self, bd_addr: str, events) -> int:
+        """
+        Store events read from a sensor log.
+        events can be raw event bytes (or a memoryview) or an EventLog.
+        Returns the number of new events.
+        """
+        bd_addr = bd_addr.lower()
+        if isinstance(events, (bytes, bytearray, memoryview)):
+            size = len(events) - (len(events) % SIZE_OF_EVENT)
+            rows = ((bd_addr, timestamp, salt, SOURCE_LOG, event_type, data)
+                    for (timestamp, data, event_type, salt)
+                    in struct.iter_unpack(FOB_EVENT_FORMAT, events[:size]))
+        else:
+            rows = ((bd_addr, e['timestamp'], e['salt'], SOURCE_LOG, e['type'], e['data'])
+                    for e in events.events)
+        before = self.conn.total_changes
+        with self.conn:
+            self.conn.executemany(INSERT_EVENT, rows)
+        count = self.conn.total_changes - before
+        self._written()
+        return count
+
+    def ingest_advertisement(self, ap) -> None:
+        """
+        Queue the event in a parsed advertisement (AdvParser).
+        Call when SensorEvent.update returns True. Rows are written in batches.
+        """
+        if not ap.adv_valid:
+            return
+        self.pending_ads.append((ap.bd_addr, ap.adv.epoch, ap.adv.record_number,
+                                 SOURCE_ADVERTISEMENT, ap.adv.record_type, ap.adv.payload))
+        if ap.name:
+            self.pending_names[ap.bd_addr] = ap.name
+        if (len(self.pending_ads) >= self.batch_size or
+                time.monotonic() - self.last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self) -> int:
+        """ Write queued advertisement events, returns the number of new events """
+        before = self.conn.total_changes
+        with self.conn:
+            self.conn.executemany(INSERT_EVENT, self.pending_ads)
+            self.conn.executemany(UPSERT_SENSOR, self.pending_names.items())
+        self.pending_ads.clear()
+        self.pending_names.clear()
+        self.last_flush = time.monotonic()
+        count = self.conn.total_changes - before
+        self._written()
+        return count
+
+    def set_name(self, bd_addr: str, name: str) -> None:
+        with self.conn:
+            self.conn.execute(UPSERT_SENSOR, (bd_addr.lower(), name))
+
+    def events(self, bd_addr: str, start=0, end=0xFFFFFFFF, source=None) -> list:
+        """ (timestamp, salt, source, type, data) for a sensor in a time range """
+        query = "SELECT timestamp, salt, source, type, data FROM events WHERE bd_addr = ? AND timestamp BETWEEN ? AND ?"
+        params = [bd_addr.lower(), start, end]
+        if source is not None:
+            query += " AND source = ?"
+            params.append(source)
+        return self.conn.execute(query + " ORDER BY timestamp, salt", params).fetchall()
+
+    def events_by_type(self, event_type: int, start=0, end=0xFFFFFFFF) -> list:
+        """ (bd_addr, timestamp, salt, source, data) of one type for all sensors in a time range """
+        return self.conn.execute(
+            "SELECT bd_addr, timestamp, salt, source, data FROM events "
+            "WHERE type = ? AND timestamp BETWEEN ? AND ? ORDER BY timestamp",
+            (int(event_type), start, end)).fetchall()
+
+    def sensors(self) -> dict:
+        return dict(self.conn.execute("SELECT bd_addr, name FROM sensors").fetchall())
+
+    def close(self) -> None:
+        self.flush()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == "__main__":
+    import sys
+    import log_wrapper
+    log_wrapper.setup(__file__, console_level=logging.DEBUG)
+    # Summary of a store: python event_store.py logs/events.db
+    store = EventStore(sys.argv[1] if len(sys.argv) > 1 else "logs/events.db")
+    for (bd_addr, count, first, last) in store.conn.execute(
+            "SELECT bd_addr, COUNT(*), MIN(timestamp), MAX(timestamp) FROM events GROUP BY bd_addr"):
+        logging.info(f"{bd_addr} {store.sensors().get(bd_addr, '')} {count} events "
+                     f"{time.strftime('%d %b %y %H:%M:%S', time.localtime(first))} - "
+                     f"{time.strftime('%d %b %y %H:%M:%S', time.localtime(last))}")
+    store.close()
@@ -10,7 +10,7 @@ from dongle import BL65x
 from json_commander import jtester
 from json_config import JsonConfig
 from sensor_event import SensorEvent
-from adv_parser import AdvParser
+from adv_parser import parse_scan
 import metrics
 import boto3
 
@@ -32,17 +32,7 @@ if __name__ == "__main__":
         event_dict = dict()
         while True:
             ad = bt_module.get_scan(timeout=None)
-            ap = None
-            try:
-                junk, address, rssi, ad_rsp = ad.split(' ')
-                logging.debug(f"{address} {rssi} {ad_rsp}")
-            except:
-                logging.info("unable to split advertisement")
-
-            try:
-                ap = AdvParser(ad_rsp.strip('"'))
-            except:
-                logging.info("unable to parse")
+            ap = parse_scan(ad)
 
             if ap is not None:
                 if ap.adv_valid:
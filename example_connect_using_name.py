@@ -8,7 +8,7 @@ import log_wrapper
 from json_config import JsonConfig
 from dongle import BL65x
 from json_commander import jtester
-from adv_parser import AdvParser
+from adv_parser import parse_scan
 
 if __name__ == "__main__":
     log_wrapper.setup(__file__, console_level=logging.DEBUG)
@@ -26,13 +26,7 @@ if __name__ == "__main__":
         configured_devices = dict()
         while number_of_devices_to_look_for > 0:
             ad = bt_module.get_scan(timeout=None)
-            ap = None
-            try:
-                junk, address, rssi, ad_rsp = ad.split(' ')
-                logging.debug(f"{address} {rssi} {ad_rsp}")
-                ap = AdvParser(ad_rsp.strip('"'))
-            except:
-                logging.debug("unable to process advertisement")
+            ap = parse_scan(ad)
 
             if ap is not None:
                 if ap.adv_valid:
@@ -44,11 +38,10 @@ if __name__ == "__main__":
                         bt_module.connect(ap.get_at_bd_addr(),
                                           bt_module.connection_timeout)
                         if bt_module.vspConnection:
-                            jt.GetAttribute("sensorName")
-                            jt.GetAttribute("location")
-                            jt.GetAttribute("firmwareVersion")
-                            jt.GetAttribute("bluetoothAddress")
-                            jt.GetAttribute("activeMode")
+                            # One dump instead of a get for each attribute
+                            jt.SetSensor(ap)
+                            jt.GetAttributes("sensorName", "location", "firmwareVersion",
+                                             "bluetoothAddress", "activeMode")
                             configured_devices[ap.bd_addr] = True
                             number_of_devices_to_look_for -= 1
                         bt_module.disconnect()
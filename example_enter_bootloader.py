@@ -14,7 +14,7 @@ from dongle import BL65x
 from json_config import JsonConfig
 from sensor_config import sensor_config
 from json_commander import jtester
-from adv_parser import AdvParser
+from adv_parser import parse_scan
 
 if __name__ == "__main__":
     log_wrapper.setup(__file__, console_level=logging.DEBUG)
@@ -32,13 +32,7 @@ if __name__ == "__main__":
         configured_devices = dict()
         while number_of_devices_to_look_for > 0:
             ad = bt_module.get_scan(timeout=None)
-            ap = None
-            try:
-                junk, address, rssi, ad_rsp = ad.split(' ')
-                logging.debug(f"{address} {rssi} {ad_rsp}")
-                ap = AdvParser(ad_rsp.strip('"'))
-            except:
-                logging.debug("unable to process advertisement")
+            ap = parse_scan(ad)
 
             if ap is not None:
                 if ap.adv_valid:
@@ -13,7 +13,7 @@ from dongle import BL65x
 from json_commander import jtester
 from json_config import JsonConfig
 from sensor_event import SensorEvent
-from adv_parser import AdvParser
+from adv_parser import parse_scan
 
 if __name__ == "__main__":
     log_wrapper.setup(__file__, console_level=logging.INFO)
@@ -32,13 +32,7 @@ if __name__ == "__main__":
         while True:
             ad = bt_module.get_scan(timeout=None)
             do_query = False
-            ap = None
-            try:
-                junk, address, rssi, ad_rsp = ad.split(' ')
-                logging.debug(f"{address} {rssi} {ad_rsp}")
-                ap = AdvParser(ad_rsp.strip('"'))
-            except:
-                logging.debug("unable to process advertisement")
+            ap = parse_scan(ad)
 
             if ap is not None:
                 if ap.adv_valid:
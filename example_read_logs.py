@@ -11,11 +11,11 @@ import serial.threaded
 import logging
 import log_wrapper
 from json_config import JsonConfig
-from dongle import BL65x
+from dongle import BL65x, BULK
 from json_commander import jtester
-from adv_parser import AdvParser
-from event_log import EventLog
-from event_log import get_number_of_events_in_list
+from adv_parser import parse_scan
+from log_download import LogDownloader
+from inventory import open_inventory
 
 if __name__ == "__main__":
     log_wrapper.setup(__file__, console_level=logging.DEBUG)
@@ -26,22 +26,21 @@ if __name__ == "__main__":
     with serial.threaded.ReaderThread(ser, BL65x) as bt_module:
         jt = jtester()
         jt.set_protocol(bt_module)
+        downloader = LogDownloader(jt)
         bt_module.secondary_initialization()
         name_to_look_for = jc.get("name_to_look_for")
         number_of_devices_to_look_for = jc.get("number_of_devices_to_look_for")
+        # When there is an inventory, only the expected sensors are read
+        inventory = open_inventory(jc.config)
         bt_module.scan(nameMatch=name_to_look_for)
         configured_devices = dict()
-        while number_of_devices_to_look_for > 0:
+        while number_of_devices_to_look_for > 0 if inventory is None else not inventory.complete():
             ad = bt_module.get_scan(timeout=None)
-            ap = None
-            try:
-                junk, address, rssi, ad_rsp = ad.split(' ')
-                logging.debug(f"{address} {rssi} {ad_rsp}")
-                ap = AdvParser(ad_rsp.strip('"'))
-            except:
-                logging.debug("unable to process advertisement")
+            ap = parse_scan(ad)
 
             if ap is not None:
+                if inventory is not None and ap.adv_valid and not inventory.expected(ap):
+                    continue
                 if ap.adv_valid:
                     # Use a dictionary of address and last events because the
                     # event handler doesn't handle events from different devices.
@@ -50,37 +49,25 @@ if __name__ == "__main__":
                         logging.debug("Preparing to read logs")
                         bt_module.allow_pairing()
                         bt_module.connect(ap.get_at_bd_addr(),
-                                          bt_module.connection_timeout)
+                                          bt_module.connection_timeout, BULK)
                         if bt_module.vspConnection:
-                            events = list()
-                            total_events = count = jt.PrepareLog()
-                            # limited in sensor (by JSON buffer size) to 128
-                            events_per_read = 500
-                            # Acking more than was read allows don't care items to be discarded.
-                            do_not_over_ack = True
-                            while count > 0:
-                                # size, base-64 data
-                                lst = jt.ReadLog(events_per_read)
-                                events_read = get_number_of_events_in_list(lst)
-                                if events_read == 0:
-                                    count = 0
-                                else:
-                                    events.append(lst)
-                                    count -= events_read
-                                    jt.AckLog(
-                                        events_read if do_not_over_ack else 200)
-
-                            event_log = EventLog(events)
-                            event_log.write(name_to_look_for, total_events)
+                            # Each chunk is stored before it is acked. If the connection
+                            # is lost the download resumes on the next connection.
+                            downloader.download(ap.bd_addr)
+                            downloader.export(ap.bd_addr, name_to_look_for)
 
                             jt.SetEpoch(int(time.time()))
                             bt_module.disconnect()
                             jt.LogResults()
                             configured_devices[ap.bd_addr] = True
                             number_of_devices_to_look_for -= 1
+                            if inventory is not None:
+                                inventory.see(ap)
                         bt_module.scan(nameMatch=name_to_look_for)
                     else:
                         logging.debug("device already in database")
 
         bt_module.cancel_scan()
+        if inventory is not None:
+            inventory.log_result()
         logging.debug("Log Read")
@@ -2,6 +2,10 @@
 """
 Connect to a sensor and set its clock (pseudo-rtc).
 Laird Connectivity BT510 uses seconds from 1970 (an unsigned 32-bit number).
+Only sensors whose clock offset (estimated from advertisements) is beyond the
+threshold or whose time was never set are connected to. Sensors that are in
+sync count towards number_of_devices_to_look_for and the scan stops after
+set_epoch_scan_duration_seconds (default 900).
 """
 
 import time
@@ -10,9 +14,10 @@ import serial.threaded
 import logging
 import log_wrapper
 from json_config import JsonConfig
-from dongle import BL65x
+from dongle import BL65x, QUICK
 from json_commander import jtester
-from adv_parser import AdvParser
+from adv_parser import parse_scan
+from clock_drift import ClockDriftEstimator, DRIFT_THRESHOLD_SECONDS
 
 if __name__ == "__main__":
     log_wrapper.setup(__file__, console_level=logging.DEBUG)
@@ -28,26 +33,32 @@ if __name__ == "__main__":
         number_of_devices_to_look_for = jc.get("number_of_devices_to_look_for")
         bt_module.scan(nameMatch=name_to_look_for)
         configured_devices = dict()
-        while number_of_devices_to_look_for > 0:
-            ad = bt_module.get_scan(timeout=None)
-            ap = None
-            try:
-                junk, address, rssi, ad_rsp = ad.split(' ')
-                logging.debug(f"{address} {rssi} {ad_rsp}")
-                ap = AdvParser(ad_rsp.strip('"'))
-            except:
-                logging.debug("unable to process advertisement")
+        estimator = ClockDriftEstimator(jc.get_optional(
+            "clock_drift_threshold_seconds", DRIFT_THRESHOLD_SECONDS))
+        # Stop when the clock of number_of_devices_to_look_for sensors was set or found to be in sync
+        stop_time = time.time() + jc.get_optional("set_epoch_scan_duration_seconds", 900)
+        while number_of_devices_to_look_for > 0 and time.time() < stop_time:
+            ad = bt_module.get_scan(timeout=1.0)
+            ap = parse_scan(ad)
 
             if ap is not None:
                 if ap.adv_valid:
                     # Use a dictionary of address and last events because the
                     # event handler doesn't handle events from different devices.
-                    if ap.bd_addr not in configured_devices:
+                    estimator.update(ap)
+                    if ap.bd_addr in configured_devices:
+                        logging.debug("device already in database")
+                    elif estimator.offset(ap.bd_addr) is not None and not estimator.needs_sync(ap.bd_addr):
+                        logging.info(f"{ap.bd_addr} clock offset {estimator.offset(ap.bd_addr)} is within the threshold")
+                        configured_devices[ap.bd_addr] = False
+                        number_of_devices_to_look_for -= 1
+                    elif estimator.needs_sync(ap.bd_addr):
+                        logging.info(f"{ap.bd_addr} clock offset {estimator.offset(ap.bd_addr)}")
                         bt_module.cancel_scan()
                         logging.debug("Preparing to set Epoch")
                         bt_module.allow_pairing()
                         bt_module.connect(ap.get_at_bd_addr(),
-                                          bt_module.connection_timeout)
+                                          bt_module.connection_timeout, QUICK)
                         if bt_module.vspConnection:
                             jt.SetEpoch(int(time.time()))
                             bt_module.disconnect()
@@ -55,7 +66,5 @@ if __name__ == "__main__":
                             configured_devices[ap.bd_addr] = True
                             number_of_devices_to_look_for -= 1
                         bt_module.scan(nameMatch=name_to_look_for)
-                    else:
-                        logging.debug("device already in database")
 
         bt_module.cancel_scan()
@@ -0,0 +1,110 @@
+
+"""
+Expected inventory of sensors for scan based workflows.
+
+The inventory is a list of addresses, a list of names, or a name prefix with
+the number of sensors that have it:
+
+{"bd_addrs": ["01C13A7E4118A2", "c0ffee000001"]}
+{"names": ["Test-12", "Test-13"]}
+{"prefix": "Test-", "count": 13}
+
+A scan (or a series of sessions) stops as soon as every expected sensor has
+been seen and the sensors that are still missing are reported on timeout.
+"""
+
+import json
+import logging
+
+
+def normalize_address(bd_addr: str) -> str:
+    """ 01C13A7E4118A2 (AT format), 0xc13a7e4118a2 or c13a7e4118a2 -> c13a7e4118a2 """
+    bd_addr = bd_addr.lower()
+    if bd_addr.startswith("0x"):
+        bd_addr = bd_addr[2:]
+    if len(bd_addr) == 14:
+        # Address type
+        bd_addr = bd_addr[2:]
+    return bd_addr
+
+
+class Inventory:
+    def __init__(self, bd_addrs=None, names=None, prefix=None, count=None):
+        self.logger = logging.getLogger('Inventory')
+        self.bd_addrs = set(normalize_address(a) for a in bd_addrs or [])
+        self.names = set(names or [])
+        self.prefix = prefix
+        self.count = count
+        if prefix is not None and count is None:
+            raise ValueError("An inventory prefix requires a count")
+        if not self.bd_addrs and not self.names and prefix is None:
+            raise ValueError("Empty inventory")
+        # bd_addr -> name of the expected sensors that have been seen
+        self.seen = dict()
+        self.seen_names = set()
+
+    @classmethod
+    def from_dict(cls, d: dict):
+        return cls(d.get("bd_addrs"), d.get("names"), d.get("prefix"), d.get("count"))
+
+    @classmethod
+    def from_file(cls, fname: str):
+        with open(fname, 'r') as f:
+            return cls.from_dict(json.load(f))
+
+    def expected(self, ap) -> bool:
+        """ The sensor is in the inventory (and hasn't been seen) """
+        if ap.bd_addr in self.seen:
+            return False
+        if ap.bd_addr in self.bd_addrs:
+            return True
+        if ap.name in self.names:
+            return ap.name not in self.seen_names
+        if self.prefix is not None and ap.name.startswith(self.prefix):
+            return self._prefix_seen() < self.count
+        return False
+
+    def _prefix_seen(self) -> int:
+        return sum(1 for name in self.seen.values() if name.startswith(self.prefix))
+
+    def see(self, ap) -> bool:
+        """ Mark an expected sensor as seen. Returns True if it was expected. """
+        if not self.expected(ap):
+            return False
+        self.seen[ap.bd_addr] = ap.name
+        self.seen_names.add(ap.name)
+        self.logger.debug(f"{ap.name} {ap.bd_addr} ({len(self.seen)} seen)")
+        return True
+
+    def complete(self) -> bool:
+        if not self.bd_addrs.issubset(self.seen):
+            return False
+        if not self.names.issubset(self.seen_names):
+            return False
+        return self.prefix is None or self._prefix_seen() >= self.count
+
+    def missing(self) -> list:
+        """ Descriptions of the sensors that haven't been seen """
+        missing = sorted(self.bd_addrs.difference(self.seen))
+        missing += sorted(self.names.difference(self.seen_names))
+        if self.prefix is not None:
+            remaining = self.count - self._prefix_seen()
+            if remaining > 0:
+                missing.append(f"{remaining} of {self.count} sensors named {self.prefix}*")
+        return missing
+
+    def log_result(self) -> None:
+        missing = self.missing()
+        if missing:
+            self.logger.warning(f"Missing {', '.join(missing)}")
+        else:
+            self.logger.info(f"All {len(self.seen)} expected sensors were seen")
+
+
+def open_inventory(c: dict, fname=None):
+    """ Inventory from a file or the "inventory" configuration key (None if neither is set) """
+    if fname:
+        return Inventory.from_file(fname)
+    if c.get("inventory"):
+        return Inventory.from_dict(c["inventory"])
+    return None
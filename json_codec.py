@@ -0,0 +1,79 @@
+
+"""
+JSON-RPC request encoding and response decoding.
+
+Requests are built from per-method templates with a local id counter
+(the output matches jsonrpcclient so transcripts don't change).
+Responses are decoded with orjson or ujson when one is installed.
+"""
+
+import json
+import base64
+
+try:
+    import orjson
+
+    def loads(s):
+        return orjson.loads(s)
+
+    backend = "orjson"
+except ImportError:
+    try:
+        import ujson
+
+        def loads(s):
+            return ujson.loads(s)
+
+        backend = "ujson"
+    except ImportError:
+        loads = json.loads
+        backend = "json"
+
+
+def _bytes_as_base64(obj):
+    """ Decoded readLog payloads are logged the same way the sensor sent them """
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return base64.standard_b64encode(obj).decode('ascii')
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj) -> str:
+    """ Serialize for logging (same format as the requests) """
+    return json.dumps(obj, default=_bytes_as_base64)
+
+
+class RequestEncoder:
+    """ Builds JSON-RPC 2.0 requests """
+
+    def __init__(self):
+        self.id = 0
+        self.method = ""
+        self._templates = dict()
+
+    def encode(self, method: str, *args, **kwargs) -> str:
+        """ Positional arguments are sent as a list and keyword arguments as an object """
+        self.id += 1
+        self.method = method
+        template = self._templates.get(method)
+        if template is None:
+            template = '{"jsonrpc": "2.0", "method": ' + json.dumps(method)
+            self._templates[method] = template
+        if kwargs:
+            params = ', "params": ' + json.dumps(kwargs)
+        elif len(args) == 1 and type(args[0]) is int:
+            params = f', "params": [{args[0]}]'
+        elif args:
+            params = ', "params": ' + json.dumps(list(args))
+        else:
+            params = ''
+        return f'{template}{params}, "id": {self.id}}}'
+
+
+if __name__ == "__main__":
+    encoder = RequestEncoder()
+    print(backend)
+    print(encoder.encode("dump"))
+    print(encoder.encode("readLog", 500))
+    print(encoder.encode("get", "sensorName"))
+    print(encoder.encode("set", lock=0))
+    print(loads('{"jsonrpc": "2.0", "id": 2, "result": [16, "kd7OXWsJAQCR3s5dwgsMAQ=="]}'))
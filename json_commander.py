@@ -9,11 +9,49 @@ import json
 import random
 import string
 import logging
-from jsonrpcclient.requests import Request
+import binascii
+import json_codec
+import log_wrapper
+from log_buffer import LogBuffer
+from rtt_estimator import RttTable, JSON_MINIMUMS
+
+# Attributes that change without a reset or configuration change aren't served from a snapshot
+VOLATILE_ATTRIBUTES = frozenset([
+    "batteryVoltageMv", "tempCc", "magnetState", "flags", "lock", "qrtc", "upTime"])
+
+
+class AttributeSnapshot:
+    """ Attributes from a dump response """
+
+    def __init__(self, attributes: dict):
+        self.attributes = attributes
+        self.time = time.time()
+
+    def get(self, name: str, default=None):
+        return self.attributes.get(name, default)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.attributes
+
+    def update(self, **kwargs) -> None:
+        self.attributes.update(kwargs)
+
+    def matches(self, ap) -> bool:
+        """ False if the advertisement shows that the sensor was reset or reconfigured """
+        reset_count = self.attributes.get("resetCount")
+        if ap.adv_valid and reset_count is not None:
+            # The advertisement only has the lower byte
+            if (reset_count & 0xFF) != ap.adv.reset_count:
+                return False
+        config_version = self.attributes.get("configVersion")
+        if ap.rsp_has_versions and config_version is not None:
+            if (config_version & 0xFF) != ap.rsp.config_version:
+                return False
+        return True
 
 
 class jtester:
-    def __init__(self, fname="config.json"):
+    def __init__(self, fname="config.json", config=None):
         """ JSON tester that is independent of the transport """
         print("jtester init")
         self.protocol = None
@@ -21,37 +59,133 @@ class jtester:
         self.reset_delay = 10
         self.reset_after_write_delay = 2
         self.get_queue_timeout = 2.0
+        # Response times of each method (the queue timeout is used until one is measured)
+        self.rtt = RttTable(JSON_MINIMUMS, initial=self.get_queue_timeout)
+        self.pending_method = None
+        self.pending_id = None
+        self.sent = 0.0
+        self.telemetry = None
+        self.phase = None
         self.ok = 0
         self.fail = 0
-        self._LoadConfig(fname)
+        self.codec = json_codec.RequestEncoder()
+        self.log_buffer = None
+        # Attribute snapshots (dump) of each sensor and the connected sensor
+        self.snapshots = dict()
+        self.sensor = None
+        self.sensor_connection = None
+        self._LoadConfig(fname, config)
         self.logger = logging.getLogger('jtester')
 
-    def _LoadConfig(self, fname: str) -> None:
-        with open(fname, 'r') as f:
-            c = json.load(f)
-            if "inter_message_delay" in c:
-                self.inter_message_delay = c["inter_message_delay"]
-            if "reset_delay" in c:
-                self.reset_delay = c["reset_delay"]
+    def _LoadConfig(self, fname: str, c=None) -> None:
+        """ Use the already parsed configuration (c) when it is provided """
+        if c is None:
+            with open(fname, 'r') as f:
+                c = json.load(f)
+        if "inter_message_delay" in c:
+            self.inter_message_delay = c["inter_message_delay"]
+        if "reset_delay" in c:
+            self.reset_delay = c["reset_delay"]
+        if "json_timeout_minimums" in c:
+            self.rtt.set_minimums(c["json_timeout_minimums"])
 
     def _send_json(self, text):
         if self.protocol is not None:
             self.logger.debug(text)
+            self.pending_method = self.codec.method
+            self.pending_id = self.codec.id
+            if self.telemetry is not None:
+                self.phase = self.telemetry.start(self.codec.method)
             self.protocol.send_json(text, self.inter_message_delay)
+            self.sent = time.monotonic()
         else:
             self.logger.warning("Transport not available")
 
     def _get_json(self):
         if self.protocol is not None:
-            result = self.protocol.get_json(self.get_queue_timeout)
-            self.logger.debug(json.dumps(result))
+            method = self.pending_method
+            timeout = self.rtt.timeout(method)
+            while True:
+                result = self.protocol.get_json(max(self.sent + timeout - time.monotonic(), 0))
+                if result is None:
+                    self.rtt.timed_out(method)
+                    self.logger.debug(f"{method} timeout ({timeout:.2f} s)")
+                    break
+                # A late response to a request that already timed out
+                if self.pending_id is not None and isinstance(result.get("id"), int) \
+                        and result["id"] < self.pending_id:
+                    self.logger.debug(f"Discarding response {result['id']}")
+                    continue
+                self.rtt.sample(method, time.monotonic() - self.sent)
+                break
+            if self.phase is not None:
+                outcome = "timeout" if result is None else "error" if "error" in result else "ok"
+                self.telemetry.stop(self.phase, outcome)
+                self.phase = None
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug(json_codec.dumps(self._sidecar(result)))
             return result
         else:
             return None
 
+    def _sidecar(self, response):
+        """
+        Move a large readLog payload to the payload sidecar (when enabled)
+        and return the response with a reference to it for the transcript.
+        """
+        sidecar = log_wrapper.payload_sidecar
+        if sidecar is None or response is None:
+            return response
+        value = response.get("result")
+        if not isinstance(value, list) or len(value) != 2 or len(value[1]) < sidecar.threshold:
+            return response
+        payload = value[1]
+        if isinstance(payload, str):
+            try:
+                payload = binascii.a2b_base64(payload)
+            except binascii.Error:
+                return response
+        logged = dict(response)
+        logged["result"] = [value[0], sidecar.write(payload)]
+        return logged
+
     def set_protocol(self, protocol) -> None:
         self.protocol = protocol
 
+    def set_telemetry(self, telemetry) -> None:
+        """ Record the time of each method in a session_telemetry.SessionTelemetry (None disables) """
+        self.telemetry = telemetry
+
+    def SetSensor(self, ap, saved=None) -> None:
+        """
+        Select the snapshot of the connected sensor (ap is its advertisement).
+        A cached snapshot is discarded if the configVersion or resetCount changed.
+        saved is the attributes of a previous dump (used when still valid).
+        The sensor is forgotten when the transport makes another connection.
+        """
+        self.sensor = ap.bd_addr
+        self.sensor_connection = self._connection()
+        snapshot = self.snapshots.get(self.sensor)
+        if snapshot is None and saved is not None:
+            snapshot = AttributeSnapshot(dict(saved))
+        if snapshot is not None and snapshot.matches(ap):
+            self.snapshots[self.sensor] = snapshot
+        else:
+            self.snapshots.pop(self.sensor, None)
+
+    def _connection(self):
+        """ Number of connections made by the transport (None for the serial port) """
+        return getattr(self.protocol, "connections", None)
+
+    def _connected_sensor(self):
+        """ The sensor selected by SetSensor if it is still the connected one """
+        if self.sensor is not None and self._connection() != self.sensor_connection:
+            self.sensor = None
+        return self.sensor
+
+    def _invalidate(self) -> None:
+        self.snapshots.pop(self._connected_sensor(), None)
+
     def IncrementOkCount(self) -> None:
         self.ok += 1
 
@@ -163,61 +297,79 @@ class jtester:
         return [0, ""]
 
     def SendFactoryReset(self) -> None:
+        self._invalidate()
         time.sleep(self.reset_after_write_delay)
-        self._send_json(str(Request("factoryReset")))
+        self._send_json(self.codec.encode("factoryReset"))
         self.ExpectOk()
         time.sleep(self.reset_delay)
 
     def SendReboot(self) -> None:
+        self._invalidate()
         time.sleep(self.reset_after_write_delay)
-        self._send_json(str(Request("reboot")))
+        self._send_json(self.codec.encode("reboot"))
         self.ExpectOk()
         time.sleep(self.reset_delay)
 
     def SendEnterBootloader(self) -> None:
+        self._invalidate()
         time.sleep(self.reset_after_write_delay)
-        self._send_json(str(Request("reboot", 1)))
+        self._send_json(self.codec.encode("reboot", 1))
         self.ExpectOk()
         time.sleep(self.reset_delay)
 
     def EpochTest(self, epoch: int) -> None:
         """Test epoch commands"""
         delay = 3
-        self._send_json(str(Request(f"setEpoch", epoch)))
+        self._send_json(self.codec.encode("setEpoch", epoch))
         self.ExpectOk()
         time.sleep(delay)
-        self._send_json(str(Request("getEpoch")))
+        self._send_json(self.codec.encode("getEpoch"))
         self.ExpectRange("epoch", epoch + delay - 1, epoch + delay + 1)
 
     def LedTest(self) -> None:
-        self._send_json(str(Request("ledTest", 1000)))
+        self._send_json(self.codec.encode("ledTest", 1000))
         self.ExpectOk()
 
-    def Dump(self) -> None:
-        """ Test dump command without any parameters """
-        self._send_json(str(Request("dump")))
+    def Dump(self):
+        """
+        Test dump command without any parameters.
+        Returns an AttributeSnapshot or None.
+        """
+        self._send_json(self.codec.encode("dump"))
         response = self._get_json()
-        ok = False
         if response is not None:
             if "result" in response:
                 if response["result"] == "ok":
                     self.IncrementOkCount()
+                    snapshot = AttributeSnapshot({k: v for (k, v) in response.items()
+                                                  if k not in ("jsonrpc", "id", "result")})
+                    if self._connected_sensor() is not None:
+                        self.snapshots[self.sensor] = snapshot
+                    return snapshot
                 else:
                     self.IncrementFailCount()
+        return None
+
+    def Snapshot(self):
+        """ The cached snapshot of the connected sensor (selected with SetSensor) or a new dump """
+        snapshot = self.snapshots.get(self._connected_sensor())
+        if snapshot is None:
+            snapshot = self.Dump()
+        return snapshot
 
     def Unlock(self) -> None:
         kwargs = {"lock": 0}
-        self._send_json(str(Request("set", **kwargs)))
+        self._send_json(self.codec.encode("set", **kwargs))
         self.ExpectOk()
 
     def Lock(self) -> None:
         kwargs = {"lock": 1}
-        self._send_json(str(Request("set", **kwargs)))
+        self._send_json(self.codec.encode("set", **kwargs))
         self.ExpectOk()
 
     def GetAttribute(self, name: str):
         """Get an attribute by its name - Doesn't affect test ok count"""
-        self._send_json(str(Request("get", name)))
+        self._send_json(self.codec.encode("get", name))
         response = self._get_json()
         result = None
         if response is not None:
@@ -232,24 +384,72 @@ class jtester:
         self.logger.info(f'"{name}": {result}')
         return result
 
+    def GetAttributes(self, *names) -> dict:
+        """
+        Get attributes by name from the snapshot (one dump for the first request).
+        Volatile attributes and those not in the snapshot are read with a single get.
+        The dump is counted in the test ok/fail counts, the get isn't.
+        """
+        snapshot = self.Snapshot()
+        result = dict.fromkeys(names)
+        missing = list()
+        for name in names:
+            if snapshot is not None and name in snapshot and name not in VOLATILE_ATTRIBUTES:
+                result[name] = snapshot.get(name)
+            else:
+                missing.append(name)
+        if missing:
+            self._send_json(self.codec.encode("get", *missing))
+            response = self._get_json()
+            for name in missing:
+                if response is not None and response.get("result") == "ok" and name in response:
+                    result[name] = response[name]
+        for (name, value) in result.items():
+            if isinstance(value, str):
+                result[name] = value.strip('\"')
+        self.logger.info(result)
+        return result
+
     def SetAttributes(self, **kwargs) -> None:
-        self._send_json(str(Request("set", **kwargs)))
+        fail = self.fail
+        self._send_json(self.codec.encode("set", **kwargs))
         self.ExpectOk()
+        snapshot = self.snapshots.get(self._connected_sensor())
+        if snapshot is not None:
+            if self.fail == fail:
+                snapshot.update(**kwargs)
+            else:
+                self._invalidate()
 
     def SetEpoch(self, epoch: int) -> None:
-        self._send_json(str(Request("setEpoch", epoch)))
+        self._send_json(self.codec.encode("setEpoch", epoch))
         self.ExpectOk()
 
     def PrepareLog(self) -> int:
-        self._send_json(str(Request("prepareLog", 0)))  # fifo mode
-        return self.ExpectInt()
+        """
+        The transport decodes readLog results into a buffer sized from the
+        number of events (when the transport supports it).
+        """
+        self._send_json(self.codec.encode("prepareLog", 0))  # fifo mode
+        count = self.ExpectInt()
+        if hasattr(self.protocol, "set_log_buffer"):
+            self.log_buffer = LogBuffer(count) if count > 0 else None
+            self.protocol.set_log_buffer(self.log_buffer)
+        return count
+
+    def EndLog(self) -> None:
+        """ Stop decoding readLog results into the log buffer (the log read is complete) """
+        self.log_buffer = None
+        if hasattr(self.protocol, "set_log_buffer"):
+            self.protocol.set_log_buffer(None)
 
     def ReadLog(self, count: int) -> list:
-        self._send_json(str(Request("readLog", count)))
+        """ Returns [size, base64 str] or [size, memoryview] when a log buffer is used """
+        self._send_json(self.codec.encode("readLog", count))
         return self.ExpectLog()
 
     def AckLog(self, count: int) -> int:
-        self._send_json(str(Request("ackLog", count)))
+        self._send_json(self.codec.encode("ackLog", count))
         result = self.ExpectInt()
         return result
 
@@ -27,6 +27,10 @@ class JsonConfig:
                 f"Unable to find key '{key}' in JSON config file")
             sys.exit(3)
 
+    def get_optional(self, key, default=None):
+        """ Find key in JSON configuration file or return default """
+        return self.config.get(key, default)
+
     def get_port(self):
         """ Returns serial communication port from JSON configuration """
         if self.isBle:
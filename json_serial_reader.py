@@ -10,6 +10,9 @@ import serial
 import serial.threaded
 import queue
 import logging
+import json_codec
+import log_buffer
+import capture
 from json_commander import jtester
 
 verbose = False
@@ -25,6 +28,7 @@ class JsonPacket(serial.threaded.Protocol):
         super().__init__()
         self.text = ""
         self.transport = None
+        self.capture = None
 
     def connection_made(self, transport):
         """Store transport"""
@@ -40,6 +44,8 @@ class JsonPacket(serial.threaded.Protocol):
         self.text = ""
 
     def data_received(self, data):
+        if self.capture is not None:
+            self.capture.record(capture.RX, data)
         self.text += data.decode('utf-8')
         if verbose:
             print(f"data received {self.text}")
@@ -58,6 +64,16 @@ class JsonPacket(serial.threaded.Protocol):
 
         self.text = ""
 
+    def set_capture(self, ring) -> None:
+        """ Record raw data in a capture.CaptureRing (None disables) """
+        self.capture = ring
+
+    def write(self, data: bytes) -> None:
+        """ Write to the port (and capture) """
+        if self.capture is not None:
+            self.capture.record(capture.TX, data)
+        self.transport.write(data)
+
     def handle_packet(self, packet):
         """Process packets - to be overridden by subclassing"""
         raise NotImplementedError(
@@ -74,13 +90,24 @@ class JsonSerialReader(jtester, JsonPacket):
         if verbose:
             print("json serial reader transport init")
         self.json_packets = queue.Queue()
+        self.log_buffer = None
+        self.capture = None
         self.logger = logging.getLogger('JsonSerialReader')
 
+    def set_log_buffer(self, buffer) -> None:
+        """ readLog results are decoded into buffer (None disables) """
+        self.log_buffer = buffer
+
     def handle_packet(self, packet):
         if verbose:
             self.logger.debug(f"response {packet}")
+        if self.log_buffer is not None:
+            jsonObject = log_buffer.decode_read_log(packet, self.log_buffer)
+            if jsonObject is not None:
+                self.json_packets.put(jsonObject)
+                return
         try:
-            jsonObject = json.loads(packet)
+            jsonObject = json_codec.loads(packet)
             self.json_packets.put(jsonObject)
         except ValueError:
             pass
@@ -90,7 +117,7 @@ class JsonSerialReader(jtester, JsonPacket):
             self.logger.debug(text)
         # Sleep is to prevent lost characters on Uart without flow control.
         time.sleep(delay)
-        self.transport.write(text.encode('utf-8'))
+        self.write(text.encode('utf-8'))
 
     def get_json(self, timeout):
         try:
@@ -104,8 +131,8 @@ class JsonSerialReader(jtester, JsonPacket):
         pass
 
     def disconnect(self):
-        """Not used for serial port"""
-        pass
+        """Not used for serial port (the log buffer is released)"""
+        self.set_log_buffer(None)
 
     def secondary_initialization(self, connection_interval_us=30000):
         """Not used for serial port"""
@@ -0,0 +1,80 @@
+
+"""
+Preallocated storage for an event log download.
+
+The transports recognise readLog results in the received bytes and base64
+decode the payload into a buffer that was sized from the prepareLog count.
+The payload isn't converted to text, but binascii decodes into a new bytes
+object, so each chunk is copied once into the buffer.
+The response handed to jtester is [size, memoryview] instead of [size, base64 str].
+"""
+
+import re
+import binascii
+from event_log import SIZE_OF_EVENT
+
+# {"jsonrpc": "2.0", "id": 2, "result": [16, "kd7OXWsJAQCR3s5dwgsMAQ=="]}
+READ_LOG_RESULT = re.compile(
+    rb'\{\s*"jsonrpc":\s*"2\.0",\s*"id":\s*(\d+),\s*"result":\s*\[\s*(\d+),\s*"([A-Za-z0-9+/=]*)"\s*\]\s*\}')
+
+
+class LogBuffer:
+    def __init__(self, count: int):
+        self.buf = bytearray(count * SIZE_OF_EVENT)
+        self.view = memoryview(self.buf)
+        self.length = 0
+
+    def decode(self, size: int, b64):
+        """
+        Decode a chunk (base64 bytes or a memoryview of them) into the buffer and
+        return a view of it. Returns None if the chunk is invalid.
+        """
+        try:
+            data = binascii.a2b_base64(b64)
+        except binascii.Error:
+            return None
+        if (size % SIZE_OF_EVENT) != 0 or len(data) != size:
+            return None
+        end = self.length + size
+        if end > len(self.buf):
+            # More was read than prepareLog reported (re-read without an ack).
+            # Slices that were already handed out keep the old buffer alive.
+            buf = bytearray(max(end, 2 * len(self.buf)))
+            buf[:self.length] = self.view[:self.length]
+            self.buf = buf
+            self.view = memoryview(self.buf)
+        self.view[self.length:end] = data
+        chunk = self.view[self.length:end]
+        self.length = end
+        return chunk
+
+    def events(self) -> memoryview:
+        """ All of the events decoded so far """
+        return self.view[:self.length]
+
+
+def decode_read_log(packet, log_buffer: LogBuffer):
+    """
+    Return the response dictionary if the packet (bytes, a memoryview of the
+    receive buffer or str) is a readLog result.
+    Otherwise, None is returned and the packet should be handled normally.
+    """
+    if isinstance(packet, str):
+        packet = packet.encode('utf-8')
+    m = READ_LOG_RESULT.match(packet)
+    if m is None:
+        return None
+    # The payload is a view of the packet (the base64 text isn't copied)
+    payload = memoryview(packet)[m.start(3):m.end(3)]
+    chunk = log_buffer.decode(int(m.group(2)), payload)
+    if chunk is None:
+        return None
+    return {"jsonrpc": "2.0", "id": int(m.group(1)), "result": [len(chunk), chunk]}
+
+
+if __name__ == "__main__":
+    lb = LogBuffer(4)
+    print(decode_read_log(
+        b'{"jsonrpc": "2.0", "id": 2, "result": [16, "ZwLJXRIIAQDLAsldEAgBAA=="]}', lb))
+    print(decode_read_log(b'{"jsonrpc": "2.0", "id": 3, "result": 16}', lb))
+    print(bytes(lb.events()))
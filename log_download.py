@@ -0,0 +1,195 @@
+
+"""
+Resumable, durable event log download.
+
+Each chunk is appended to a per-sensor file and flushed to disk (fsync)
+before it is acked. If the connection is lost the download resumes on
+the next connection without losing or duplicating events.
+"""
+
+import os
+import json
+import base64
+import logging
+from event_log import EventLog, SIZE_OF_EVENT, get_number_of_events_in_list
+
+DOWNLOAD_DIRECTORY = "logs/downloads"
+EVENTS_FILE = "events.bin"
+STATE_FILE = "state.json"
+# limited in sensor (by JSON buffer size) to 128
+EVENTS_PER_READ = 500
+
+
+def _fsync_directory(directory: str) -> None:
+    """ Make a rename durable (not supported on Windows) """
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def chunk_bytes(lst: list) -> bytes:
+    """ The data of a readLog result ([size, base64 str] or [size, memoryview]) """
+    size, data = lst
+    if isinstance(data, str):
+        data = base64.standard_b64decode(data)
+    return bytes(data[:size])
+
+
+class DownloadState:
+    """
+    Progress of the download for one sensor.
+    committed - bytes of events.bin that are on disk
+    pending - events at the end of events.bin whose ack hasn't been confirmed
+    exported - bytes of events.bin that have been written to a sensor_events.log
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.fname = os.path.join(directory, STATE_FILE)
+        self.committed = 0
+        self.pending = 0
+        self.exported = 0
+        try:
+            with open(self.fname, 'r') as f:
+                d = json.load(f)
+                self.committed = d["committed"]
+                self.pending = d["pending"]
+                self.exported = d["exported"]
+        except (IOError, ValueError, KeyError):
+            pass
+
+    def save(self) -> None:
+        tmp = self.fname + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump({"committed": self.committed, "pending": self.pending,
+                       "exported": self.exported}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.fname)
+        _fsync_directory(self.directory)
+
+
+class LogDownloader:
+    def __init__(self, jt, directory=DOWNLOAD_DIRECTORY, events_per_read=EVENTS_PER_READ):
+        self.logger = logging.getLogger('LogDownloader')
+        self.jt = jt
+        self.directory = directory
+        self.events_per_read = events_per_read
+
+    def _sensor_directory(self, bd_addr: str) -> str:
+        d = os.path.join(self.directory, bd_addr.lower())
+        if not os.path.exists(d):
+            os.makedirs(d)
+        return d
+
+    def download(self, bd_addr: str) -> int:
+        """
+        Read, store and ack the log of the connected sensor.
+        Returns the number of events that were stored.
+        """
+        try:
+            return self._download(bd_addr)
+        finally:
+            # Later readLog responses aren't decoded into this download's buffer
+            self.jt.EndLog()
+
+    def _download(self, bd_addr: str) -> int:
+        d = self._sensor_directory(bd_addr)
+        state = DownloadState(d)
+        stored = 0
+        with open(os.path.join(d, EVENTS_FILE), 'a+b') as f:
+            # Discard anything that was written after the last durable state (torn write)
+            f.truncate(state.committed)
+            remaining = self.jt.PrepareLog()
+            lst = None
+            if state.pending and remaining > 0:
+                # The ack of the last stored chunk may not have reached the sensor.
+                # If the sensor still has the chunk, ack it instead of storing it again.
+                lst = self.jt.ReadLog(state.pending)
+                if get_number_of_events_in_list(lst) == 0:
+                    return 0
+                f.seek(state.committed - state.pending * SIZE_OF_EVENT)
+                if chunk_bytes(lst) == f.read(state.pending * SIZE_OF_EVENT):
+                    self.logger.info(
+                        f"Acking {state.pending} events that were stored before the connection was lost")
+                    pending = state.pending
+                    if self._ack(state, pending) != pending:
+                        return 0
+                    remaining -= pending
+                    lst = None
+                else:
+                    state.pending = 0
+                    state.save()
+
+            while remaining > 0:
+                if lst is None:
+                    lst = self.jt.ReadLog(self.events_per_read)
+                events_read = get_number_of_events_in_list(lst)
+                if events_read == 0:
+                    break
+                f.seek(0, os.SEEK_END)
+                f.write(chunk_bytes(lst))
+                f.flush()
+                os.fsync(f.fileno())
+                lst = None
+                state.committed += events_read * SIZE_OF_EVENT
+                state.pending = events_read
+                state.save()
+                stored += events_read
+                acked = self._ack(state, events_read)
+                if acked != events_read:
+                    self.logger.warning("Ack failed - download will resume on the next connection")
+                    break
+                remaining -= events_read
+        self.logger.info(f"Stored {stored} events for {bd_addr}")
+        return stored
+
+    def _ack(self, state: DownloadState, count: int) -> int:
+        acked = self.jt.AckLog(count)
+        if acked == count:
+            state.pending = 0
+            state.save()
+        return acked
+
+    def size(self, bd_addr: str) -> int:
+        """ Bytes of events stored for a sensor """
+        return DownloadState(self._sensor_directory(bd_addr)).committed
+
+    def events(self, bd_addr: str, start=0) -> bytes:
+        """ Stored events (from byte offset start) """
+        d = self._sensor_directory(bd_addr)
+        state = DownloadState(d)
+        with open(os.path.join(d, EVENTS_FILE), 'rb') as f:
+            f.seek(start)
+            return f.read(state.committed - start)
+
+    def export(self, bd_addr: str, sensor_name: str) -> int:
+        """
+        Write the events that haven't been exported to a sensor_events.log file.
+        Returns the number of events written.
+        """
+        d = self._sensor_directory(bd_addr)
+        state = DownloadState(d)
+        buf = self.events(bd_addr, state.exported)
+        count = len(buf) // SIZE_OF_EVENT
+        if count > 0:
+            EventLog([[len(buf), buf]]).write(sensor_name, count)
+        state.exported += len(buf)
+        state.save()
+        return count
+
+
+if __name__ == "__main__":
+    import sys
+    import log_wrapper
+    log_wrapper.setup(__file__, console_level=logging.DEBUG)
+    # Export the stored events of a sensor: python log_download.py <bd_addr> <name>
+    if len(sys.argv) == 3:
+        LogDownloader(None).export(sys.argv[1], sys.argv[2])
@@ -1,26 +1,121 @@
-
 import logging
+import logging.handlers
 import os
+import copy
+import queue
+import atexit
+import threading
+
+# Large payloads (readLog results) are referenced in the transcript as "@file:offset:length"
+PAYLOAD_REFERENCE_PREFIX = "@"
+PAYLOAD_THRESHOLD = 256
+
+payload_sidecar = None
+# setup() has added the handlers
+configured = False
+
+
+class PayloadSidecar:
+    """ Binary file that holds the large payloads referenced by the transcript """
+
+    def __init__(self, fname: str, file_mode='w', threshold=PAYLOAD_THRESHOLD):
+        self.fname = fname
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.f = open(fname, file_mode + 'b')
+        self.offset = self.f.seek(0, os.SEEK_END)
+
+    def write(self, data) -> str:
+        """ Append data and return the reference that is written to the transcript """
+        with self.lock:
+            offset = self.offset
+            self.f.write(data)
+            self.offset += len(data)
+        return f"{PAYLOAD_REFERENCE_PREFIX}{os.path.basename(self.fname)}:{offset}:{len(data)}"
+
+    def flush(self) -> None:
+        with self.lock:
+            self.f.flush()
+
+    def close(self) -> None:
+        with self.lock:
+            self.f.close()
+
+
+def is_payload_reference(s) -> bool:
+    return isinstance(s, str) and s.startswith(PAYLOAD_REFERENCE_PREFIX) and s.count(':') == 2
 
 
-def setup(source_script_name: str, console_level=logging.INFO, file_mode='w') -> None:
+def read_payload(reference: str, directory="logs") -> bytes:
+    """ Read the data for a transcript reference from the sidecar file """
+    fname, offset, length = reference[len(PAYLOAD_REFERENCE_PREFIX):].split(':')
+    with open(os.path.join(directory, fname), 'rb') as f:
+        f.seek(int(offset))
+        return f.read(int(length))
+
+
+class _MessageQueueHandler(logging.handlers.QueueHandler):
+    """
+    The message (msg % args) is formatted by the calling thread, not the listener,
+    because the arguments can change before the listener runs (the log buffer, dicts...).
+    Only the transcript format (time stamp) and tracebacks are applied by the listener thread.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def setup(source_script_name: str, console_level=logging.INFO, file_mode='w',
+          file_level=logging.DEBUG, queued=False, sidecar=False) -> None:
     """
     Log everything to transcript file that uses top level script name.
     Log console_level and above to console.
+
+    file_level - transcript level (above DEBUG, debug messages aren't formatted at all)
+    queued - file and console I/O is done by a listener thread.
+    sidecar - large payloads are written to a binary file that the transcript references.
+    Like logging.basicConfig, calls after the first do nothing.
     """
+    global payload_sidecar, configured
+    if configured:
+        return
+    configured = True
     if not os.path.exists("logs"):
         os.makedirs("logs")
 
     base = os.path.basename(source_script_name)
     transcript_name = "logs/" + base.replace(".py", ".transcript.log")
     # '%(asctime)s : %(name)-16s : %(levelname)-8s : %(message)s'
-    logging.basicConfig(format='%(asctime)s : %(message)s',
-                        level=logging.DEBUG,
-                        filename=transcript_name,
-                        filemode=file_mode)
+    formatter = logging.Formatter('%(asctime)s : %(message)s')
+    transcript = logging.FileHandler(transcript_name, mode=file_mode)
+    transcript.setFormatter(formatter)
+    transcript.setLevel(file_level)
     console = logging.StreamHandler()
     console.setLevel(console_level)
-    logging.getLogger('').addHandler(console)
+
+    root = logging.getLogger('')
+    if queued:
+        q = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(
+            q, transcript, console, respect_handler_level=True)
+        root.addHandler(_MessageQueueHandler(q))
+        listener.start()
+        atexit.register(listener.stop)
+    else:
+        root.addHandler(transcript)
+        root.addHandler(console)
+    # The root level is the lowest handler level so that messages no handler writes
+    # are discarded before they are formatted (isEnabledFor(logging.DEBUG) is False
+    # when neither the transcript nor the console logs debug messages).
+    root.setLevel(min(file_level, console_level))
+
+    if sidecar:
+        payload_sidecar = PayloadSidecar(
+            "logs/" + base.replace(".py", ".payload.bin"), file_mode)
+        atexit.register(payload_sidecar.close)
 
 
 if __name__ == "__main__":
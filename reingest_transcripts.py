@@ -0,0 +1,237 @@
+
+"""
+Re-create event logs from archived transcripts (*.transcript.log).
+
+Transcripts are memory mapped and scanned with one regular expression for the
+connection, prepareLog, readLog and ackLog requests and responses, so no line
+is decoded unless it matches. Each readLog result is kept once its ackLog
+succeeded (the sensor only discards events that were acked) and is decoded
+with EventLog. Results that were moved to the payload sidecar are read from
+the sidecar file next to the transcript.
+
+Each transcript is processed by a separate process. The output is a
+.sensor_events.log file for each session (text), the event store (sqlite)
+or a Parquet/Arrow file (parquet).
+
+python reingest_transcripts.py archive/ --format sqlite --output logs/events.db
+"""
+
+import os
+import re
+import mmap
+import base64
+import binascii
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from event_log import EventLog, SIZE_OF_EVENT
+from log_wrapper import is_payload_reference, read_payload
+
+TRANSCRIPT_SUFFIX = ".transcript.log"
+FORMATS = ("text", "sqlite", "parquet")
+
+PATTERN = re.compile(
+    rb'Attempting to connect to (?P<connect>[0-9A-Fa-f]{14})'
+    rb'|Found new sensor "(?P<name>[^"\r\n]*)" with BDA: (?P<name_addr>[0-9A-Fa-f]{12})'
+    rb'|"method":\s*"(?P<method>prepareLog|readLog|ackLog)",\s*"params":\s*\[(?P<param>[^\]]*)\],'
+    rb'\s*"id":\s*(?P<request_id>\d+)'
+    rb'|"id":\s*(?P<response_id>\d+),\s*"result":\s*'
+    rb'(?:\[\s*(?P<size>\d+),\s*"(?P<payload>[^"]*)"\s*\]|(?P<count>-?\d+))')
+
+
+class Session:
+    """ The log read during one connection """
+
+    def __init__(self, bd_addr: str):
+        self.bd_addr = bd_addr
+        self.prepared = None
+        self.chunks = list()
+        self.unacked = None
+        self.discarded = 0
+
+    def read(self, chunk) -> None:
+        if self.unacked is not None:
+            self.discarded += 1
+        self.unacked = chunk
+
+    def acked(self, count: int) -> None:
+        if self.unacked is not None and count * SIZE_OF_EVENT == self.unacked[0]:
+            self.chunks.append(self.unacked)
+        elif self.unacked is not None:
+            self.discarded += 1
+        self.unacked = None
+
+    def close(self, include_unacked: bool) -> None:
+        if self.unacked is not None:
+            if include_unacked:
+                self.chunks.append(self.unacked)
+            else:
+                self.discarded += 1
+        self.unacked = None
+
+
+def _payload(payload: bytes, directory: str):
+    """ Base64 text or bytes read from the sidecar (None if it can't be read) """
+    s = payload.decode('ascii', errors='replace')
+    if not is_payload_reference(s):
+        return s
+    try:
+        return read_payload(s, directory)
+    except (IOError, ValueError):
+        return None
+
+
+def parse_transcript(fname: str, include_unacked=False) -> tuple:
+    """ Returns (sessions, sensor names {bd_addr: name}) """
+    directory = os.path.dirname(fname)
+    sessions = list()
+    names = dict()
+    requests = dict()
+    session = None
+    with open(fname, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return sessions, names
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for m in PATTERN.finditer(mm):
+                if m.group('connect'):
+                    if session is not None:
+                        session.close(include_unacked)
+                    # AT format has the address type prefix
+                    session = Session(m.group('connect')[2:].decode('ascii').lower())
+                    sessions.append(session)
+                    requests.clear()
+                elif m.group('name_addr'):
+                    names[m.group('name_addr').decode('ascii').lower()] = \
+                        m.group('name').decode('utf-8', errors='replace')
+                elif m.group('method'):
+                    requests[m.group('request_id')] = (m.group('method'), m.group('param'))
+                elif session is not None:
+                    request = requests.pop(m.group('response_id'), None)
+                    if request is None:
+                        continue
+                    method = request[0]
+                    if method == b'readLog' and m.group('size') is not None:
+                        payload = _payload(m.group('payload'), directory)
+                        if payload is not None:
+                            session.read((int(m.group('size')), payload))
+                    elif method == b'ackLog' and m.group('count') is not None:
+                        session.acked(int(m.group('count')))
+                    elif method == b'prepareLog' and m.group('count') is not None:
+                        session.prepared = int(m.group('count'))
+    if session is not None:
+        session.close(include_unacked)
+    return sessions, names
+
+
+def decode(chunks: list) -> list:
+    """ [size, event bytes] of the valid chunks """
+    valid = list()
+    for (size, payload) in chunks:
+        if isinstance(payload, str):
+            try:
+                payload = base64.standard_b64decode(payload)
+            except binascii.Error:
+                continue
+        if size % SIZE_OF_EVENT == 0 and len(payload) == size:
+            valid.append([size, payload])
+    return valid
+
+
+def process_file(fname: str, text_directory=None, include_unacked=False) -> dict:
+    """
+    Decode the logs read in a transcript (runs in a worker process).
+    With text_directory a .sensor_events.log is written for each session.
+    """
+    sessions, names = parse_transcript(fname, include_unacked)
+    results = list()
+    discarded = 0
+    stem = os.path.basename(fname)[:-len(TRANSCRIPT_SUFFIX)]
+    for (n, session) in enumerate(sessions):
+        discarded += session.discarded
+        if not session.chunks:
+            continue
+        chunks = decode(session.chunks)
+        name = names.get(session.bd_addr, "")
+        if text_directory is not None:
+            # The events are only parsed for the text output (the parent stores the raw bytes)
+            log = EventLog(chunks)
+            log.write(name or session.bd_addr, len(log.events), os.path.join(
+                text_directory, f"{stem}_{n}_{session.bd_addr}_{len(log.events)}.sensor_events.log"))
+        results.append((session.bd_addr, name, b"".join(payload for (size, payload) in chunks)))
+    return {"fname": fname, "sessions": results, "discarded": discarded}
+
+
+def find_transcripts(paths: list) -> list:
+    files = list()
+    for path in paths:
+        if os.path.isdir(path):
+            for (root, _, names) in os.walk(path):
+                files.extend(os.path.join(root, n) for n in names if n.endswith(TRANSCRIPT_SUFFIX))
+        else:
+            files.append(path)
+    return sorted(files)
+
+
+def reingest(paths: list, fmt="text", output="logs/reingested", workers=None, include_unacked=False) -> dict:
+    """
+    Decode the logs in the transcripts (files or directories) and write them
+    in fmt (text: output is a directory, sqlite: event store, parquet: file).
+    Returns counts of the files, sessions, events and discarded (unacked) chunks.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt}")
+    logger = logging.getLogger('reingest')
+    files = find_transcripts(paths)
+    text_directory = output if fmt == "text" else None
+    if text_directory and not os.path.exists(text_directory):
+        os.makedirs(text_directory)
+    store = None
+    writer = None
+    if fmt == "sqlite":
+        from event_store import EventStore
+        store = EventStore(output)
+    elif fmt == "parquet":
+        from columnar_export import LogWriter
+        writer = LogWriter(output)
+    totals = {"files": 0, "sessions": 0, "events": 0, "new": 0, "discarded": 0}
+    try:
+        with ProcessPoolExecutor(workers) as pool:
+            futures = [pool.submit(process_file, fname, text_directory, include_unacked) for fname in files]
+            for future in as_completed(futures):
+                result = future.result()
+                totals["files"] += 1
+                totals["discarded"] += result["discarded"]
+                for (bd_addr, name, raw) in result["sessions"]:
+                    totals["sessions"] += 1
+                    totals["events"] += len(raw) // SIZE_OF_EVENT
+                    if store is not None:
+                        if name:
+                            store.set_name(bd_addr, name)
+                        totals["new"] += store.ingest_log(bd_addr, raw)
+                    elif writer is not None:
+                        writer.write(name, bd_addr, raw)
+                logger.debug(f"{result['fname']} {len(result['sessions'])} sessions")
+    finally:
+        if store is not None:
+            store.close()
+        if writer is not None:
+            writer.close()
+    logger.info(f"Reingested {totals}")
+    return totals
+
+
+if __name__ == "__main__":
+    import argparse
+    import log_wrapper
+    parser = argparse.ArgumentParser(description="Re-create event logs from archived transcripts")
+    parser.add_argument("paths", nargs="+", help="Transcript files or directories")
+    parser.add_argument("--format", choices=FORMATS, default="text")
+    parser.add_argument("--output", help="Directory (text), event store (sqlite) or .parquet/.arrow file "
+                                         "(default: logs/reingested, logs/events.db, logs/events.parquet)")
+    parser.add_argument("--workers", type=int, help="Number of processes (default: number of CPUs)")
+    parser.add_argument("--include-unacked", action="store_true",
+                        help="Keep readLog results whose ackLog failed (they may be read again later)")
+    args = parser.parse_args()
+    log_wrapper.setup(__file__, console_level=logging.INFO)
+    default_output = {"text": "logs/reingested", "sqlite": "logs/events.db", "parquet": "logs/events.parquet"}
+    reingest(args.paths, args.format, args.output or default_output[args.format],
+             args.workers, args.include_unacked)
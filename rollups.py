@@ -0,0 +1,167 @@
+
+"""
+Incremental time-series rollups of the event store.
+
+Per-sensor count/sum/min/max buckets at minute, hour and day resolution for
+temperature and battery voltage, and counts of magnet and movement events.
+Only events added to the store since the last update are read, so a late
+log chunk only touches the buckets that it falls in. The same event received
+in an advertisement and read from the log is only counted once.
+"""
+
+import logging
+from event_store import EventStore, scaled_value, same_reading, TEMPERATURE_EVENTS, BATTERY_EVENTS
+from sensor_event import SensorEventType
+
+MINUTE = 60
+HOUR = 60 * 60
+DAY = 24 * 60 * 60
+RESOLUTIONS = (MINUTE, HOUR, DAY)
+
+TEMPERATURE = 0
+BATTERY = 1
+MAGNET = 2
+MOVEMENT = 3
+METRIC_NAMES = {TEMPERATURE: "temperature", BATTERY: "battery",
+                MAGNET: "magnet", MOVEMENT: "movement"}
+
+METRIC_OF_TYPE = dict()
+METRIC_OF_TYPE.update({int(t): TEMPERATURE for t in TEMPERATURE_EVENTS})
+METRIC_OF_TYPE.update({int(t): BATTERY for t in BATTERY_EVENTS})
+METRIC_OF_TYPE[int(SensorEventType.MAGNET)] = MAGNET
+METRIC_OF_TYPE[int(SensorEventType.MOVEMENT)] = MOVEMENT
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rollups (
+    bd_addr TEXT NOT NULL,
+    metric INTEGER NOT NULL,
+    resolution INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    total REAL NOT NULL,
+    minimum REAL NOT NULL,
+    maximum REAL NOT NULL,
+    PRIMARY KEY (bd_addr, metric, resolution, bucket)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollup_state (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+UPSERT_BUCKET = """
+INSERT INTO rollups (bd_addr, metric, resolution, bucket, count, total, minimum, maximum)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (bd_addr, metric, resolution, bucket) DO UPDATE SET
+    count = count + excluded.count,
+    total = total + excluded.total,
+    minimum = MIN(minimum, excluded.minimum),
+    maximum = MAX(maximum, excluded.maximum)
+"""
+
+# Events of the other source with the same reading that were stored earlier are duplicates
+# (the payloads are compared after scaling because each source stores them differently)
+NEW_EVENTS = f"""
+SELECT e.bd_addr, e.timestamp, e.source, e.type, e.data FROM events e
+WHERE e.rowid > ? AND e.rowid <= ? AND e.type IN ({",".join(str(t) for t in METRIC_OF_TYPE)})
+AND NOT EXISTS (
+    SELECT 1 FROM events d
+    WHERE d.bd_addr = e.bd_addr AND d.timestamp = e.timestamp AND d.type = e.type
+    AND d.source != e.source AND d.rowid < e.rowid
+    AND same_reading(e.type, e.data, e.source, d.data, d.source))
+"""
+
+
+class RollupEngine:
+    def __init__(self, store: EventStore):
+        self.logger = logging.getLogger('RollupEngine')
+        self.store = store
+        self.conn = store.conn
+        self.conn.executescript(SCHEMA)
+        self.conn.create_function("same_reading", 5, same_reading, deterministic=True)
+        row = self.conn.execute(
+            "SELECT value FROM rollup_state WHERE name = 'last_rowid'").fetchone()
+        self.last_rowid = 0 if row is None else row[0]
+        # Keep the rollups current as events are written
+        store.rollups = self
+
+    def update(self) -> int:
+        """ Add the events stored since the last update, returns the number of events """
+        top = self.conn.execute("SELECT MAX(rowid) FROM events").fetchone()[0] or 0
+        if top <= self.last_rowid:
+            return 0
+        buckets = dict()
+        count = 0
+        for (bd_addr, timestamp, source, event_type, data) in self.conn.execute(
+                NEW_EVENTS, (self.last_rowid, top)):
+            metric = METRIC_OF_TYPE[event_type]
+            value = scaled_value(event_type, data, source)
+            count += 1
+            for resolution in RESOLUTIONS:
+                key = (bd_addr, metric, resolution, timestamp - timestamp % resolution)
+                b = buckets.get(key)
+                if b is None:
+                    buckets[key] = [1, value, value, value]
+                else:
+                    b[0] += 1
+                    b[1] += value
+                    b[2] = min(b[2], value)
+                    b[3] = max(b[3], value)
+        with self.conn:
+            self.conn.executemany(UPSERT_BUCKET, (k + tuple(b) for (k, b) in buckets.items()))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO rollup_state (name, value) VALUES ('last_rowid', ?)", (top,))
+        self.last_rowid = top
+        self.logger.debug(f"{count} events updated {len(buckets)} buckets")
+        return count
+
+    def rebuild(self) -> int:
+        """ Discard the rollups and compute them from all stored events """
+        with self.conn:
+            self.conn.execute("DELETE FROM rollups")
+            self.conn.execute("DELETE FROM rollup_state")
+        self.last_rowid = 0
+        return self.update()
+
+    def series(self, bd_addr: str, metric: int, resolution=HOUR, start=0, end=0xFFFFFFFF) -> list:
+        """ (bucket, count, mean, minimum, maximum) for one sensor """
+        return self.conn.execute(
+            "SELECT bucket, count, total / count, minimum, maximum FROM rollups "
+            "WHERE bd_addr = ? AND metric = ? AND resolution = ? AND bucket BETWEEN ? AND ? "
+            "ORDER BY bucket", (bd_addr.lower(), metric, resolution, start, end)).fetchall()
+
+    def fleet(self, metric: int, resolution=DAY, start=0, end=0xFFFFFFFF) -> dict:
+        """ Series of every sensor: {bd_addr: [(bucket, count, mean, minimum, maximum)]} """
+        result = dict()
+        for (bd_addr, *row) in self.conn.execute(
+                "SELECT bd_addr, bucket, count, total / count, minimum, maximum FROM rollups "
+                "WHERE metric = ? AND resolution = ? AND bucket BETWEEN ? AND ? "
+                "ORDER BY bd_addr, bucket", (metric, resolution, start, end)):
+            result.setdefault(bd_addr, list()).append(tuple(row))
+        return result
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    import log_wrapper
+    log_wrapper.setup(__file__, console_level=logging.DEBUG)
+    # Daily summary of a store: python rollups.py logs/events.db [--rebuild]
+    store = EventStore(sys.argv[1] if len(sys.argv) > 1 else "logs/events.db")
+    engine = RollupEngine(store)
+    if "--rebuild" in sys.argv:
+        engine.rebuild()
+    else:
+        engine.update()
+    names = store.sensors()
+    for metric in (TEMPERATURE, BATTERY):
+        for (bd_addr, series) in engine.fleet(metric).items():
+            for (bucket, count, mean, minimum, maximum) in series:
+                logging.info(f"{bd_addr} {names.get(bd_addr, '')} {METRIC_NAMES[metric]} "
+                             f"{time.strftime('%d %b %y', time.gmtime(bucket))} "
+                             f"n={count} mean={mean:.2f} min={minimum:.2f} max={maximum:.2f}")
+    for metric in (MAGNET, MOVEMENT):
+        for (bd_addr, series) in engine.fleet(metric).items():
+            logging.info(f"{bd_addr} {names.get(bd_addr, '')} {METRIC_NAMES[metric]} "
+                         f"{sum(row[1] for row in series)} events")
+    store.close()
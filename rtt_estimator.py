@@ -0,0 +1,137 @@
+
+"""
+Round trip time estimation for command timeouts (TCP style SRTT/RTTVAR).
+
+The timeout of each command (JSON-RPC method or AT command) is
+SRTT + 4 * RTTVAR, limited to a per command minimum and a maximum.
+Until the first response is measured the initial timeout is used.
+Each timeout doubles the next timeout (up to the maximum) until a
+response is measured again.
+"""
+
+import threading
+
+ALPHA = 1 / 8
+BETA = 1 / 4
+K = 4
+MAX_BACKOFF = 8
+
+# Seconds - from response times in sample_logs (ackLog ~700 ms, connect ~3.2 s)
+JSON_MINIMUMS = {
+    "default": 0.5,
+    "prepareLog": 1.0,
+    "readLog": 1.0,
+    "ackLog": 1.5,
+    "dump": 1.0,
+}
+
+AT_MINIMUMS = {
+    "default": 0.25,
+    "AT+LSCN": 0.5,
+    "AT+LSCNX": 0.5,
+    # The dongle resets after ATZ and the next command is ATI
+    "ATZ": 1.0,
+    "ATI": 1.0,
+    "ATD": 4.0,
+}
+
+
+class RttEstimator:
+    def __init__(self, initial=1.0, minimum=0.2, maximum=10.0):
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.srtt = None
+        self.rttvar = None
+        self.backoff = 1
+        self.samples = 0
+        self.timeouts = 0
+
+    def sample(self, rtt: float) -> None:
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - BETA) * self.rttvar + BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - ALPHA) * self.srtt + ALPHA * rtt
+        self.backoff = 1
+        self.samples += 1
+
+    def timed_out(self) -> None:
+        self.backoff = min(self.backoff * 2, MAX_BACKOFF)
+        self.timeouts += 1
+
+    def timeout(self) -> float:
+        if self.srtt is None:
+            t = max(self.initial, self.minimum)
+        else:
+            t = max(self.srtt + K * self.rttvar, self.minimum)
+        return min(t * self.backoff, self.maximum)
+
+
+class RttTable:
+    """ An estimator for each command of a link """
+
+    def __init__(self, minimums: dict, initial=1.0, maximum=10.0):
+        self.minimums = dict(minimums)
+        self.initial = initial
+        self.maximum = maximum
+        self.estimators = dict()
+        self.lock = threading.Lock()
+
+    def set_minimums(self, minimums: dict) -> None:
+        """ Override minimums (from the configuration) """
+        with self.lock:
+            self.minimums.update(minimums)
+            for (k, e) in self.estimators.items():
+                e.minimum = self.minimums.get(k, self.minimums["default"])
+
+    def _get(self, key: str) -> RttEstimator:
+        e = self.estimators.get(key)
+        if e is None:
+            e = RttEstimator(self.initial, self.minimums.get(key, self.minimums["default"]), self.maximum)
+            self.estimators[key] = e
+        return e
+
+    def timeout(self, key: str, limit=None) -> float:
+        """
+        limit - a timeout given by the caller is used until the first response
+        is measured and is the maximum afterwards
+        """
+        with self.lock:
+            e = self._get(key)
+            if limit is None:
+                return e.timeout()
+            if e.srtt is None:
+                return limit
+            return min(e.timeout(), limit)
+
+    def sample(self, key: str, rtt: float) -> None:
+        with self.lock:
+            self._get(key).sample(rtt)
+
+    def timed_out(self, key: str) -> None:
+        with self.lock:
+            self._get(key).timed_out()
+
+    def stats(self) -> dict:
+        """ {key: (srtt, rttvar, timeout, samples, timeouts)} """
+        with self.lock:
+            return {k: (e.srtt, e.rttvar, e.timeout(), e.samples, e.timeouts)
+                    for (k, e) in self.estimators.items()}
+
+
+def at_command_name(cmd: str) -> str:
+    """ ATS 100=1 -> ATS, AT+LSCN 0,"Test",-128 -> AT+LSCN """
+    return cmd.split(' ', 1)[0].split('=', 1)[0].strip()
+
+
+if __name__ == "__main__":
+    table = RttTable(JSON_MINIMUMS, initial=2.0)
+    for rtt in (0.68, 0.72, 0.70, 0.75, 0.69):
+        table.sample("ackLog", rtt)
+    for rtt in (0.09, 0.11, 0.10):
+        table.sample("get", rtt)
+    table.timed_out("dump")
+    for (k, (srtt, rttvar, timeout, samples, timeouts)) in table.stats().items():
+        print(f"{k:10} srtt: {srtt} rttvar: {rttvar} timeout: {timeout:.3f}")
@@ -52,7 +52,12 @@ class ResetReason(IntEnum):
 
 
 class SensorEvent:
-    def __init__(self, buf=None):
+    # EventHistory that each new event is added to
+    history = None
+
+    def __init__(self, buf=None, history=None):
+        if history is not None:
+            self.history = history
         self.epoch = 0
         self.type = SensorEventType.RESERVED
         self.number = 0
@@ -113,6 +118,8 @@ class SensorEvent:
             except:
                 self.logger.debug("Sensor event type not valid")
 
+            if self.history is not None:
+                self.history.add(ap)
             return True
 
 
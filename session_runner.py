@@ -0,0 +1,168 @@
+
+"""
+Connect to a series of sensors without waiting for each one to advertise.
+
+Advertisements that arrive while a scan is running (including those received
+just before the scan is cancelled) are kept in a queue of pending targets.
+When a session with one sensor finishes, the next target is taken from the
+queue and connected to immediately. The dongle only scans again when the queue
+is empty.
+"""
+
+import time
+import logging
+from collections import OrderedDict
+from adv_parser import parse_scan
+
+# Targets whose last advertisement is older than this are rescanned
+MAX_TARGET_AGE_SECONDS = 60
+
+
+class SessionRunner:
+    def __init__(self, bt_module, name_to_look_for: str, select=None, max_age=MAX_TARGET_AGE_SECONDS,
+                 profile=None, inventory=None):
+        """
+        select(ap) - returns False for sensors that don't need a connection (yet)
+        profile - connection profile (dongle.BULK, QUICK, LOW_POWER) applied before connecting
+        inventory - only these sensors are connected to (run stops when each has had a session)
+        """
+        self.logger = logging.getLogger('SessionRunner')
+        self.bt_module = bt_module
+        self.name_to_look_for = name_to_look_for
+        self.select = select
+        self.max_age = max_age
+        self.profile = profile
+        self.inventory = inventory
+        # bd_addr -> most recent advertisement (in the order sensors were first seen)
+        self.pending = OrderedDict()
+        self.done = set()
+        self.scanning = False
+
+    def _add(self, ad) -> None:
+        ap = parse_scan(ad)
+        if ap is None or not ap.adv_valid or ap.bd_addr in self.done:
+            return
+        if self.inventory is not None and not self.inventory.expected(ap):
+            return
+        if self.select is not None and not self.select(ap):
+            # The latest advertisement decides (a sensor may no longer need a connection)
+            self.pending.pop(ap.bd_addr, None)
+            return
+        self.pending[ap.bd_addr] = ap
+
+    def _drain(self) -> None:
+        """ Move the advertisements that have already been received to the pending queue """
+        while True:
+            ad = self.bt_module.get_scan(timeout=0)
+            if ad is None:
+                return
+            self._add(ad)
+
+    def _pop(self):
+        """ The oldest pending target whose advertisement is recent """
+        now = time.time()
+        while self.pending:
+            bd_addr, ap = self.pending.popitem(last=False)
+            if now - ap.rx_epoch <= self.max_age:
+                return ap
+            self.logger.debug(f"Discarding stale target {bd_addr}")
+        return None
+
+    def _phase(self, name: str):
+        telemetry = getattr(self.bt_module, "telemetry", None)
+        return None if telemetry is None else telemetry.start(name)
+
+    def _phase_end(self, token, outcome="ok") -> None:
+        if token is not None:
+            self.bt_module.telemetry.stop(token, outcome)
+
+    def _scan(self) -> None:
+        if not self.scanning:
+            phase = self._phase("scan")
+            self.bt_module.scan(nameMatch=self.name_to_look_for)
+            self.scanning = True
+            self._phase_end(phase)
+
+    def _cancel_scan(self) -> None:
+        if self.scanning:
+            phase = self._phase("cancel_scan")
+            self.bt_module.cancel_scan()
+            self.scanning = False
+            # Advertisements received before the scan stopped are still targets
+            self._drain()
+            self._phase_end(phase)
+
+    def next_target(self, timeout=None):
+        """ The next sensor to connect to (None on timeout) """
+        self._drain()
+        ap = self._pop()
+        stop_time = None if timeout is None else time.time() + timeout
+        while ap is None:
+            self._scan()
+            remaining = None if stop_time is None else stop_time - time.time()
+            if remaining is not None and remaining <= 0:
+                return None
+            ad = self.bt_module.get_scan(timeout=remaining)
+            if ad is None:
+                continue
+            self._add(ad)
+            self._drain()
+            ap = self._pop()
+        return ap
+
+    def run(self, action, count=None, duration=None, description="") -> int:
+        """
+        Connect to each new sensor and call action(ap).
+        Stops after count sensors (runs indefinitely when count is None),
+        after duration seconds or when each sensor in the inventory had a session.
+        Returns the number of sessions.
+        """
+        sessions = 0
+        stop_time = None if duration is None else time.time() + duration
+        telemetry = getattr(self.bt_module, "telemetry", None)
+        while count is None or sessions < count:
+            if self.inventory is not None and self.inventory.complete():
+                break
+            timeout = None if stop_time is None else stop_time - time.time()
+            if timeout is not None and timeout <= 0:
+                break
+            wait = self._phase("wait")
+            ap = self.next_target(timeout)
+            if ap is None:
+                self._phase_end(wait, "timeout")
+                break
+            if telemetry is not None:
+                telemetry.begin(ap.bd_addr)
+            self._phase_end(wait)
+            self._cancel_scan()
+            logging.debug(description)
+            self.bt_module.allow_pairing()
+            self.bt_module.connect(ap.get_at_bd_addr(), self.bt_module.connection_timeout, self.profile)
+            outcome = "no_connection"
+            if self.bt_module.vspConnection:
+                phase = self._phase("action")
+                try:
+                    action(ap)
+                except:
+                    self._phase_end(phase, "error")
+                    if telemetry is not None:
+                        telemetry.end("error")
+                    raise
+                self._phase_end(phase)
+                phase = self._phase("disconnect")
+                self.bt_module.disconnect()
+                self._phase_end(phase, "ok" if self.bt_module.no_carrier.is_set() else "timeout")
+                self.done.add(ap.bd_addr)
+                self.pending.pop(ap.bd_addr, None)
+                if self.inventory is not None:
+                    self.inventory.see(ap)
+                sessions += 1
+                outcome = "ok"
+            if telemetry is not None:
+                telemetry.end(outcome)
+            self.logger.debug(f"{len(self.pending)} targets pending")
+
+        self._cancel_scan()
+        if self.inventory is not None:
+            self.inventory.log_result()
+        return sessions
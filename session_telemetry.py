@@ -0,0 +1,139 @@
+
+"""
+Timing of each phase of a sensor session.
+
+A record is written (JSON lines) for each phase: waiting for the advertisement,
+cancelling the scan, connecting, pairing, each JSON-RPC method, the session
+action (log download), disconnecting and restarting the scan.
+
+{"session": 3, "bd_addr": "c0ffee000001", "phase": "readLog", "start": 1603315200.5,
+ "seconds": 0.412, "outcome": "ok", "bytes": 1204, "retries": 0}
+
+The phase "session" covers the whole session. Durations are aggregated into
+percentiles for each phase (python session_telemetry.py logs/session_telemetry.jsonl).
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import logging
+from collections import defaultdict
+
+TELEMETRY_FILE = "logs/session_telemetry.jsonl"
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(values: list, p: int) -> float:
+    """ Nearest rank percentile of sorted values """
+    if not values:
+        return None
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def summarize(durations: dict) -> dict:
+    """ {phase: {"count": n, "p50": s, "p90": s, "p99": s, "max": s}} """
+    summary = dict()
+    for (phase, values) in durations.items():
+        values = sorted(values)
+        s = {"count": len(values)}
+        for p in PERCENTILES:
+            s[f"p{p}"] = percentile(values, p)
+        s["max"] = values[-1]
+        summary[phase] = s
+    return summary
+
+
+def format_summary(summary: dict) -> list:
+    return [f"{phase:12} n {s['count']:5} " + " ".join(f"p{p} {s[f'p{p}']:.3f}" for p in PERCENTILES) +
+            f" max {s['max']:.3f}" for (phase, s) in summary.items()]
+
+
+def read_durations(fname: str, bd_addr=None) -> dict:
+    """ Durations of each phase in a telemetry file (optionally for one sensor) """
+    durations = defaultdict(list)
+    with open(fname, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if bd_addr is None or record.get("bd_addr") == bd_addr:
+                durations[record["phase"]].append(record["seconds"])
+    return durations
+
+
+class SessionTelemetry:
+    def __init__(self, fname=TELEMETRY_FILE):
+        self.logger = logging.getLogger('SessionTelemetry')
+        directory = os.path.dirname(fname)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.fname = fname
+        self.file = open(fname, 'a')
+        # Total bytes sent and received by the transport (set by BL65x.set_telemetry)
+        self.byte_counter = None
+        self.sessions = 0
+        self.bd_addr = None
+        self.session = None
+        self.retries = 0
+        self.durations = defaultdict(list)
+
+    def _bytes(self) -> int:
+        return 0 if self.byte_counter is None else self.byte_counter()
+
+    def start(self, phase: str) -> tuple:
+        """ Token passed to stop when the phase ends """
+        return (phase, time.monotonic(), time.time(), self._bytes())
+
+    def stop(self, token: tuple, outcome="ok", retries=0) -> None:
+        (phase, start, epoch, count) = token
+        seconds = time.monotonic() - start
+        self.durations[phase].append(seconds)
+        record = {
+            "session": self.sessions if self.session is not None else None,
+            "bd_addr": self.bd_addr,
+            "phase": phase,
+            "start": round(epoch, 3),
+            "seconds": round(seconds, 6),
+            "outcome": outcome,
+            "bytes": self._bytes() - count,
+            "retries": retries}
+        self.file.write(json.dumps(record) + '\n')
+
+    def begin(self, bd_addr: str) -> None:
+        """ Phases are recorded for this sensor until end is called """
+        self.sessions += 1
+        self.bd_addr = bd_addr
+        self.session = self.start("session")
+        self.retries = 0
+
+    def retry(self) -> None:
+        """ Count a retry (pairing fallback, ...) in the current session """
+        if self.session is not None:
+            self.retries += 1
+
+    def end(self, outcome="ok") -> None:
+        if self.session is not None:
+            self.stop(self.session, outcome, self.retries)
+            self.file.flush()
+        self.session = None
+        self.bd_addr = None
+
+    def summary(self) -> dict:
+        return summarize(self.durations)
+
+    def log_summary(self) -> None:
+        for line in format_summary(self.summary()):
+            self.logger.info(line)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+if __name__ == "__main__":
+    fname = sys.argv[1] if len(sys.argv) > 1 else TELEMETRY_FILE
+    bd_addr = sys.argv[2] if len(sys.argv) > 2 else None
+    for line in format_summary(summarize(read_durations(fname, bd_addr))):
+        print(line)
@@ -0,0 +1,153 @@
+
+"""
+Report of the BT510s found by a scan (name, address, versions, reset count...).
+
+There is one row for each sensor (a dict keyed by address). A row is updated
+in place when a newer firmware version, reset count or configuration is
+advertised. The text report is written with a single write (every checkpoint
+seconds and when the report is closed) and can also be written as a
+spreadsheet (openpyxl write-only workbook with a filter on each column).
+"""
+
+import os
+import time
+import logging
+from adv_parser import parse_scan
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+COLUMN_LIST = "                   Name,        BD Addr,          Timestamp,  FW Version, BootVersion,   HW,  Reset Count, Config Version, Network ID\n"
+COLUMNS = ("Name", "BD Addr", "Timestamp", "FW Version", "BootVersion", "HW",
+           "Reset Count", "Config Version", "Network ID")
+TIMESTAMP_COLUMN = 2
+CHECKPOINT_SECONDS = 60
+
+
+def build_version_string(major: int, minor: int, build: int) -> str:
+    return str(major) + "." + str(minor) + "." + str(build)
+
+
+def report_row(ap) -> tuple:
+    local_time = time.strftime(
+        '%d %b %y %H:%M:%S', time.localtime(time.time()))
+    return (ap.name, f"0x{ap.bd_addr}", local_time,
+            build_version_string(ap.rsp.firmware_major_version, ap.rsp.firmware_minor_version,
+                                 ap.rsp.firmware_build_version),
+            build_version_string(ap.rsp.bootloader_major_version, ap.rsp.bootloader_minor_version,
+                                 ap.rsp.bootloader_build_version),
+            ap.unpack_hardware_version(),  # 12.4
+            ap.adv.reset_count,
+            ap.rsp.config_version,
+            ap.adv.network_id)
+
+
+def format_row(row: tuple) -> str:
+    (name, bd_addr, local_time, firmware, bootloader, hardware, reset_count, config_version, network_id) = row
+    return (f"{name:>23}, {bd_addr}, {local_time:>18}, {firmware:>11}, {bootloader:>11}, {hardware:>4}, "
+            f"{reset_count:>12}, {config_version:>14}, {network_id:>10}\n")
+
+
+def report_generator(ap) -> str:
+    return format_row(report_row(ap))
+
+
+def _without_timestamp(row: tuple) -> tuple:
+    return row[:TIMESTAMP_COLUMN] + row[TIMESTAMP_COLUMN + 1:]
+
+
+class SystemReport:
+    def __init__(self, fname: str, xlsx=None, checkpoint=CHECKPOINT_SECONDS):
+        """
+        fname - text report
+        xlsx - spreadsheet written when the report is closed (requires openpyxl)
+        """
+        self.logger = logging.getLogger('SystemReport')
+        if xlsx and openpyxl is None:
+            raise ImportError("openpyxl is required for the spreadsheet (pip install openpyxl)")
+        self.fname = fname
+        self.xlsx = xlsx
+        self.checkpoint = checkpoint
+        # bd_addr -> row
+        self.rows = dict()
+        self.updates = 0
+        self.last_change = time.time()
+        self.saved = time.time()
+
+    def add(self, ap) -> bool:
+        """ Add or update the row of a sensor. Returns True if the report changed. """
+        if not (ap.adv_valid and ap.rsp_valid and ap.rsp_has_versions):
+            return False
+        old = self.rows.get(ap.bd_addr)
+        row = report_row(ap)
+        if old is not None and _without_timestamp(old) == _without_timestamp(row):
+            return False
+        if old is None:
+            self.logger.info(f'Found new sensor "{ap.name}" with BDA: {ap.bd_addr}')
+        else:
+            self.updates += 1
+            self.logger.info(f'Updated sensor "{ap.name}" with BDA: {ap.bd_addr}')
+        self.logger.debug(format_row(row))
+        self.rows[ap.bd_addr] = row
+        self.last_change = time.time()
+        if self.last_change - self.saved >= self.checkpoint:
+            self.save()
+        return True
+
+    def sorted_rows(self) -> list:
+        return sorted(self.rows.values(), key=lambda row: (row[0], row[1]))
+
+    def save(self) -> None:
+        """ Write the text report (replaces the previous one) """
+        directory = os.path.dirname(self.fname)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        tmp = self.fname + ".tmp"
+        with open(tmp, 'w') as f:
+            f.write(COLUMN_LIST + "".join(format_row(row) for row in self.sorted_rows()))
+        os.replace(tmp, self.fname)
+        self.saved = time.time()
+
+    def save_xlsx(self, fname: str) -> None:
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet("BT510")
+        ws.freeze_panes = "A2"
+        ws.append(COLUMNS)
+        for row in self.sorted_rows():
+            ws.append(row)
+        ws.auto_filter.ref = f"A1:{chr(ord('A') + len(COLUMNS) - 1)}{len(self.rows) + 1}"
+        wb.save(fname)
+
+    def close(self) -> None:
+        self.save()
+        if self.xlsx:
+            self.save_xlsx(self.xlsx)
+        self.logger.info(f"{len(self.rows)} sensors ({self.updates} updates)")
+
+
+def scan_report(bt_module, name_to_look_for: str, duration: float, report: SystemReport, idle=None,
+                inventory=None) -> None:
+    """
+    Scan for duration seconds, until no sensor was added or updated
+    for idle seconds, or until every sensor in the inventory was found.
+    """
+    bt_module.scan(nameMatch=name_to_look_for)
+    stop_time = time.time() + duration
+    while True:
+        now = time.time()
+        if now >= stop_time:
+            break
+        if idle is not None and report.rows and now - report.last_change >= idle:
+            logging.info(f"No new sensors for {idle} seconds")
+            break
+        ap = parse_scan(bt_module.get_scan(timeout=min(stop_time - now, 1.0)))
+        if ap is not None:
+            report.add(ap)
+            if inventory is not None and ap.bd_addr in report.rows and inventory.see(ap):
+                if inventory.complete():
+                    break
+    bt_module.cancel_scan()
+    if inventory is not None:
+        inventory.log_result()
@@ -0,0 +1,101 @@
+import queue
+import pytest
+from adv_parser import ScanResult
+import threading
+from bounded_queue import BoundedQueue, BLOCK, DROP_OLDEST, COALESCE, COALESCE_DUPLICATES, \
+    ad_key, ad_duplicate_key
+
+
+def ad(sensor: int, record_number: int, rssi=-60) -> ScanResult:
+    return ScanResult(f"01C0FFEE00000{sensor}", rssi, bytes([sensor, record_number]))
+
+
+def drain(q) -> list:
+    items = list()
+    while not q.empty():
+        items.append(q.get_nowait())
+    return items
+
+
+def test_coalesce_keeps_latest_advertisement_of_a_sensor():
+    q = BoundedQueue(16, COALESCE, ad_key)
+    q.put(ad(1, 0))
+    q.put(ad(2, 0))
+    q.put(ad(1, 1))
+    q.put(ad(1, 2))
+    assert [a.data for a in drain(q)] == [bytes([1, 2]), bytes([2, 0])]
+    assert q.stats()["coalesced"] == 2
+
+
+def test_coalesce_duplicates_keeps_each_event_of_a_sensor():
+    q = BoundedQueue(16, COALESCE_DUPLICATES, ad_key, ad_duplicate_key)
+    for record_number in range(3):
+        q.put(ad(1, record_number))
+    assert [a.data for a in drain(q)] == [bytes([1, n]) for n in range(3)]
+    assert q.stats()["coalesced"] == 0
+
+
+def test_coalesce_duplicates_replaces_repeated_advertisement():
+    q = BoundedQueue(16, COALESCE_DUPLICATES, ad_key, ad_duplicate_key)
+    q.put(ad(1, 0, -70))
+    q.put(ad(2, 0))
+    q.put(ad(1, 0, -50))
+    items = drain(q)
+    assert [(a.address, a.rssi) for a in items] == [("01C0FFEE000001", -50), ("01C0FFEE000002", -60)]
+    assert q.stats()["coalesced"] == 1
+
+
+@pytest.mark.parametrize("policy", [DROP_OLDEST, COALESCE_DUPLICATES])
+def test_full_queue_drops_oldest(policy):
+    q = BoundedQueue(2, policy, ad_key, ad_duplicate_key)
+    for record_number in range(5):
+        q.put(ad(1, record_number))
+    assert [a.data for a in drain(q)] == [bytes([1, 3]), bytes([1, 4])]
+    assert q.stats()["dropped"] == 3
+
+
+@pytest.mark.parametrize("policy", [DROP_OLDEST, COALESCE, COALESCE_DUPLICATES])
+def test_join_after_dropped_and_coalesced_items(policy):
+    q = BoundedQueue(2, policy, ad_key, ad_duplicate_key)
+    for record_number in range(5):
+        q.put(ad(1, record_number))
+        q.put(ad(1, record_number))
+    while not q.empty():
+        q.get_nowait()
+        q.task_done()
+    t = threading.Thread(target=q.join)
+    t.start()
+    t.join(1)
+    assert not t.is_alive()
+
+
+def test_block():
+    q = BoundedQueue(1, BLOCK)
+    q.put(1)
+    with pytest.raises(queue.Full):
+        q.put(2, timeout=0.01)
+
+
+def test_configure_keeps_items():
+    q = BoundedQueue(4, DROP_OLDEST, ad_key, ad_duplicate_key)
+    q.put(ad(1, 0))
+    q.put(ad(1, 1))
+    q.configure(4, COALESCE_DUPLICATES)
+    q.put(ad(1, 1))
+    assert len(drain(q)) == 2
+
+
+def test_configure_coalesced_items_are_done():
+    q = BoundedQueue(4, DROP_OLDEST, ad_key, ad_duplicate_key)
+    q.put(ad(1, 0))
+    q.put(ad(1, 1))
+    q.configure(4, COALESCE)
+    assert [a.data for a in drain(q)] == [bytes([1, 1])]
+    assert q.unfinished_tasks == 1
+
+
+def test_dongle_ads_queue_drops_oldest():
+    dongle = pytest.importorskip("dongle")
+    protocol = dongle.BL65x(config=dict(bd_addrs=[""]))
+    protocol.stop()
+    assert protocol.ads.policy == DROP_OLDEST
@@ -0,0 +1,20 @@
+import pytest
+from adv_parser import AdvParser
+from bt510_emulator import SensorEmulator
+from sensor_event import SensorEvent, SensorEventType
+
+
+@pytest.mark.parametrize("event_count", [1, 10, 890])
+def test_event_count(event_count):
+    sensor = SensorEmulator("C0FFEE000001", event_count=event_count)
+    # Advertising doesn't add the samples that were missing from the history
+    sensor.advertisement()
+    assert len(sensor.events) == event_count
+
+
+def test_advertised_battery_voltage():
+    sensor = SensorEmulator("C0FFEE000001", event_count=10)
+    sensor.last_event = (sensor.epoch(), 2985, SensorEventType.BATTERY_GOOD)
+    event = SensorEvent()
+    assert event.update(AdvParser(sensor.advertisement()))
+    assert event.batteryVoltage == pytest.approx(2.98)
@@ -0,0 +1,58 @@
+import os
+import pytest
+from capture import CaptureRing, RECORD_SIZE, RX, TX
+
+
+def test_records_wrap(tmp_path):
+    ring = CaptureRing(str(tmp_path / "capture.bin"), capacity=100)
+    for n in range(20):
+        ring.record(RX if n % 2 == 0 else TX, bytes([n]) * 7)
+    records = ring.records()
+    assert ring.head > ring.capacity
+    assert records
+    assert [data for (_, _, data) in records] == [bytes([n]) * 7 for n in range(20 - len(records), 20)]
+    assert records[-1][1] == TX
+
+
+def test_existing_ring_is_continued(tmp_path):
+    fname = str(tmp_path / "capture.bin")
+    ring = CaptureRing(fname, capacity=1000)
+    ring.record(RX, b"AT\r")
+    ring.close()
+    ring = CaptureRing(fname)
+    ring.record(TX, b"OK\r")
+    assert [data for (_, _, data) in ring.records()] == [b"AT\r", b"OK\r"]
+    ring.close()
+    ring = CaptureRing(fname, readonly=True)
+    assert len(ring.records()) == 2
+    with pytest.raises(ValueError):
+        ring.record(RX, b"x")
+    ring.close()
+
+
+def test_chunk_larger_than_ring(tmp_path):
+    ring = CaptureRing(str(tmp_path / "capture.bin"), capacity=64)
+    # Split into records that fit in the ring
+    ring.record(RX, bytes(range(200)))
+    records = ring.records()
+    assert records[-1][2] == bytes(range(200))[-len(records[-1][2]):]
+    assert all(len(data) + RECORD_SIZE <= 64 for (_, _, data) in records)
+    with pytest.raises(ValueError):
+        ring._put(bytes(65))
+
+
+@pytest.mark.parametrize("readonly", [True, False])
+@pytest.mark.parametrize("content", [b"not a capture file\n" * 10, b"short"])
+def test_not_a_capture_file(tmp_path, readonly, content):
+    fname = tmp_path / "transcript.log"
+    fname.write_bytes(content)
+    with pytest.raises(ValueError):
+        CaptureRing(str(fname), readonly=readonly)
+    assert fname.read_bytes() == content
+
+
+def test_missing_file_isnt_created_by_readers(tmp_path):
+    fname = tmp_path / "missing.bin"
+    with pytest.raises(IOError):
+        CaptureRing(str(fname), readonly=True)
+    assert not os.path.exists(fname)
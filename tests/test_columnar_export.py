@@ -0,0 +1,51 @@
+import struct
+import pytest
+from event_log import FOB_EVENT_FORMAT
+from sensor_event import SensorEventType
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+from columnar_export import LogWriter, AdvertisementWriter  # noqa: E402
+from adv_parser import AdvParser  # noqa: E402
+from bt510_emulator import build_fleet  # noqa: E402
+
+TIMESTAMP = 1603315200
+
+
+def read(fname: str):
+    if fname.endswith(".arrow"):
+        return pa.ipc.open_file(fname).read_all()
+    return pq.read_table(fname)
+
+
+def log_events(count: int) -> bytes:
+    return b"".join(struct.pack(FOB_EVENT_FORMAT, TIMESTAMP + n, 2000 + n, int(SensorEventType.TEMPERATURE), n)
+                    for n in range(count))
+
+
+@pytest.mark.parametrize("suffix", [".arrow", ".parquet"])
+def test_log_batches_add_sensors(tmp_path, suffix):
+    fname = str(tmp_path / ("events" + suffix))
+    # Each write is flushed as a batch that adds a sensor to the dictionaries
+    with LogWriter(fname, row_group_size=2) as writer:
+        for n in range(3):
+            writer.write(f"Test-{n:02d}", f"C0FFEE00000{n}", log_events(3))
+    table = read(fname)
+    assert table.num_rows == 9
+    assert table.column("sensor").to_pylist() == [f"Test-{n:02d}" for n in range(3) for _ in range(3)]
+    assert table.column("bd_addr").to_pylist()[-1] == "c0ffee000002"
+    assert table.column("value").to_pylist()[:3] == [20.0, 20.01, 20.02]
+
+
+@pytest.mark.parametrize("suffix", [".arrow", ".parquet"])
+def test_advertisement_batches(tmp_path, suffix):
+    fname = str(tmp_path / ("ads" + suffix))
+    fleet = build_fleet(3, event_count=10)
+    parsed = [AdvParser(sensor.advertisement()) for sensor in fleet.values()]
+    with AdvertisementWriter(fname, row_group_size=2) as writer:
+        for ap in parsed:
+            writer.add(ap, -60)
+    table = read(fname)
+    assert table.column("sensor").to_pylist() == ["Test-00", "Test-01", "Test-02"]
+    assert table.column("payload").to_pylist() == [ap.adv.payload for ap in parsed]
+    assert table.column("rssi").to_pylist() == [-60] * 3
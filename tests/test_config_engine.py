@@ -0,0 +1,11 @@
+from config_engine import ConfigEngine
+
+
+def test_reboot_only_for_reset_attributes(tmp_path):
+    engine = ConfigEngine({"sensorName": "Test-01", "temperatureSenseInterval": 60},
+                          state_file=str(tmp_path / "state.json"))
+    changes = engine.diff({"sensorName": "BT510", "temperatureSenseInterval": 60,
+                           "firmwareVersion": "4.1.0"})
+    assert changes == {"sensorName": "Test-01", "configVersion": engine.version}
+    assert engine.requires_reboot(changes)
+    assert not engine.requires_reboot({"temperatureSenseInterval": 120})
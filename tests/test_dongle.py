@@ -0,0 +1,14 @@
+from dongle import BL65x
+
+
+def test_discard_buffer_drops_partial_line():
+    protocol = BL65x(config=dict(bd_addrs=[""]))
+    try:
+        # Received at the previous baud rate
+        protocol.data_received(b'\x8f\xfe')
+        protocol.discard_buffer = True
+        protocol.data_received(b'OK\r')
+        assert protocol.responses.get(timeout=1) == "OK"
+        assert not protocol.discard_buffer
+    finally:
+        protocol.stop()
@@ -0,0 +1,54 @@
+import pytest
+from adv_parser import AdvParser
+from bt510_emulator import build_fleet
+from event_history import SensorHistory, open_history
+from sensor_event import SensorEvent, SensorEventType
+
+TIMESTAMP = 1603315200
+
+
+def history(epochs: list, capacity=8) -> SensorHistory:
+    h = SensorHistory(capacity)
+    for (n, epoch) in enumerate(epochs):
+        h.add(epoch, 1, n, float(n), -60)
+    return h
+
+
+def test_since_newest_samples_are_views():
+    h = history([100, 200, 300, 400])
+    w = h.since(250)
+    assert list(w["epoch"]) == [300, 400]
+    assert w["epoch"].obj is h.columns["epoch"]
+
+
+def test_since_after_clock_reset():
+    # The sensor clock was reset after the second sample
+    h = history([1000, 1100, 5, 65, 1200])
+    assert list(h.since(1050)["epoch"]) == [1100, 1200]
+    assert list(h.since(1050)["record_number"]) == [1, 4]
+    assert list(h.since(0)["epoch"]) == [1000, 1100, 5, 65, 1200]
+    assert list(h.since(2000)["epoch"]) == []
+
+
+def test_since_after_wrap():
+    h = history(list(range(100, 1300, 100)), capacity=4)
+    assert list(h.since(950)["epoch"]) == [1000, 1100, 1200]
+
+
+def test_sensor_event_updates_history():
+    fleet = build_fleet(2, event_count=10)
+    history = open_history({"event_history_samples": 8})
+    events = {bd_addr: SensorEvent(history=history) for bd_addr in fleet}
+    for n in range(3):
+        for (bd_addr, sensor) in fleet.items():
+            sensor.record_number = 100 + n
+            sensor.last_event = (TIMESTAMP + 300 * n, 2000 + n, SensorEventType.TEMPERATURE)
+            ap = AdvParser(sensor.advertisement())
+            assert events[bd_addr].update(ap)
+            # The same advertisement again isn't a new sample
+            assert not events[bd_addr].update(ap)
+    w = history.window("c0ffee000001", 400, TIMESTAMP + 600)
+    assert list(w["record_number"]) == [101, 102]
+    assert list(w["value"]) == pytest.approx([20.01, 20.02])
+    assert len(history.sensors) == 2
+    assert open_history({}) is None
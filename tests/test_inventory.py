@@ -0,0 +1,52 @@
+import pytest
+from types import SimpleNamespace
+from inventory import Inventory, normalize_address, open_inventory
+
+
+def ad(bd_addr: str, name: str):
+    return SimpleNamespace(bd_addr=bd_addr, name=name)
+
+
+def test_normalize_address():
+    assert normalize_address("01C13A7E4118A2") == "c13a7e4118a2"
+    assert normalize_address("0xc13a7e4118a2") == "c13a7e4118a2"
+    assert normalize_address("C13A7E4118A2") == "c13a7e4118a2"
+
+
+def test_addresses():
+    inventory = Inventory(bd_addrs=["01C0FFEE000001", "c0ffee000002"])
+    assert not inventory.see(ad("c0ffee000003", "Test-03"))
+    assert inventory.see(ad("c0ffee000001", "Test-01"))
+    assert not inventory.see(ad("c0ffee000001", "Test-01"))
+    assert inventory.missing() == ["c0ffee000002"]
+    assert inventory.see(ad("c0ffee000002", "Test-02"))
+    assert inventory.complete()
+
+
+def test_names():
+    inventory = Inventory(names=["Test-01", "Test-02"])
+    assert inventory.see(ad("c0ffee000001", "Test-01"))
+    # A second sensor with the same name isn't counted
+    assert not inventory.see(ad("c0ffee000009", "Test-01"))
+    assert not inventory.complete()
+    assert inventory.missing() == ["Test-02"]
+
+
+def test_prefix():
+    inventory = Inventory(prefix="Test-", count=2)
+    assert not inventory.see(ad("c0ffee000001", "Other"))
+    assert inventory.see(ad("c0ffee000001", "Test-01"))
+    assert inventory.missing() == ["1 of 2 sensors named Test-*"]
+    assert inventory.see(ad("c0ffee000002", "Test-02"))
+    assert not inventory.see(ad("c0ffee000003", "Test-03"))
+    assert inventory.complete()
+    assert inventory.missing() == []
+
+
+def test_invalid():
+    with pytest.raises(ValueError):
+        Inventory()
+    with pytest.raises(ValueError):
+        Inventory(prefix="Test-")
+    assert open_inventory({}) is None
+    assert open_inventory({"inventory": {"names": ["Test-01"]}}).names == {"Test-01"}
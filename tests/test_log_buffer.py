@@ -0,0 +1,34 @@
+from dongle import BL65x
+from log_buffer import LogBuffer, decode_read_log
+
+PACKET = b'{"jsonrpc": "2.0", "id": 2, "result": [16, "ZwLJXRIIAQDLAsldEAgBAA=="]}'
+EVENTS = bytes.fromhex("6702c95d12080100cb02c95d10080100")
+
+
+def test_decode_read_log():
+    lb = LogBuffer(2)
+    response = decode_read_log(PACKET, lb)
+    assert response["id"] == 2
+    assert response["result"][0] == 16
+    assert bytes(response["result"][1]) == EVENTS
+    # The serial transport passes text
+    assert decode_read_log(PACKET.decode(), lb)["result"][0] == 16
+    assert bytes(lb.events()) == EVENTS * 2
+    assert decode_read_log(b'{"jsonrpc": "2.0", "id": 3, "result": 16}', lb) is None
+    assert decode_read_log(b'{"jsonrpc": "2.0", "id": 3, "result": [15, "ZwLJ"]}', lb) is None
+
+
+def test_dongle_decodes_into_log_buffer():
+    protocol = BL65x(config=dict(bd_addrs=[""]))
+    try:
+        lb = LogBuffer(2)
+        protocol.set_log_buffer(lb)
+        for n in range(0, len(PACKET), 10):
+            protocol.data_received(PACKET[n:n + 10])
+        response = protocol.json_packets.get(timeout=1)
+        assert bytes(response["result"][1]) == EVENTS
+        assert response["result"][1].obj is lb.buf
+        protocol.data_received(b'{"jsonrpc": "2.0", "id": 3, "result": 16}')
+        assert protocol.json_packets.get(timeout=1)["result"] == 16
+    finally:
+        protocol.stop()
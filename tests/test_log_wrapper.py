@@ -0,0 +1,28 @@
+import logging
+import log_wrapper
+
+
+def test_setup_twice_logs_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(log_wrapper, "configured", False)
+    root = logging.getLogger('')
+    handlers = list(root.handlers)
+    level = root.level
+    try:
+        log_wrapper.setup("test_setup.py", console_level=logging.CRITICAL)
+        log_wrapper.setup("test_setup.py", console_level=logging.CRITICAL)
+        args = {"count": 1}
+        logging.info("args %s", args)
+        args["count"] = 2
+        for h in root.handlers:
+            h.flush()
+    finally:
+        for h in root.handlers:
+            if h not in handlers:
+                root.removeHandler(h)
+                h.close()
+        root.setLevel(level)
+    with open(tmp_path / "logs" / "test_setup.transcript.log") as f:
+        lines = f.readlines()
+    assert len(lines) == 1
+    assert lines[0].endswith("args {'count': 1}\n")
@@ -0,0 +1,29 @@
+import os
+from reingest_transcripts import process_file, parse_transcript, Session
+from event_log import SIZE_OF_EVENT
+
+SAMPLE = os.path.join(os.path.dirname(__file__), "..", "sample_logs", "example_read_logs_Test-12.transcript.log")
+
+
+def test_unacked_chunk_is_discarded():
+    session = Session("dd353ac041bb")
+    session.read((SIZE_OF_EVENT, "AAAA"))
+    session.acked(1)
+    session.read((SIZE_OF_EVENT, "BBBB"))
+    session.close(include_unacked=False)
+    assert session.chunks == [(SIZE_OF_EVENT, "AAAA")]
+    assert session.discarded == 1
+
+
+def test_sample_transcript():
+    sessions, names = parse_transcript(SAMPLE)
+    assert [s.bd_addr for s in sessions] == ["dd353ac041bb"]
+    result = process_file(SAMPLE)
+    [(bd_addr, name, data)] = result["sessions"]
+    assert bd_addr == "dd353ac041bb"
+    assert len(data) == 890 * SIZE_OF_EVENT
+
+
+def test_text_output(tmp_path):
+    process_file(SAMPLE, text_directory=str(tmp_path))
+    assert os.listdir(str(tmp_path)) == ["example_read_logs_Test-12_0_dd353ac041bb_890.sensor_events.log"]
@@ -0,0 +1,59 @@
+import struct
+from types import SimpleNamespace
+from event_log import FOB_EVENT_FORMAT
+from event_store import EventStore
+from rollups import RollupEngine, TEMPERATURE, BATTERY, MINUTE
+from sensor_event import SensorEventType
+
+BD_ADDR = "c0ffee000001"
+TIMESTAMP = 1603315200
+
+
+def advertisement(epoch: int, record_number: int, event_type: int, payload: int):
+    adv = SimpleNamespace(epoch=epoch, record_number=record_number, record_type=int(event_type), payload=payload)
+    return SimpleNamespace(adv_valid=True, bd_addr=BD_ADDR, name="Test-01", adv=adv)
+
+
+def log_events(*events) -> bytes:
+    """ (timestamp, event_type, data) -> raw log bytes """
+    return b"".join(struct.pack(FOB_EVENT_FORMAT, timestamp, data, int(event_type), salt)
+                    for (salt, (timestamp, event_type, data)) in enumerate(events))
+
+
+def rollup_store(tmp_path):
+    store = EventStore(str(tmp_path / "events.db"), batch_size=1)
+    return store, RollupEngine(store)
+
+
+def counts(engine, metric) -> int:
+    return sum(row[1] for row in engine.series(BD_ADDR, metric, MINUTE))
+
+
+def test_event_in_advertisement_and_log_is_counted_once(tmp_path):
+    store, engine = rollup_store(tmp_path)
+    # Battery in 10 mV in advertisements and mV in the log, temperature as a 32 bit advertisement payload
+    store.ingest_advertisement(advertisement(TIMESTAMP, 1, SensorEventType.BATTERY_GOOD, 298))
+    store.ingest_advertisement(advertisement(TIMESTAMP + 60, 2, SensorEventType.TEMPERATURE, 0xFFFFF830))
+    store.ingest_log(BD_ADDR, log_events((TIMESTAMP, SensorEventType.BATTERY_GOOD, 2985),
+                                         (TIMESTAMP + 60, SensorEventType.TEMPERATURE, 0xF830)))
+    assert counts(engine, BATTERY) == 1
+    assert counts(engine, TEMPERATURE) == 1
+    assert engine.series(BD_ADDR, TEMPERATURE, MINUTE)[0][2] == -20.0
+    # Rebuilding gives the same result
+    engine.rebuild()
+    assert counts(engine, BATTERY) == 1
+    assert counts(engine, TEMPERATURE) == 1
+    store.close()
+
+
+def test_different_readings_are_counted(tmp_path):
+    store, engine = rollup_store(tmp_path)
+    store.ingest_advertisement(advertisement(TIMESTAMP, 1, SensorEventType.BATTERY_GOOD, 290))
+    store.ingest_advertisement(advertisement(TIMESTAMP, 2, SensorEventType.TEMPERATURE, 2100))
+    store.ingest_log(BD_ADDR, log_events((TIMESTAMP, SensorEventType.BATTERY_GOOD, 2985),
+                                         (TIMESTAMP, SensorEventType.TEMPERATURE, 2200),
+                                         (TIMESTAMP, SensorEventType.TEMPERATURE, 2200)))
+    assert counts(engine, BATTERY) == 2
+    # The log events have different salts
+    assert counts(engine, TEMPERATURE) == 3
+    store.close()
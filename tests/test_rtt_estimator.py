@@ -0,0 +1,43 @@
+from rtt_estimator import RttTable, RttEstimator, JSON_MINIMUMS, at_command_name
+
+
+def test_initial_timeout_until_first_sample():
+    table = RttTable(JSON_MINIMUMS, initial=2.0)
+    assert table.timeout("get") == 2.0
+    table.sample("get", 0.1)
+    # srtt + 4 * rttvar is below the minimum
+    assert table.timeout("get") == JSON_MINIMUMS["default"]
+
+
+def test_limit_is_used_until_first_sample():
+    table = RttTable(JSON_MINIMUMS, initial=2.0)
+    assert table.timeout("ackLog", limit=10) == 10
+    table.sample("ackLog", 0.7)
+    assert table.timeout("ackLog", limit=10) < 10
+    assert table.timeout("ackLog", limit=1.0) == 1.0
+
+
+def test_backoff_is_reset_by_a_sample():
+    e = RttEstimator(initial=1.0, minimum=0.2, maximum=10.0)
+    e.sample(1.0)
+    timeout = e.timeout()
+    e.timed_out()
+    assert e.timeout() == 2 * timeout
+    for _ in range(10):
+        e.timed_out()
+    assert e.timeout() == 10.0
+    e.sample(1.0)
+    assert e.backoff == 1
+
+
+def test_set_minimums_updates_estimators():
+    table = RttTable(JSON_MINIMUMS)
+    table.sample("dump", 0.01)
+    table.set_minimums({"dump": 3.0})
+    assert table.timeout("dump") == 3.0
+
+
+def test_at_command_name():
+    assert at_command_name("ATS 100=1") == "ATS"
+    assert at_command_name('AT+LSCN 0,"Test",-128') == "AT+LSCN"
+    assert at_command_name("ATD 01C0FFEE000001") == "ATD"
@@ -0,0 +1,27 @@
+import pytest
+from dongle import scan_result
+
+DATA = "0201061BFF7700010000000780E61CBB0C45CA01B602A5ABA95FCA0800000210FFE4"
+
+
+@pytest.mark.parametrize("line", [
+    f'AD 01CA450CBB1CE6 -54 "{DATA}"'.encode(),
+    # Other spacing and AD variants are split into tokens
+    f'AD  01CA450CBB1CE6  -54 "{DATA}"'.encode(),
+    f'ADV 01CA450CBB1CE6 -54 "{DATA}"'.encode(),
+])
+def test_scan_result(line):
+    ad = scan_result(line)
+    assert ad.address == "01CA450CBB1CE6"
+    assert ad.rssi == -54
+    assert ad.data == bytes.fromhex(DATA)
+
+
+@pytest.mark.parametrize("line", [
+    b'AD 01CA450CBB1CEX -54 "0201"',
+    b'AD 01CA450CBB1CE6 -54 "020"',
+    b'AD 01CA450CBB1CE6 "0201"',
+    b'AD',
+])
+def test_malformed_scan_result(line):
+    assert scan_result(line) is None
@@ -0,0 +1,21 @@
+from adv_parser import AdvParser
+from bt510_emulator import SensorEmulator
+from system_report import SystemReport, COLUMN_LIST
+
+
+def test_add_updates_row_in_place(tmp_path):
+    report = SystemReport(str(tmp_path / "report.txt"))
+    sensor = SensorEmulator("C0FFEE000001", "Test-01", event_count=0)
+    assert report.add(AdvParser(sensor.advertisement()))
+    # The same versions again (only the timestamp can differ)
+    assert not report.add(AdvParser(sensor.advertisement()))
+    sensor.attributes["resetCount"] += 1
+    assert report.add(AdvParser(sensor.advertisement()))
+    assert len(report.rows) == 1
+    assert report.updates == 1
+    report.add(AdvParser(SensorEmulator("C0FFEE000002", "Test-00", event_count=0).advertisement()))
+    report.close()
+    with open(report.fname) as f:
+        lines = f.readlines()
+    assert lines[0] == COLUMN_LIST
+    assert [line.split(',')[0].strip() for line in lines[1:]] == ["Test-00", "Test-01"]